@@ -1,7 +1,7 @@
 # agent_backend.py
 
 import os
-from typing import TypedDict, Optional, List, Dict, Any
+from typing import TypedDict, Optional, List, Dict, Any, Iterator, AsyncIterator
 from langgraph.graph import StateGraph, END
 from openai import AzureOpenAI
 from dotenv import load_dotenv
@@ -28,55 +28,146 @@ client = AzureOpenAI(
 class AgentState(TypedDict, total=False):
     user_input: str
     next: str
+    route_tier: Optional[str]  # which router tier decided: rules, classifier or llm
+    cache_hit: Optional[str]  # response cache namespace that answered the turn, if any
     response: str
     topic: Optional[str]
     docs: Optional[List[Dict[str, Any]]]
-    chat_history: List[Dict[str, str]]  # Added chat memory
+    passages: Optional[List[Dict[str, Any]]]  # packed chunks a grounded answer cites
+    retrieval_skipped: Optional[bool]  # the store was loading or retrieval failed; the reply is not cached
+    chat_history: List[Dict[str, str]]  # Added chat memory; the most recent turns, verbatim
+    summary: Optional[str]  # rolling summary of the turns folded out of chat_history
+    token_usage: Optional[Dict[str, int]]  # memory and prompt token counts of the turn
 
 # Import logic nodes
 from nodetest import (
-    router_node, chat_node, extract_topic_node,
-    search_index_node, format_results_node, final_output_node
+    cache_lookup_node, route_and_extract_node, chat_node, extract_topic_node,
+    search_index_node, format_results_node, final_output_node,
+    acache_lookup_node, aroute_and_extract_node, achat_node, aextract_topic_node,
+    asearch_index_node, aformat_results_node, afinal_output_node,
+    retrieve_context_node, qa_node, aretrieve_context_node, aqa_node
 )
+from langchain_core.runnables import RunnableLambda
+from conversation_store import make_checkpointer, session_config, DEFAULT_SESSION
+
+# Each node runs its sync version under invoke and its async version under ainvoke
+def node(func, afunc=None):
+    return RunnableLambda(func, afunc=afunc, name=func.__name__)
 
 # Build LangGraph agent
 def build_agent():
     workflow = StateGraph(AgentState)
-    workflow.add_node("router", router_node)
-    workflow.add_node("chat_node", chat_node)
-    workflow.add_node("extract_topic", extract_topic_node)
-    workflow.add_node("search_index", search_index_node)
-    workflow.add_node("format_results", format_results_node)
-    workflow.add_node("final_output_node", final_output_node)
+    workflow.add_node("cache_lookup", node(cache_lookup_node, acache_lookup_node))
+    # Routing and topic extraction share one LLM call when the LLM has to decide
+    workflow.add_node("router", node(route_and_extract_node, aroute_and_extract_node))
+    workflow.add_node("retrieve_context", node(retrieve_context_node, aretrieve_context_node))
+    workflow.add_node("qa_node", node(qa_node, aqa_node))
+    workflow.add_node("chat_node", node(chat_node, achat_node))
+    workflow.add_node("extract_topic", node(extract_topic_node, aextract_topic_node))
+    workflow.add_node("search_index", node(search_index_node, asearch_index_node))
+    workflow.add_node("format_results", node(format_results_node, aformat_results_node))
+    workflow.add_node("final_output_node", node(final_output_node, afinal_output_node))
+
+    workflow.set_entry_point("cache_lookup")
 
-    workflow.set_entry_point("router")
+    # Cached answers skip routing, the LLM and the search call entirely
+    workflow.add_conditional_edges("cache_lookup", lambda x: x["next"],
+        {
+            "router": "router",
+            "format_results": "format_results",
+            "final_output_node": "final_output_node",
+        }
+    )
 
+    # Chat turns first look for passages in the local vector store to ground the answer on
     workflow.add_conditional_edges("router", lambda x: x["next"],
         {
-            "chat_node": "chat_node",
+            "chat_node": "retrieve_context",
             "extract_topic": "extract_topic",
+            "search_index": "search_index",
+        }
+    )
+
+    workflow.add_conditional_edges("retrieve_context", lambda x: x["next"],
+        {
+            "qa_node": "qa_node",
+            "chat_node": "chat_node",
         }
     )
 
     workflow.add_edge("extract_topic", "search_index")
     workflow.add_edge("search_index", "format_results")
     workflow.add_edge("chat_node", "final_output_node")
+    workflow.add_edge("qa_node", "final_output_node")
     workflow.add_edge("format_results", "final_output_node")
     workflow.add_edge("final_output_node", END)
 
-    return workflow.compile()
+    # The checkpointer keeps each session's state, chat_history included, between turns
+    return workflow.compile(checkpointer=make_checkpointer())
 
 # Compile agent once
 _agent = build_agent()
 
+# Fields of the previous turn that must not leak into the next one; chat_history carries over
+def turn_input(user_input: str) -> Dict[str, Any]:
+    return {
+        "user_input": user_input,
+        "next": None,
+        "route_tier": None,
+        "cache_hit": None,
+        "response": None,
+        "topic": None,
+        "docs": None,
+        "passages": None,
+        "retrieval_skipped": None,
+        "token_usage": None
+    }
+
 # Public function to use in UI
-chat_history: List[Dict[str,str]] = []
+def run_agent(user_input: str, session_id: str = DEFAULT_SESSION) -> str:
+    result = _agent.invoke(turn_input(user_input), session_config(session_id))
+    return result["response"]
 
-def run_agent(user_input: str) -> str:
-    global chat_history
-    result = _agent.invoke({
-        "user_input": user_input,
-        "chat_history": chat_history
-    })
-    chat_history = result.get("chat_history", [])
-    return result["response"]
\ No newline at end of file
+async def arun_agent(user_input: str, session_id: str = DEFAULT_SESSION) -> str:
+    """Async run_agent for event-loop callers such as Chainlit; LLM and search calls are awaited."""
+    result = await _agent.ainvoke(turn_input(user_input), session_config(session_id))
+    return result["response"]
+
+# Nodes whose LLM output is the reply itself, so their tokens are streamed to the user
+STREAM_NODES = ("chat_node", "qa_node")
+
+# The part of the final response the stream has not shown, such as a grounded answer's sources
+def unstreamed(response: str, streamed: str) -> str:
+    if streamed and response.startswith(streamed):
+        return response[len(streamed):]
+    return "" if streamed else response
+
+def stream_agent(user_input: str, session_id: str = DEFAULT_SESSION) -> Iterator[str]:
+    """Yield the reply as it is generated; replies that are not streamed come as one piece."""
+    config = session_config(session_id)
+    streamed = ""
+    for chunk, metadata in _agent.stream(turn_input(user_input), config, stream_mode="messages"):
+        if metadata.get("langgraph_node") in STREAM_NODES and chunk.content:
+            streamed += chunk.content
+            yield chunk.content
+    rest = unstreamed(_agent.get_state(config).values.get("response") or "", streamed)
+    if rest:
+        yield rest
+
+async def astream_agent(user_input: str, session_id: str = DEFAULT_SESSION) -> AsyncIterator[str]:
+    """Async stream_agent, on astream_events."""
+    config = session_config(session_id)
+    streamed = ""
+    async for event in _agent.astream_events(turn_input(user_input), config, version="v2"):
+        if event["event"] != "on_chat_model_stream":
+            continue
+        if event.get("metadata", {}).get("langgraph_node") in STREAM_NODES and event["data"]["chunk"].content:
+            streamed += event["data"]["chunk"].content
+            yield event["data"]["chunk"].content
+    rest = unstreamed((await _agent.aget_state(config)).values.get("response") or "", streamed)
+    if rest:
+        yield rest
+
+def get_token_usage(session_id: str = DEFAULT_SESSION) -> Optional[Dict[str, int]]:
+    """Memory and prompt token counts of the session's last turn."""
+    return _agent.get_state(session_config(session_id)).values.get("token_usage")
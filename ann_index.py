@@ -0,0 +1,377 @@
+import os
+import json
+import time
+import shutil
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from vector_store import VectorStore
+
+ANN_DIR_NAME = "ann"
+
+# search_unique widens until it has re-ranked this many times ``rerank`` rows; past
+# that, exact re-ranking row by row costs more than an exact scan of the corpus
+UNIQUE_MAX_RERANK_FACTOR = 4
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.where(norms > 0, norms, 1.0)
+
+
+def nearest_centroids(x: np.ndarray, centroids: np.ndarray, block: int = 8192) -> np.ndarray:
+    """Index of the nearest centroid (L2) for every row of x."""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assign = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), block):
+        part = x[start:start + block]
+        distances = centroid_norms[None, :] - 2 * part @ centroids.T
+        assign[start:start + block] = np.argmin(distances, axis=1)
+    return assign
+
+
+def kmeans(x: np.ndarray, k: int, iters: int = 20, seed: int = 0) -> np.ndarray:
+    """Plain Lloyd's k-means; empty clusters are re-seeded from random points."""
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float32)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iters):
+        assign = nearest_centroids(x, centroids)
+        order = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=k)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        sums = np.add.reduceat(x[order], starts, axis=0)
+        centroids[nonempty] = sums / counts[nonempty, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = x[rng.choice(len(x), len(empty), replace=False)]
+    return centroids
+
+
+def _live_rows(segments) -> List[np.ndarray]:
+    rows = []
+    for segment in segments:
+        mask = segment.live_mask()
+        rows.append(np.arange(segment.count) if mask is None else np.flatnonzero(mask))
+    return rows
+
+
+class IVFPQIndex:
+    """Inverted-file index with product quantization over a VectorStore.
+
+    Vectors are L2-normalized, assigned to one of ``nlist`` coarse clusters
+    and their residuals compressed to ``m`` one-byte codes. A query scans the
+    ``nprobe`` nearest clusters with per-cluster lookup tables, then re-ranks
+    the best ``rerank`` candidates exactly against the memory-mapped store.
+    Raising nprobe or rerank trades latency for recall.
+
+    The index lives in ``<store>/ann/`` and is tied to the store version it
+    was built from; a stale index is reported by ``is_current``.
+    """
+
+    def __init__(self, store: VectorStore, nprobe: int = 16, rerank: int = 100):
+        self.store = store
+        self.path = os.path.join(store.root, ANN_DIR_NAME)
+        self.nprobe = nprobe
+        self.rerank = rerank
+        with open(os.path.join(self.path, "meta.json"), 'r') as f:
+            self.meta = json.load(f)
+        self.store_version = self.meta['store_version']
+        self.blob_names = [tuple(key) for key in self.meta['blob_names']]
+        self.centroids = np.load(os.path.join(self.path, "centroids.npy"))
+        self.codebooks = np.load(os.path.join(self.path, "codebooks.npy"))
+        self.offsets = np.load(os.path.join(self.path, "offsets.npy"))
+        self.codes = np.load(os.path.join(self.path, "codes.npy"), mmap_mode='r')
+        self.segment_ids = np.load(os.path.join(self.path, "segment_ids.npy"), mmap_mode='r')
+        self.rows = np.load(os.path.join(self.path, "rows.npy"), mmap_mode='r')
+        self.blob_ids = np.load(os.path.join(self.path, "blob_ids.npy"), mmap_mode='r')
+        self.segments = store.open_segments(self._manifest_at_build())
+        self._centroid_norms = (self.centroids ** 2).sum(axis=1)
+        self._codebook_norms = (self.codebooks ** 2).sum(axis=2)
+
+    def _manifest_at_build(self) -> Dict:
+        manifest = self.store.read_manifest()
+        if manifest['version'] != self.store_version:
+            # Segments may be gone; only open those listed when the index was built
+            ids = set(self.meta['segment_ids'])
+            manifest['segments'] = [info for info in manifest['segments'] if info['id'] in ids]
+        return manifest
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def is_current(self) -> bool:
+        return self.store.version() == self.store_version
+
+    @classmethod
+    def exists(cls, store: VectorStore) -> bool:
+        return os.path.exists(os.path.join(store.root, ANN_DIR_NAME, "meta.json"))
+
+    @classmethod
+    def meta_stamp(cls, store: VectorStore) -> Optional[Tuple[int, int]]:
+        """(mtime_ns, size) of the index's meta.json, or None; changes when the index is (re)built."""
+        try:
+            stat = os.stat(os.path.join(store.root, ANN_DIR_NAME, "meta.json"))
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @classmethod
+    def build(cls, store: VectorStore, nlist: Optional[int] = None, m: int = 64, nbits: int = 8,
+              train_size: int = 100000, iters: int = 20, trained: Optional['IVFPQIndex'] = None,
+              batch_rows: int = 50000, seed: int = 0) -> Optional['IVFPQIndex']:
+        """Train (or reuse ``trained``'s quantizers) and encode every live row.
+
+        Rows are read from the memory-mapped segments in batches, so building
+        never needs the full-precision corpus in memory.
+        """
+        manifest = store.read_manifest()
+        segments = store.open_segments(manifest)
+        live_rows = _live_rows(segments)
+        total = int(sum(len(rows) for rows in live_rows))
+        if total == 0:
+            return None
+        dim = segments[0].vectors.shape[1]
+        rng = np.random.default_rng(seed)
+
+        if trained is not None and trained.centroids.shape[1] == dim:
+            centroids, codebooks = trained.centroids, trained.codebooks
+        else:
+            if dim % m:
+                raise ValueError(f"m={m} must divide the vector dimension {dim}")
+            nlist = nlist or max(1, int(4 * np.sqrt(total)))
+            # Train on a uniform sample of live rows
+            sample_positions = np.sort(rng.choice(total, min(train_size, total), replace=False))
+            sample = []
+            base = 0
+            for segment, rows in zip(segments, live_rows):
+                local = sample_positions[(sample_positions >= base) & (sample_positions < base + len(rows))] - base
+                if len(local):
+                    sample.append(np.asarray(segment.vectors[rows[local]], dtype=np.float32))
+                base += len(rows)
+            sample = _normalize(np.concatenate(sample))
+            centroids = kmeans(sample, nlist, iters=iters, seed=seed)
+            residuals = sample - centroids[nearest_centroids(sample, centroids)]
+            dsub = dim // m
+            codebooks = np.stack([
+                kmeans(residuals[:, j * dsub:(j + 1) * dsub], 2 ** nbits, iters=iters, seed=seed + j)
+                for j in range(m)
+            ])
+
+        m, ksub, dsub = codebooks.shape
+        codes = np.empty((total, m), dtype=np.uint8)
+        lists = np.empty(total, dtype=np.int32)
+        segment_ids = np.empty(total, dtype=np.int32)
+        row_ids = np.empty(total, dtype=np.int64)
+        blob_ids = np.empty(total, dtype=np.int32)
+        blob_names: List[Tuple[str, str]] = []
+        blob_index: Dict[Tuple[str, str], int] = {}
+        out = 0
+        for position, (segment, rows) in enumerate(zip(segments, live_rows)):
+            remap = np.empty(len(segment.blobs), dtype=np.int32)
+            for i, blob in enumerate(segment.blobs):
+                key = (blob['container'], blob['blob_name'])
+                if key not in blob_index:
+                    blob_index[key] = len(blob_names)
+                    blob_names.append(key)
+                remap[i] = blob_index[key]
+            for start in range(0, len(rows), batch_rows):
+                part = rows[start:start + batch_rows]
+                n = len(part)
+                x = _normalize(segment.vectors[part])
+                assign = nearest_centroids(x, centroids)
+                residuals = x - centroids[assign]
+                for j in range(m):
+                    codes[out:out + n, j] = nearest_centroids(residuals[:, j * dsub:(j + 1) * dsub], codebooks[j])
+                lists[out:out + n] = assign
+                segment_ids[out:out + n] = position
+                row_ids[out:out + n] = part
+                blob_ids[out:out + n] = remap[np.asarray(segment.meta['blob'][part])]
+                out += n
+
+        # Lay rows out list by list so each probe reads a contiguous range
+        order = np.argsort(lists, kind='stable')
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(lists, minlength=len(centroids))))).astype(np.int64)
+
+        path = os.path.join(store.root, ANN_DIR_NAME)
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "centroids.npy"), centroids)
+        np.save(os.path.join(tmp_path, "codebooks.npy"), codebooks)
+        np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+        np.save(os.path.join(tmp_path, "codes.npy"), codes[order])
+        np.save(os.path.join(tmp_path, "segment_ids.npy"), segment_ids[order])
+        np.save(os.path.join(tmp_path, "rows.npy"), row_ids[order])
+        np.save(os.path.join(tmp_path, "blob_ids.npy"), blob_ids[order])
+        with open(os.path.join(tmp_path, "meta.json"), 'w') as f:
+            json.dump({
+                'store_version': manifest['version'],
+                'segment_ids': [info['id'] for info in manifest['segments']],
+                'count': total,
+                'nlist': len(centroids),
+                'm': m,
+                'nbits': int(np.log2(ksub)),
+                'blob_names': blob_names
+            }, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        print(f"Built IVF-PQ index: {total} vectors, {len(centroids)} lists, {m} bytes per vector")
+        return cls(store)
+
+    def vector(self, i: int) -> np.ndarray:
+        segment = self.segments[int(self.segment_ids[i])]
+        return np.asarray(segment.vectors[int(self.rows[i])], dtype=np.float32)
+
+    def document(self, i: int) -> Dict:
+        return self.segments[int(self.segment_ids[i])].document(int(self.rows[i]))
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None,
+               rerank: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (positions, cosine scores) of the approximate top k, best first."""
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        rerank = self.rerank if rerank is None else rerank
+        query = _normalize(query)
+        m, ksub, dsub = self.codebooks.shape
+
+        coarse = self._centroid_norms - 2 * self.centroids @ query
+        probes = np.argpartition(coarse, nprobe - 1)[:nprobe] if nprobe < len(coarse) else np.arange(len(coarse))
+
+        # Lookup tables for every probed list at once: ||r - c||^2 = ||r||^2 - 2 r.c + ||c||^2
+        residuals = (query[None, :] - self.centroids[probes]).reshape(len(probes), m, dsub)
+        tables = ((residuals ** 2).sum(axis=2)[:, :, None]
+                  - 2 * np.einsum('pmd,mkd->pmk', residuals, self.codebooks)
+                  + self._codebook_norms[None, :, :])
+
+        positions, distances = [], []
+        subspaces = np.arange(m)[:, None]
+        for table, list_id in zip(tables, probes):
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if start == end:
+                continue
+            codes = np.asarray(self.codes[start:end])
+            distances.append(table[subspaces, codes.T].sum(axis=0))
+            positions.append(np.arange(start, end))
+        if not positions:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        positions = np.concatenate(positions)
+        distances = np.concatenate(distances)
+
+        pool = min(len(positions), max(k, rerank))
+        best = np.argpartition(distances, pool - 1)[:pool] if pool < len(positions) else np.arange(len(positions))
+        positions = positions[best]
+        if rerank:
+            vectors = _normalize(np.stack([self.vector(i) for i in positions]))
+            scores = vectors @ query
+        else:
+            # For unit vectors cosine = 1 - ||q - x||^2 / 2
+            scores = 1 - distances[best] / 2
+        order = np.argsort(-scores)[:k]
+        return positions[order], scores[order].astype(np.float32)
+
+    def search_unique(self, query: np.ndarray, k: int,
+                      max_candidates: Optional[int] = None) -> Optional[Tuple[List[int], List[float]]]:
+        """Best chunk of each of the top k documents, widening the search if needed.
+
+        Returns None if k documents are not found among ``max_candidates``
+        re-ranked rows (default UNIQUE_MAX_RERANK_FACTOR times ``rerank``),
+        which happens when a few documents own most of the nearest rows; the
+        caller should then score the corpus exactly.
+        """
+        limit = max_candidates or UNIQUE_MAX_RERANK_FACTOR * max(self.rerank, k * 3)
+        want, nprobe = k * 3, self.nprobe
+        while True:
+            positions, scores = self.search(query, want, nprobe=nprobe, rerank=max(self.rerank, want))
+            seen, selected, selected_scores = set(), [], []
+            for position, score in zip(positions, scores):
+                blob = int(self.blob_ids[position])
+                if blob in seen:
+                    continue
+                seen.add(blob)
+                selected.append(int(position))
+                selected_scores.append(float(score))
+                if len(selected) == k:
+                    return selected, selected_scores
+            if want >= len(self) and nprobe >= len(self.centroids):
+                return selected, selected_scores
+            if want >= limit:
+                return None
+            want, nprobe = min(want * 4, limit), min(nprobe * 2, len(self.centroids))
+
+
+def recall_report(store: VectorStore, index: IVFPQIndex, k: int = 10, num_queries: int = 200,
+                  nprobes=(1, 4, 8, 16, 32, 64), reranks=(0, 100), seed: int = 0) -> List[Dict]:
+    """Measure recall@k and latency of the index against brute force.
+
+    Queries are live rows of the store itself. Ground truth is computed by
+    scanning every memory-mapped segment.
+    """
+    rng = np.random.default_rng(seed)
+    segments = store.open_segments()
+    live_rows = _live_rows(segments)
+    candidates = [(s, int(r)) for s, rows in enumerate(live_rows) for r in rows[:100000]]
+    picks = rng.choice(len(candidates), min(num_queries, len(candidates)), replace=False)
+    queries = [np.asarray(segments[candidates[p][0]].vectors[candidates[p][1]], dtype=np.float32) for p in picks]
+
+    truth, brute_times = [], []
+    for query in queries:
+        started = time.perf_counter()
+        per_segment = []
+        for s, segment in enumerate(segments):
+            scores = segment.scores(query)
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+            per_segment.extend((float(scores[r]), s, int(r)) for r in top)
+        per_segment.sort(reverse=True)
+        truth.append({(s, r) for _, s, r in per_segment[:k]})
+        brute_times.append(time.perf_counter() - started)
+
+    report = [{'method': 'brute_force', 'nprobe': None, 'rerank': None, 'recall': 1.0,
+               'mean_ms': 1000 * float(np.mean(brute_times)), 'p95_ms': 1000 * float(np.percentile(brute_times, 95))}]
+    for rerank in reranks:
+        for nprobe in nprobes:
+            if nprobe > len(index.centroids):
+                continue
+            hits, times = 0, []
+            for query, expected in zip(queries, truth):
+                started = time.perf_counter()
+                positions, _ = index.search(query, k, nprobe=nprobe, rerank=rerank)
+                times.append(time.perf_counter() - started)
+                found = {(int(index.segment_ids[p]), int(index.rows[p])) for p in positions}
+                hits += len(found & expected)
+            report.append({
+                'method': 'ivfpq', 'nprobe': nprobe, 'rerank': rerank,
+                'recall': hits / (k * len(queries)),
+                'mean_ms': 1000 * float(np.mean(times)), 'p95_ms': 1000 * float(np.percentile(times, 95))
+            })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an IVF-PQ index for a container's vector store")
+    parser.add_argument('container')
+    parser.add_argument('--vectors-dir', default="vectors")
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--m', type=int, default=64, help="PQ sub-quantizers (bytes per vector)")
+    parser.add_argument('--report', action='store_true', help="print recall and latency against brute force")
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    store = VectorStore(os.path.join(args.vectors_dir, args.container))
+    index = IVFPQIndex.build(store, nlist=args.nlist, m=args.m)
+    if index is None:
+        print(f"No vectors found for container {args.container}")
+        return
+    if args.report:
+        print(f"{'method':<12}{'nprobe':>8}{'rerank':>8}{'recall@' + str(args.k):>12}{'mean ms':>10}{'p95 ms':>10}")
+        for row in recall_report(store, index, k=args.k):
+            print(f"{row['method']:<12}{str(row['nprobe'] or '-'):>8}{str(row['rerank'] if row['rerank'] is not None else '-'):>8}"
+                  f"{row['recall']:>12.3f}{row['mean_ms']:>10.2f}{row['p95_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
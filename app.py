@@ -13,6 +13,7 @@ import streamlit as st
 from vectorize_documents import DocumentVectorizer
 import base64
 import agent_backend
+from conversation_store import new_session_id
 
 # Set page config - must be called before any other Streamlit commands
 st.set_page_config(
@@ -42,20 +43,18 @@ if "interaction_history" not in st.session_state:
     st.session_state.interaction_history = []
 if "user_input_box" not in st.session_state:
     st.session_state.user_input_box = ""
+if "session_id" not in st.session_state:
+    st.session_state.session_id = new_session_id()
+
+if "pending_query" not in st.session_state:
+    st.session_state.pending_query = None
 
 # Callback to handle submission and clear input
 def submit_query():
     user_input = st.session_state.user_input_box
-    # Only process non-empty input
+    # Only process non-empty input; the reply is streamed into the page below
     if user_input and user_input.strip():
-        # Log user message
-        st.session_state.interaction_history.append(("user", user_input))
-        # Get response from backend
-        response = agent_backend.run_agent(user_input)
-        if isinstance(response, dict) and "response" in response:
-            response = response["response"]
-        # Log assistant response
-        st.session_state.interaction_history.append(("assistant", response))
+        st.session_state.pending_query = user_input
     # Clear the textarea
     st.session_state.user_input_box = ""
 
@@ -145,8 +144,23 @@ with st.sidebar.form(key="interaction_form"):
         on_click=submit_query
     )
 
-# Display chat history (latest at top)
+# Stream the reply to a new query, then log the exchange with the rest of the history
 history = st.session_state.interaction_history
+if st.session_state.pending_query:
+    user_input = st.session_state.pending_query
+    st.session_state.pending_query = None
+    live = st.empty()
+    with live.container():
+        st.markdown(
+            f"<div class='chat-message user'><strong>You:</strong> {user_input}</div>",
+            unsafe_allow_html=True
+        )
+        response = st.write_stream(agent_backend.stream_agent(user_input, st.session_state.session_id))
+    live.empty()
+    history.append(("user", user_input))
+    history.append(("assistant", response))
+
+# Display chat history (latest at top)
 for i in range(len(history) - 1, 0, -2):
     user_role, user_msg = history[i-1]
     assistant_role, assistant_msg = history[i]
@@ -0,0 +1,66 @@
+import os
+import json
+from typing import Dict, Iterable, List, Tuple
+
+
+class BlobManifest:
+    """Per-container record of the blobs that are already vectorized.
+
+    Each entry holds the blob's etag, size and last_modified time so a later
+    run can tell which blobs were added, changed or deleted since.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                print(f"Error reading manifest {path}: {str(e)}. Starting empty.")
+                self.entries = {}
+
+    @staticmethod
+    def describe(blob) -> Dict:
+        """Build a manifest entry from a BlobProperties object."""
+        return {
+            'etag': blob.etag,
+            'size': blob.size,
+            'last_modified': blob.last_modified.isoformat()
+        }
+
+    def is_current(self, blob) -> bool:
+        entry = self.entries.get(blob.name)
+        if entry is None:
+            return False
+        return all(entry.get(key) == value for key, value in self.describe(blob).items())
+
+    def diff(self, blobs: Iterable) -> Tuple[List, List, List[str]]:
+        """Return (added, changed, deleted) against the listed blobs.
+
+        added and changed are BlobProperties, deleted are blob names.
+        """
+        added, changed, seen = [], [], set()
+        for blob in blobs:
+            seen.add(blob.name)
+            if blob.name not in self.entries:
+                added.append(blob)
+            elif not self.is_current(blob):
+                changed.append(blob)
+        deleted = [name for name in self.entries if name not in seen]
+        return added, changed, deleted
+
+    def update(self, blob, **extra):
+        """Record blob as processed; extra values (e.g. a chunk count) are kept with it."""
+        self.entries[blob.name] = {**self.describe(blob), **extra}
+
+    def remove(self, blob_name: str):
+        self.entries.pop(blob_name, None)
+
+    def save(self):
+        """Write the manifest atomically so a crash never leaves it half written."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
@@ -1,6 +1,6 @@
 import re
 import chainlit as cl
-from agent_backend import run_agent
+from agent_backend import astream_agent
 
 # Author name to display in chat
 AUTHOR_NAME = "Content IQ"
@@ -25,12 +25,11 @@ async def on_chat_start():
 
 @cl.on_message
 async def main(message: cl.Message):
-    response = run_agent(message.content)
-    if isinstance(response, dict):
-        response = response.get("response", "")
-    # Convert HTML <a> tags to Markdown
-    response = re.sub(r'<a\s+href="([^\"]+)">([^<]+)</a>', r"[\2](\1)", response)
-    await cl.Message(
-        content=response,
-        author=AUTHOR_NAME
-    ).send()
+    # Awaited so other sessions keep running while this turn waits on the LLM and search
+    msg = cl.Message(content="", author=AUTHOR_NAME)
+    # Each browser session keeps its own conversation; chat replies arrive token by token
+    async for token in astream_agent(message.content, cl.user_session.get("id")):
+        # Convert HTML <a> tags to Markdown (search results arrive as one piece)
+        token = re.sub(r'<a\s+href="([^\"]+)">([^<]+)</a>', r"[\2](\1)", token)
+        await msg.stream_token(token)
+    await msg.send()
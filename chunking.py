@@ -0,0 +1,153 @@
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a character-based estimate
+    tiktoken = None
+
+DEFAULT_MAX_TOKENS = int(os.getenv('CHUNK_MAX_TOKENS', '512'))
+DEFAULT_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '64'))
+
+_encoding = None
+if tiktoken is not None:
+    try:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        _encoding = None
+
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_WORD = re.compile(r'\S+\s*')
+
+
+def count_tokens(text: str) -> int:
+    """Return the cl100k token count of text (estimated if tiktoken is missing)."""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def _split_by_tokens(text: str, max_tokens: int) -> List[str]:
+    """Last resort for a single sentence longer than max_tokens."""
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        return [_encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+    # count_tokens estimates len // 4 + 1, so this is the longest piece within max_tokens
+    limit = max_tokens * 4 - 1
+    pieces, start = [], 0
+    for word in _WORD.finditer(text):
+        if word.end() - start > limit and word.start() > start:
+            pieces.append(text[start:word.start()])
+            start = word.start()
+        # A single word longer than the budget is cut by characters
+        while word.end() - start > limit:
+            pieces.append(text[start:start + limit])
+            start += limit
+    if start < len(text):
+        pieces.append(text[start:])
+    return pieces
+
+
+class TokenChunker:
+    """Token-aware chunker that keeps paragraphs and sentences intact.
+
+    Input is a stream of (page_number, text) units such as PDF pages or
+    slides. Each unit is split into paragraphs, oversized paragraphs into
+    sentences, and only an oversized sentence is cut by tokens. Pieces are
+    packed into chunks of up to ``max_tokens``, and the last pieces of each
+    chunk (up to ``overlap_tokens``) are repeated at the start of the next.
+
+    Every chunk is a dict with its text, token count, first and last page and
+    character offsets into the document (units joined by newlines).
+    """
+
+    def __init__(self, max_tokens: int = DEFAULT_MAX_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def _pieces(self, page: int, text: str, base_offset: int) -> Iterator[Tuple[str, int, int, int, str]]:
+        """Yield (piece, tokens, page, offset, separator) for the paragraphs and sentences of a unit.
+
+        separator is what joins the piece to the one before it in a chunk.
+        """
+        position = 0
+        for paragraph in _PARAGRAPH_BREAK.split(text):
+            start = text.find(paragraph, position)
+            position = start + len(paragraph)
+            if not paragraph.strip():
+                continue
+            separator = "\n\n"
+            tokens = count_tokens(paragraph)
+            if tokens <= self.max_tokens:
+                yield self._piece(paragraph, tokens, page, base_offset + start, separator)
+                continue
+            sentence_position = 0
+            for sentence in _SENTENCE_END.split(paragraph):
+                sentence_start = paragraph.find(sentence, sentence_position)
+                sentence_position = sentence_start + len(sentence)
+                if not sentence.strip():
+                    continue
+                offset = base_offset + start + sentence_start
+                tokens = count_tokens(sentence)
+                if tokens <= self.max_tokens:
+                    yield self._piece(sentence, tokens, page, offset, separator)
+                    separator = " "
+                    continue
+                for part in _split_by_tokens(sentence, self.max_tokens):
+                    yield self._piece(part, count_tokens(part), page, offset, separator)
+                    separator = ""
+                    offset += len(part)
+                separator = " "
+
+    @staticmethod
+    def _piece(text: str, tokens: int, page: int, offset: int, separator: str):
+        stripped = text.lstrip()
+        return stripped.rstrip(), tokens, page, offset + len(text) - len(stripped), separator
+
+    def _make_chunk(self, pieces: List[Tuple[str, int, int, int, str]]) -> Dict:
+        text = pieces[0][0] + "".join(separator + piece for piece, _, _, _, separator in pieces[1:])
+        return {
+            'text': text,
+            'token_count': sum(piece[1] for piece in pieces),
+            'page_start': pieces[0][2],
+            'page_end': pieces[-1][2],
+            'start_offset': pieces[0][3],
+            'end_offset': pieces[-1][3] + len(pieces[-1][0])
+        }
+
+    def chunk_units(self, units: Iterable[Tuple[int, str]]) -> Iterator[Dict]:
+        """Chunk a stream of (page_number, text) units, holding one chunk in memory."""
+        current: List[Tuple[str, int, int, int, str]] = []
+        current_tokens = 0
+        # Pieces carried over from the previous chunk as overlap
+        carried = 0
+        offset = 0
+        for page, text in units:
+            for piece in self._pieces(page, text, offset):
+                tokens = piece[1]
+                if current and current_tokens + tokens > self.max_tokens:
+                    if len(current) > carried:
+                        yield self._make_chunk(current)
+                    overlap, overlap_tokens = [], 0
+                    for previous in reversed(current):
+                        if overlap_tokens + previous[1] > self.overlap_tokens:
+                            break
+                        overlap.insert(0, previous)
+                        overlap_tokens += previous[1]
+                    # Drop overlap that would not leave room for the new piece
+                    while overlap and overlap_tokens + tokens > self.max_tokens:
+                        overlap_tokens -= overlap.pop(0)[1]
+                    current, current_tokens, carried = overlap, overlap_tokens, len(overlap)
+                current.append(piece)
+                current_tokens += tokens
+            offset += len(text) + 1
+        if len(current) > carried:
+            yield self._make_chunk(current)
+
+    def chunk_text(self, text: str, page: int = 1) -> List[Dict]:
+        """Chunk a single string."""
+        return list(self.chunk_units([(page, text)]))
@@ -0,0 +1,125 @@
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from chunking import count_tokens
+
+# Tokens of verbatim turns kept in the prompt, and the size the summary is asked to stay under
+RECENT_TOKEN_BUDGET = int(os.getenv("MEMORY_RECENT_TOKENS", "1500"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))
+
+# Per-message overhead of the chat format (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+Turn = Dict[str, str]
+
+
+def turn_tokens(turn: Turn) -> int:
+    return count_tokens(turn["user"]) + count_tokens(turn["assistant"]) + 2 * MESSAGE_OVERHEAD_TOKENS
+
+
+def messages_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def format_turns(turns: List[Turn]) -> str:
+    return "".join(f"User: {turn['user']}\nAssistant: {turn['assistant']}\n" for turn in turns)
+
+
+class ConversationMemory:
+    """Rolling summary plus the most recent turns, within a token budget.
+
+    The session keeps the newest turns verbatim in ``chat_history``. Once
+    they exceed ``recent_budget`` tokens, the oldest are folded into
+    ``summary`` with one LLM call, leaving about half the budget verbatim so
+    that the next fold is several turns away. The summary is rewritten
+    rather than appended to and capped at ``summary_budget`` tokens, so the
+    context sent with each turn stays the same size however long the
+    conversation runs.
+    """
+
+    def __init__(self, complete: Callable[[str], str], recent_budget: int = RECENT_TOKEN_BUDGET,
+                 summary_budget: int = SUMMARY_TOKEN_BUDGET):
+        self.complete = complete
+        self.recent_budget = recent_budget
+        self.summary_budget = summary_budget
+
+    def split(self, chat_history: List[Turn]) -> Tuple[List[Turn], List[Turn]]:
+        """Return (turns to fold, turns to keep); nothing is folded while within budget."""
+        tokens = [turn_tokens(turn) for turn in chat_history]
+        if sum(tokens) <= self.recent_budget:
+            return [], chat_history
+        kept, start = 0, len(chat_history)
+        # Always keep the latest turn so a follow-up can refer to it
+        while start > 0 and (start == len(chat_history) or kept + tokens[start - 1] <= self.recent_budget // 2):
+            start -= 1
+            kept += tokens[start]
+        return chat_history[:start], chat_history[start:]
+
+    def summary_prompt(self, summary: str, turns: List[Turn]) -> str:
+        return (
+            "Update the running summary of a conversation between a user and an assistant with the "
+            "turns below. Keep names, topics, documents and decisions the user may refer back to; "
+            f"drop small talk. Reply with the new summary only, in at most {self.summary_budget} tokens.\n\n"
+            f"Current summary:\n{summary or '(none)'}\n\n"
+            f"New turns:\n{format_turns(turns)}"
+        )
+
+    def _folded(self, summary: str, older: List[Turn], recent: List[Turn], new_summary: Optional[str]) -> Dict:
+        if new_summary is None:
+            # Keep the old summary; the overflow is dropped so the prompt stays bounded
+            print(f"Memory dropped {len(older)} turns without summarizing them")
+            return {"summary": summary, "chat_history": recent}
+        print(f"Memory folded {len(older)} turns into the summary ({count_tokens(new_summary)} tokens)")
+        return {"summary": new_summary, "chat_history": recent}
+
+    def fold(self, summary: str, chat_history: List[Turn]) -> Dict:
+        """Return {'summary', 'chat_history'} with overflowing turns folded into the summary."""
+        older, recent = self.split(chat_history)
+        if not older:
+            return {"summary": summary, "chat_history": chat_history}
+        try:
+            new_summary = self.complete(self.summary_prompt(summary, older)).strip()
+        except Exception as e:
+            print(f"Error summarizing conversation: {e}")
+            new_summary = None
+        return self._folded(summary, older, recent, new_summary)
+
+    async def afold(self, summary: str, chat_history: List[Turn],
+                    acomplete: Callable[[str], Awaitable[str]]) -> Dict:
+        """``fold`` with an async LLM call; ``acomplete`` is awaited."""
+        older, recent = self.split(chat_history)
+        if not older:
+            return {"summary": summary, "chat_history": chat_history}
+        try:
+            new_summary = (await acomplete(self.summary_prompt(summary, older))).strip()
+        except Exception as e:
+            print(f"Error summarizing conversation: {e}")
+            new_summary = None
+        return self._folded(summary, older, recent, new_summary)
+
+    def context(self, summary: str, chat_history: List[Turn]) -> str:
+        """Summary and recent turns as prompt text."""
+        context = f"Summary of earlier conversation: {summary}\n" if summary else ""
+        return context + format_turns(chat_history)
+
+    def messages(self, system: str, summary: str, chat_history: List[Turn], user_input: str) -> List[Dict[str, str]]:
+        """Chat messages: the system prompt with the summary, then the recent turns and the new message."""
+        if summary:
+            system = f"{system}\n\nSummary of the conversation so far:\n{summary}"
+        messages = [{"role": "system", "content": system}]
+        for turn in chat_history:
+            messages.append({"role": "user", "content": turn["user"]})
+            messages.append({"role": "assistant", "content": turn["assistant"]})
+        messages.append({"role": "user", "content": user_input})
+        return messages
+
+    def usage(self, summary: str, chat_history: List[Turn], prompt_tokens: int = None) -> Dict[str, int]:
+        """Token counts for a turn's memory, plus the prompt it went into if given."""
+        usage = {
+            "summary_tokens": count_tokens(summary) if summary else 0,
+            "recent_tokens": sum(turn_tokens(turn) for turn in chat_history),
+            "recent_turns": len(chat_history)
+        }
+        if prompt_tokens is not None:
+            usage["prompt_tokens"] = prompt_tokens
+        return usage
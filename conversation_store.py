@@ -0,0 +1,179 @@
+import os
+import time
+import uuid
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from langgraph.checkpoint.memory import MemorySaver
+
+# "memory" keeps sessions in this process; "sqlite" and "redis" share them between workers
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "memory")
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "vectors/conversations.sqlite")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+
+# Sessions idle this long are dropped, and the memory store keeps at most MAX_SESSIONS
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "3600"))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "1000"))
+
+DEFAULT_SESSION = "default"
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def session_config(session_id: str) -> Dict:
+    """LangGraph run config that loads and saves the state of one session."""
+    return {"configurable": {"thread_id": session_id or DEFAULT_SESSION}}
+
+
+class SessionMemorySaver(MemorySaver):
+    """In-process checkpointer that forgets idle and least recently used sessions.
+
+    Each session is a LangGraph thread. Reading or writing a thread marks it
+    as used; threads idle for ``idle_seconds`` are deleted, and the least
+    recently used go once there are more than ``max_sessions``.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, idle_seconds: float = SESSION_IDLE_SECONDS, **kwargs):
+        super().__init__(**kwargs)
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.evictions = 0
+        self._last_seen: "OrderedDict[str, float]" = OrderedDict()
+        self._sessions_lock = threading.Lock()
+
+    def _touch(self, config: Dict):
+        thread_id = config["configurable"]["thread_id"]
+        now = time.time()
+        stale = []
+        with self._sessions_lock:
+            self._last_seen.pop(thread_id, None)
+            self._last_seen[thread_id] = now
+            # Oldest first, so stop at the first session that is still active
+            for other, seen in self._last_seen.items():
+                if other == thread_id or (seen + self.idle_seconds >= now and
+                                          len(self._last_seen) - len(stale) <= self.max_sessions):
+                    break
+                stale.append(other)
+            for other in stale:
+                del self._last_seen[other]
+        for other in stale:
+            self.delete_thread(other)
+            self.evictions += 1
+
+    def get_tuple(self, config):
+        self._touch(config)
+        return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        self._touch(config)
+        return super().put(config, checkpoint, metadata, new_versions)
+
+    def sessions(self) -> int:
+        return len(self._last_seen)
+
+
+class ThreadedAsyncSaver:
+    """Mixin giving a synchronous checkpointer the async methods ``ainvoke`` needs.
+
+    The SQLite and Redis savers only implement the sync interface; their
+    calls are short, so they run on a worker thread instead of the event loop.
+    """
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+def sqlite_saver(path: str = CONVERSATION_DB_PATH, idle_seconds: float = SESSION_IDLE_SECONDS):
+    """Checkpointer on a SQLite file, shared by every worker that can open it.
+
+    A sessions table records when each thread was last used, and threads idle
+    for ``idle_seconds`` are deleted at most once a minute. Needs the
+    langgraph-checkpoint-sqlite package.
+    """
+    import sqlite3
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    class SqliteSessionSaver(ThreadedAsyncSaver, SqliteSaver):
+        def __init__(self, conn):
+            super().__init__(conn)
+            self._pruned_at = 0.0
+
+        def setup(self):
+            if self.is_setup:
+                return
+            super().setup()
+            # SqliteSaver.cursor calls setup while holding self.lock, so do not take it here
+            self.conn.execute("CREATE TABLE IF NOT EXISTS sessions (thread_id TEXT PRIMARY KEY, last_seen REAL)")
+            self.conn.commit()
+
+        def _touch(self, config: Dict):
+            self.setup()
+            now = time.time()
+            with self.lock:
+                self.conn.execute(
+                    "INSERT INTO sessions (thread_id, last_seen) VALUES (?, ?) "
+                    "ON CONFLICT(thread_id) DO UPDATE SET last_seen = excluded.last_seen",
+                    (config["configurable"]["thread_id"], now)
+                )
+                stale = []
+                if now - self._pruned_at > 60:
+                    self._pruned_at = now
+                    cutoff = now - idle_seconds
+                    stale = [row[0] for row in self.conn.execute(
+                        "SELECT thread_id FROM sessions WHERE last_seen < ?", (cutoff,))]
+                    self.conn.execute("DELETE FROM sessions WHERE last_seen < ?", (cutoff,))
+                self.conn.commit()
+            for thread_id in stale:
+                self.delete_thread(thread_id)
+
+        def get_tuple(self, config):
+            self._touch(config)
+            return super().get_tuple(config)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return SqliteSessionSaver(sqlite3.connect(path, check_same_thread=False))
+
+
+def redis_saver(url: str = REDIS_URL, idle_seconds: float = SESSION_IDLE_SECONDS):
+    """Checkpointer on Redis; keys expire after ``idle_seconds`` and reads renew them.
+
+    Needs the langgraph-checkpoint-redis package.
+    """
+    from langgraph.checkpoint.redis import RedisSaver
+
+    class RedisSessionSaver(ThreadedAsyncSaver, RedisSaver):
+        pass
+
+    saver = RedisSessionSaver(redis_url=url, ttl={"default_ttl": idle_seconds / 60, "refresh_on_read": True})
+    saver.setup()
+    return saver
+
+
+def make_checkpointer(backend: Optional[str] = None):
+    """Checkpointer for the backend named by CONVERSATION_STORE (memory, sqlite or redis)."""
+    backend = backend or CONVERSATION_STORE
+    if backend == "memory":
+        return SessionMemorySaver()
+    if backend == "sqlite":
+        return sqlite_saver()
+    if backend == "redis":
+        return redis_saver()
+    raise ValueError(f"Unknown CONVERSATION_STORE '{backend}'. Use memory, sqlite or redis")
@@ -9,13 +9,11 @@ from langchain.prompts import ChatPromptTemplate
 import re
 import requests
 import os
-import json
 import html
 from typing import Dict, Any, List
 import textwrap 
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
-from datetime import datetime, timedelta
-import urllib.parse
+from sas_service import get_sas_service
+from hybrid_search import get_search_client
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -85,51 +83,24 @@ def extract_topic_node(input):
 
 def search_index_node(input):
     print(f"Search Index Node received topic: {input['topic']}") # Debugging print
-    AZURE_SEARCH_ENDPOINT = os.getenv("AZURE_SEARCH_ENDPOINT")
-    AZURE_SEARCH_KEY = os.getenv("AZURE_SEARCH_KEY")
-    INDEX_NAME = os.getenv("AZURE_SEARCH_INDEX")
-    print(f"Search Endpoint: {AZURE_SEARCH_ENDPOINT}") # Debugging print
-    print(f"Search Key (first 5 chars): {AZURE_SEARCH_KEY[:5] if AZURE_SEARCH_KEY else 'N/A'}") # Debugging print
-    print(f"Search Index: {INDEX_NAME}") # Debugging print
-
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": AZURE_SEARCH_KEY
-    }
-    search_url = f"{AZURE_SEARCH_ENDPOINT}/indexes/{INDEX_NAME}/docs/search?api-version=2023-07-01-preview"
-    data = {
-        "search": input['topic'],
-        "top": 1000  # Azure maximum per page
-        # Removed semantic search parameters - assuming this was applied
-    }
-    print(f"Search request data payload: {json.dumps(data)}") # Debugging print: print the JSON payload
+    # Shared client: settings read once, connections kept warm between turns
+    client = get_search_client()
 
     try:
-        res = requests.post(search_url, headers=headers, json=data)
-        res.raise_for_status() # Raise an exception for HTTP errors
-        hits = res.json().get("value", [])
+        # Hybrid keyword + vector query; one hit per document, only id and title returned
+        hits = client.search(input["topic"], top_docs=TOP_K)
         print(f"Search results count: {len(hits)}") # Debugging print
     except requests.exceptions.RequestException as e:
         print(f"Error during Azure AI Search: {e}")
-        if 'res' in locals() and res is not None: # Check if response object exists before trying to access .text
-            print(f"Azure AI Search response content: {res.text}") # Debugging print: full response content
+        if e.response is not None: # Check if response object exists before trying to access .text
+            print(f"Azure AI Search response content: {e.response.text}") # Debugging print: full response content
         hits = [] # Ensure hits is defined even on error
         
     return {"docs": hits}
 
 def generate_blob_sas_url(container_name, blob_name, expiry_minutes=10):
-    AZURE_CONNECTION_STRING = os.getenv("AZURE_CONNECTION_STRING")
-    blob_service_client = BlobServiceClient.from_connection_string(AZURE_CONNECTION_STRING)
-    sas_token = generate_blob_sas(
-        account_name=blob_service_client.account_name,
-        container_name=container_name,
-        blob_name=blob_name,
-        account_key=blob_service_client.credential.account_key,
-        permission=BlobSasPermissions(read=True),
-        expiry=datetime.utcnow() + timedelta(minutes=expiry_minutes)
-    )
-    blob_url = f"https://{blob_service_client.account_name}.blob.core.windows.net/{container_name}/{urllib.parse.quote(blob_name)}?{sas_token}"
-    return blob_url
+    # Shared client and URL cache; see sas_service.py
+    return get_sas_service().url(container_name, blob_name, expiry_minutes)
 
 def format_results_node(input: Dict[str, Any]) -> Dict[str, Any]:
     docs: List[Dict[str, Any]] = input.get("docs", []) or []
@@ -150,6 +121,8 @@ def format_results_node(input: Dict[str, Any]) -> Dict[str, Any]:
     )[:TOP_K]
 
     AZURE_BLOB_CONTAINER = "contentiq"
+    # Sign every link of the page at once; cached URLs are reused until close to expiry
+    sas_urls = get_sas_service().urls(AZURE_BLOB_CONTAINER, [d.get('title', '') for d in unique_docs])
     header = "Here are the top documents I found (most relevant first):"
     html_lines = ["<style>.search-results a { text-decoration: none !important; }</style>", "<div class='search-results'>"]
     for idx, d in enumerate(unique_docs, start=1):
@@ -158,7 +131,7 @@ def format_results_node(input: Dict[str, Any]) -> Dict[str, Any]:
         score = d.get('@search.score', 0)
         snippet = (d.get('content', '')[:200] + '...') if d.get('content') else ''
 
-        sas_url = generate_blob_sas_url(AZURE_BLOB_CONTAINER, blob_name)
+        sas_url = sas_urls[blob_name]
         # Inject JavaScript function for download if not already present
         # (This will be included once at the top of the results)
         if idx == 1:
@@ -1,14 +1,40 @@
 import os
-import json
+import threading
 import numpy as np
 from openai import AzureOpenAI
 from dotenv import load_dotenv
-from typing import List, Dict, Tuple
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
-from datetime import datetime, timedelta
+from typing import List, Dict, Optional
+from sas_service import get_sas_service
+from embedding_cache import EmbeddingCache
+from vector_store import VectorStore, ResidentIndex
+from topk import top_k_unique, batch_top_k_unique, mmr_order
+from ann_index import IVFPQIndex
+from chunking import count_tokens
+
+# Grounded answers: context token budget, candidate chunks considered and MMR diversity weight
+QA_CONTEXT_TOKENS = int(os.getenv('QA_CONTEXT_TOKENS', '3000'))
+QA_CANDIDATES = int(os.getenv('QA_CANDIDATES', '40'))
+QA_DIVERSITY = float(os.getenv('QA_DIVERSITY', '0.3'))
+
+# Similarity a chunk needs to ground an answer. ada-002 scores unrelated text around
+# 0.7-0.8, so the cut-off is best measured on the deployment's own documents (top-1
+# similarity of questions they do and do not answer) and set here
+QA_MIN_SIMILARITY = float(os.getenv('QA_MIN_SIMILARITY')) if os.getenv('QA_MIN_SIMILARITY') else None
+
+# Unset, it is calibrated on the store: sampled chunks are searched for like questions and
+# the given percentile of their best match in another document is the cut-off, so a
+# question has to match a chunk about as well as related documents match each other
+QA_CALIBRATION_SAMPLES = int(os.getenv('QA_CALIBRATION_SAMPLES', '100'))
+QA_CALIBRATION_PERCENTILE = float(os.getenv('QA_CALIBRATION_PERCENTILE', '10'))
+
+QA_SYSTEM_PROMPT = (
+    "You are a helpful assistant that answers questions using only the numbered sources provided. "
+    "Cite the sources you use inline as [1], [2], etc. If the answer cannot be found in the sources, say so."
+)
 
 class DocumentRetriever:
-    def __init__(self, max_context_length: int = 5000):
+    def __init__(self, max_context_length: int = 5000, use_ann: bool = True, ann_nprobe: int = 16,
+                 ann_rerank: int = 100):
         # Load environment variables
         load_dotenv()
         
@@ -23,41 +49,185 @@ class DocumentRetriever:
         self.vectors_dir = "vectors"
         self.max_context_length = max_context_length
         
+        # Repeated queries are served from the shared embedding cache
+        self.embedding_cache = EmbeddingCache()
+        
+        # Resident, pre-normalized index per container: {container: (manifest stamp, index)}
+        self._indexes = {}
+        self._indexes_lock = threading.Lock()
+        
+        # Approximate search settings; brute force is used when no current ANN index exists
+        self.use_ann = use_ann
+        self.ann_nprobe = ann_nprobe
+        self.ann_rerank = ann_rerank
+        self._ann_indexes = {}
+        
+        # Containers whose index is being loaded in the background by warm()
+        self._warming = set()
+        self._warming_lock = threading.Lock()
+        
+        # Calibrated grounding cut-off per container: {container: (manifest stamp, similarity)}
+        self._min_similarities = {}
+        
     def get_embedding(self, text: str) -> List[float]:
         """Get embedding for a query text."""
+        cached = self.embedding_cache.get(self.embedding_model, text)
+        if cached is not None:
+            return cached
         try:
             response = self.openai_client.embeddings.create(
                 input=text,
                 model=self.embedding_model
             )
-            return response.data[0].embedding
+            embedding = response.data[0].embedding
+            self.embedding_cache.put(self.embedding_model, text, embedding)
+            return embedding
         except Exception as e:
             print(f"Error getting embedding: {str(e)}")
             return None
 
-    def load_vectors(self, container_name: str) -> Tuple[np.ndarray, List[Dict]]:
-        """Load vectors and metadata for a container."""
+    def load_vectors(self, container_name: str) -> Optional[ResidentIndex]:
+        """Return the container's resident index, reloading it if the store changed.
+
+        Only the manifest is stat'ed per call; the vectors are read from disk
+        once per store version.
+        """
+        store_dir = os.path.join(self.vectors_dir, container_name)
+        if not os.path.isdir(store_dir):
+            return None
+        store = VectorStore(store_dir)
+        stamp = store.manifest_stamp()
+        if stamp is None:
+            return None
+        cached = self._indexes.get(container_name)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        with self._indexes_lock:
+            cached = self._indexes.get(container_name)
+            if cached and cached[0] == stamp:
+                return cached[1]
+            try:
+                index = ResidentIndex(store)
+            except Exception as e:
+                print(f"Error loading vectors: {str(e)}")
+                # Keep serving the previous version if the reload failed
+                return cached[1] if cached else None
+            self._indexes[container_name] = (stamp, index)
+            return index
+
+    def load_ann_index(self, container_name: str) -> Optional[IVFPQIndex]:
+        """Return the container's IVF-PQ index if one was built for the current store."""
+        if not self.use_ann:
+            return None
+        store = VectorStore(os.path.join(self.vectors_dir, container_name))
+        # The index is built after the store is written, so its own meta.json is part of the key
+        stamp = (store.manifest_stamp(), IVFPQIndex.meta_stamp(store))
+        cached = self._ann_indexes.get(container_name)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        index = None
+        if stamp[0] is not None and stamp[1] is not None:
+            try:
+                index = IVFPQIndex(store, nprobe=self.ann_nprobe, rerank=self.ann_rerank)
+                if not index.is_current():
+                    index = None
+            except Exception as e:
+                print(f"Error loading ANN index: {str(e)}")
+                index = None
+        self._ann_indexes[container_name] = (stamp, index)
+        return index
+
+    def has_vectors(self, container_name: str) -> bool:
+        """True if the container has a local store with rows; reads only the manifest."""
+        store = VectorStore(os.path.join(self.vectors_dir, container_name))
+        if store.manifest_stamp() is None:
+            return False
+        return any(info['count'] for info in store.read_manifest()['segments'])
+
+    def is_loaded(self, container_name: str) -> bool:
+        """True if a search would not have to load the container's index first."""
+        store = VectorStore(os.path.join(self.vectors_dir, container_name))
+        stamp = store.manifest_stamp()
+        cached = self._ann_indexes.get(container_name)
+        if self.use_ann and cached and cached[0] == (stamp, IVFPQIndex.meta_stamp(store)) and cached[1] is not None:
+            return True
+        cached = self._indexes.get(container_name)
+        return bool(cached) and cached[0] == stamp
+
+    def warm(self, container_name: str, calibrate: bool = False) -> bool:
+        """Return True if the index is in memory, else start loading it on a background thread.
+
+        With ``calibrate`` the grounding cut-off (see ``min_similarity``) has to be ready too.
+        """
+        if self.is_loaded(container_name) and (not calibrate or self._calibration(container_name) is not None):
+            return True
+        with self._warming_lock:
+            if container_name in self._warming:
+                return False
+            self._warming.add(container_name)
+        threading.Thread(target=self._warm, args=(container_name, calibrate), daemon=True).start()
+        return False
+
+    def _warm(self, container_name: str, calibrate: bool = False):
         try:
-            # Find the most recent vector files for the container
-            vector_files = [f for f in os.listdir(self.vectors_dir) 
-                          if f.startswith(f"{container_name}_embeddings_") and f.endswith('.npy')]
-            
-            if not vector_files:
-                return None, None
-                
-            # Get the most recent file
-            latest_vector_file = sorted(vector_files)[-1]
-            latest_metadata_file = latest_vector_file.replace('embeddings_', 'metadata_').replace('.npy', '.json')
-            
-            # Load vectors and metadata
-            vectors = np.load(os.path.join(self.vectors_dir, latest_vector_file))
-            with open(os.path.join(self.vectors_dir, latest_metadata_file), 'r') as f:
-                metadata = json.load(f)
-                
-            return vectors, metadata
-        except Exception as e:
-            print(f"Error loading vectors: {str(e)}")
-            return None, None
+            if self.load_ann_index(container_name) is None:
+                self.load_vectors(container_name)
+            if calibrate and self._calibration(container_name) is None:
+                stamp = VectorStore(os.path.join(self.vectors_dir, container_name)).manifest_stamp()
+                similarity = self.calibrate_min_similarity(container_name)
+                if similarity is None:
+                    print(f"Could not calibrate a grounding cut-off for {container_name}; set QA_MIN_SIMILARITY")
+                self._min_similarities[container_name] = (stamp, similarity)
+        finally:
+            with self._warming_lock:
+                self._warming.discard(container_name)
+
+    def _calibration(self, container_name: str):
+        """(stamp, similarity) calibrated for the current store, or None."""
+        cached = self._min_similarities.get(container_name)
+        store = VectorStore(os.path.join(self.vectors_dir, container_name))
+        return cached if cached and cached[0] == store.manifest_stamp() else None
+
+    def min_similarity(self, container_name: str) -> Optional[float]:
+        """QA_MIN_SIMILARITY, else the cut-off warm() calibrated for the current store."""
+        if QA_MIN_SIMILARITY is not None:
+            return QA_MIN_SIMILARITY
+        calibration = self._calibration(container_name)
+        return calibration[1] if calibration else None
+
+    def calibrate_min_similarity(self, container_name: str, samples: int = QA_CALIBRATION_SAMPLES,
+                                 percentile: float = QA_CALIBRATION_PERCENTILE, seed: int = 0) -> Optional[float]:
+        """Estimate the similarity a chunk needs to ground an answer from the store itself.
+
+        Sampled chunks are searched for like questions; each one's top-1 score
+        is its best match in another document, since chunks of the same
+        document overlap. Returns the ``percentile`` of those scores, or None
+        for a store with fewer than two documents.
+        """
+        index = self.load_ann_index(container_name)
+        if index is None:
+            index = self.load_vectors(container_name)
+        if index is None or not len(index):
+            return None
+        rng = np.random.default_rng(seed)
+        picks = np.sort(rng.choice(len(index), min(samples, len(index)), replace=False))
+        blob_ids = np.asarray(index.blob_ids)
+        top1 = []
+        if isinstance(index, ResidentIndex):
+            # Score the sample in blocks of rows, one matrix multiply each
+            for start in range(0, len(picks), 16):
+                block = picks[start:start + 16]
+                scores = index.vectors[block] @ index.vectors.T
+                scores[blob_ids[block][:, None] == blob_ids[None, :]] = -np.inf
+                top1.extend(scores.max(axis=1))
+        else:
+            for i in picks:
+                positions, scores = index.search(index.vector(i), QA_CANDIDATES)
+                top1.extend(scores[blob_ids[positions] != blob_ids[i]][:1])
+        top1 = [score for score in top1 if np.isfinite(score)]
+        if not top1:
+            return None
+        return float(np.percentile(top1, percentile))
 
     def semantic_search(self, query: str, container_name: str, top_k: int = 3) -> List[Dict]:
         """Perform semantic search on documents."""
@@ -66,41 +236,192 @@ class DocumentRetriever:
         if not query_embedding:
             return []
             
-        # Load vectors and metadata
-        vectors, metadata = self.load_vectors(container_name)
-        if vectors is None or metadata is None:
+        # Prefer the approximate index when one matches the current store
+        ann_index = self.load_ann_index(container_name)
+        if ann_index is not None:
+            found = ann_index.search_unique(np.array(query_embedding), top_k)
+            if found is not None:
+                return self._format_results(ann_index, *found)
+            # A few documents own the nearest rows; scoring every row exactly is cheaper
+            # than re-ranking ever more of them one by one
+            
+        # Get the container's resident index
+        index = self.load_vectors(container_name)
+        if index is None or not len(index):
             return []
             
-        # Calculate cosine similarity
-        query_embedding = np.array(query_embedding)
-        similarities = np.dot(vectors, query_embedding) / (
-            np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_embedding)
-        )
-        
-        # Get top k results
-        top_indices = np.argsort(similarities)[-top_k*3:][::-1]  # Get more results initially to allow for deduplication
+        # Calculate cosine similarity against pre-normalized vectors
+        similarities = index.scores(np.array(query_embedding))
         
-        # Deduplicate results by (container, blob_name), keeping the most relevant chunk
-        seen_docs = set()
+        # Best chunk of each of the top_k most relevant documents
+        top_indices = top_k_unique(similarities, index.blob_ids, top_k)
+        return self._format_results(index, top_indices, similarities[top_indices])
+
+    def get_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Get embeddings for several query texts with at most one request."""
+        embeddings = self.embedding_cache.get_many(self.embedding_model, texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            try:
+                response = self.openai_client.embeddings.create(
+                    input=[texts[i] for i in missing],
+                    model=self.embedding_model
+                )
+                fresh = [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+                self.embedding_cache.put_many(self.embedding_model, [texts[i] for i in missing], fresh)
+                for i, embedding in zip(missing, fresh):
+                    embeddings[i] = embedding
+            except Exception as e:
+                print(f"Error getting embeddings: {str(e)}")
+        return embeddings
+
+    def batch_semantic_search(self, queries: List[str], container_name: str, top_k: int = 3) -> List[List[Dict]]:
+        """Run semantic_search for many queries, scored together as one matrix multiply."""
+        results: List[List[Dict]] = [[] for _ in queries]
+        index = self.load_vectors(container_name)
+        if index is None or not len(index):
+            return results
+        embeddings = self.get_embeddings(queries)
+        valid = [i for i, embedding in enumerate(embeddings) if embedding]
+        if not valid:
+            return results
+        matches = batch_top_k_unique(
+            index.vectors, np.array([embeddings[i] for i in valid]), index.blob_ids, top_k
+        )
+        for i, (indices, scores) in zip(valid, matches):
+            results[i] = self._format_results(index, indices, scores)
+        return results
+
+    def _format_results(self, index, indices: List[int], scores) -> List[Dict]:
+        """Build result dicts for the selected rows, truncating long content."""
         results = []
-        for idx in top_indices:
-            doc_key = (metadata[idx]['container'], metadata[idx]['blob_name'])
-            if doc_key not in seen_docs:
-                seen_docs.add(doc_key)
-                # Truncate content if it exceeds max_context_length
-                content = metadata[idx]['content']
-                if len(content) > self.max_context_length:
-                    content = content[:self.max_context_length] + "..."
-                
-                results.append({
-                    'document': {**metadata[idx], 'content': content},
-                    'similarity': float(similarities[idx])
-                })
-                
-                if len(results) >= top_k:  # Stop once we have enough unique documents
-                    break
+        for idx, score in zip(indices, scores):
+            document = index.document(idx)
+            # Truncate content if it exceeds max_context_length
+            content = document['content']
+            if len(content) > self.max_context_length:
+                content = content[:self.max_context_length] + "..."
+            results.append({
+                'document': {**document, 'content': content},
+                'similarity': float(score)
+            })
         return results
 
+    def candidates(self, query_embedding: List[float], container_name: str, n: int):
+        """Return (index, positions, scores, normalized vectors) of the n best chunks."""
+        query = np.array(query_embedding)
+        ann_index = self.load_ann_index(container_name)
+        if ann_index is not None:
+            positions, scores = ann_index.search(query, n)
+            vectors = np.stack([ann_index.vector(i) for i in positions]) if len(positions) else np.zeros((0, len(query)))
+            norms = np.linalg.norm(vectors, axis=1)
+            return ann_index, list(positions), np.asarray(scores), vectors / np.where(norms > 0, norms, 1.0)[:, None]
+
+        index = self.load_vectors(container_name)
+        if index is None or not len(index):
+            return None, [], np.zeros(0), np.zeros((0, len(query)))
+        similarities = index.scores(query)
+        positions = np.argpartition(-similarities, n - 1)[:n] if n < len(similarities) else np.arange(len(similarities))
+        positions = positions[np.argsort(-similarities[positions])]
+        return index, list(positions), similarities[positions], index.vectors[positions]
+
+    def build_context(self, question: str, container_name: str, max_tokens: int = QA_CONTEXT_TOKENS,
+                      candidates: int = QA_CANDIDATES, diversity: float = QA_DIVERSITY,
+                      min_similarity: Optional[float] = None, max_per_document: int = 3) -> Optional[List[Dict]]:
+        """Pick the chunks to ground an answer on, within max_tokens.
+
+        The best ``candidates`` chunks are ordered by MMR so near-duplicates
+        are dropped and several documents get a say, then packed greedily:
+        a chunk that does not fit the remaining budget is skipped for a
+        smaller one. Chunks below ``min_similarity`` (default
+        ``min_similarity()``) are left out, so this returns [] when the
+        documents do not cover the question.
+
+        Nothing is embedded unless the container has a local store. Returns
+        None when retrieval was skipped: while the index or the calibrated
+        cut-off is still being prepared in the background (rather than
+        making the turn wait) or when the question could not be embedded.
+        """
+        if not self.has_vectors(container_name):
+            return []
+        if not self.warm(container_name, calibrate=min_similarity is None and QA_MIN_SIMILARITY is None):
+            return None
+        if min_similarity is None:
+            min_similarity = self.min_similarity(container_name)
+            if min_similarity is None:
+                # The store could not be calibrated, so grounding stays off for it
+                return []
+        query_embedding = self.get_embedding(question)
+        if not query_embedding:
+            return None
+        index, positions, scores, vectors = self.candidates(query_embedding, container_name, candidates)
+        # Weak matches would only dilute the context
+        keep = scores >= min_similarity
+        if not keep.any():
+            return []
+        positions = [position for position, kept in zip(positions, keep) if kept]
+        scores, vectors = scores[keep], vectors[keep]
+
+        passages, used, per_document, seen = [], 0, {}, set()
+        for i in mmr_order(scores, vectors, diversity):
+            document = index.document(positions[i])
+            content = document['content'].strip()
+            key = (document['container'], document['blob_name'])
+            if not content or content in seen or per_document.get(key, 0) >= max_per_document:
+                continue
+            tokens = count_tokens(content)
+            if used + tokens > max_tokens:
+                continue
+            seen.add(content)
+            per_document[key] = per_document.get(key, 0) + 1
+            used += tokens
+            passages.append({**document, 'content': content, 'similarity': float(scores[i]), 'tokens': tokens})
+        # Present each document's chunks together, in reading order
+        order = {}
+        for passage in passages:
+            order.setdefault((passage['container'], passage['blob_name']), len(order))
+        passages.sort(key=lambda p: (order[(p['container'], p['blob_name'])], p.get('chunk_index', 0)))
+        return passages
+
+    def qa_messages(self, question: str, passages: List[Dict]) -> List[Dict[str, str]]:
+        """Chat messages asking for an answer grounded in numbered passages."""
+        sources = []
+        for n, passage in enumerate(passages, 1):
+            page = f", page {passage['page_start']}" if passage.get('page_start') else ""
+            sources.append(f"[{n}] {passage['blob_name']}{page}\n{passage['content']}")
+        return [
+            {"role": "system", "content": QA_SYSTEM_PROMPT},
+            {"role": "user", "content": "Sources:\n\n" + "\n\n".join(sources) + f"\n\nQuestion: {question}"}
+        ]
+
+    def citations(self, passages: List[Dict], expiry_minutes: int = 15) -> str:
+        """Markdown list of the numbered sources with links to the documents."""
+        lines = []
+        for n, passage in enumerate(passages, 1):
+            page = f", page {passage['page_start']}" if passage.get('page_start') else ""
+            url = self.generate_blob_sas_url(passage['container'], passage['blob_name'], expiry_minutes)
+            name = f"[{passage['blob_name']}]({url})" if url else passage['blob_name']
+            lines.append(f"[{n}] {name}{page}")
+        return "\n".join(lines)
+
+    def answer_from_store(self, question: str, container_name: str,
+                          min_similarity: Optional[float] = None) -> Dict:
+        """Answer from the container's documents with token-budgeted context; returns {'answer', 'sources'}."""
+        passages = self.build_context(question, container_name, min_similarity=min_similarity)
+        if not passages:
+            return {"answer": "I couldn't find this in the documents.", "sources": []}
+        try:
+            response = self.openai_client.chat.completions.create(
+                model=os.getenv('DEPLOYMENT_NAME'),
+                messages=self.qa_messages(question, passages),
+                temperature=0,
+                max_tokens=500
+            )
+            return {"answer": response.choices[0].message.content, "sources": passages}
+        except Exception as e:
+            print(f"Error generating answer: {str(e)}")
+            return {"answer": "Sorry, I couldn't generate an answer at this time.", "sources": passages}
+
     def answer_question(self, question: str, context: str) -> str:
         """Generate an answer based on the question and context."""
         try:
@@ -125,19 +446,7 @@ class DocumentRetriever:
     def generate_blob_sas_url(self, container_name: str, blob_name: str, expiry_minutes: int = 15) -> str:
         """Generate a SAS URL for a blob to allow secure access."""
         try:
-            load_dotenv()
-            connection_string = os.getenv('AZURE_CONNECTION_STRING')
-            blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-            sas_token = generate_blob_sas(
-                account_name=blob_service_client.account_name,
-                container_name=container_name,
-                blob_name=blob_name,
-                account_key=blob_service_client.credential.account_key,
-                permission=BlobSasPermissions(read=True),
-                expiry=datetime.utcnow() + timedelta(minutes=expiry_minutes)
-            )
-            blob_url = blob_service_client.get_blob_client(container=container_name, blob=blob_name).url
-            return f"{blob_url}?{sas_token}"
+            return get_sas_service().url(container_name, blob_name, expiry_minutes)
         except Exception as e:
             print(f"Error generating SAS URL: {str(e)}")
             return None
\ No newline at end of file
@@ -0,0 +1,186 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', os.path.join('vectors', 'embedding_cache.db'))
+DEFAULT_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '500000'))
+
+# Access times are kept in memory and written together once this many keys or
+# seconds have built up, so cache hits do not each commit a write
+ACCESS_FLUSH_KEYS = 1024
+ACCESS_FLUSH_SECONDS = 30.0
+
+# Eviction trims this fraction below max_entries so the next puts do not evict again
+EVICT_SLACK = 0.1
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text so trivially different copies share a cache entry."""
+    text = unicodedata.normalize('NFC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by (model, normalized text hash).
+
+    Entries live in a SQLite file as float32 blobs. When the cache grows past
+    ``max_entries`` the least recently used entries are evicted. Access times
+    are recorded in batches, and the row count is tracked in memory, so the
+    hot path is mostly reads.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        # Upper bound on the rows; replaced keys and other processes' writes make it drift,
+        # so it is re-counted whenever it says the cache is full
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        # key -> last access time not yet written
+        self._touched: Dict[str, float] = {}
+        self._touched_at = time.time()
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+        return f"{model}:{digest}"
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Look up texts; the result is aligned with the input, None for misses."""
+        keys = [self.make_key(model, text) for text in texts]
+        found: Dict[str, bytes] = {}
+        with self._lock:
+            unique = list(set(keys))
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                part = unique[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._touched.update((key, now) for key in found)
+                if len(self._touched) >= ACCESS_FLUSH_KEYS or now - self._touched_at >= ACCESS_FLUSH_SECONDS:
+                    self._write_access_times()
+                    self._conn.commit()
+            results = []
+            for key in keys:
+                if key in found:
+                    self.hits += 1
+                    results.append(np.frombuffer(found[key], dtype=np.float32).tolist())
+                else:
+                    self.misses += 1
+                    results.append(None)
+        return results
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, texts: List[str], embeddings: List[Optional[List[float]]]):
+        """Store embeddings for texts, skipping failed (None) entries."""
+        now = time.time()
+        rows = [
+            (self.make_key(model, text), np.asarray(embedding, dtype=np.float32).tobytes(), now)
+            for text, embedding in zip(texts, embeddings) if embedding
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._write_access_times()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)", rows
+            )
+            self._count += len(rows)
+            if self._count > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def put(self, model: str, text: str, embedding: List[float]):
+        self.put_many(model, [text], [embedding])
+
+    def _write_access_times(self):
+        """Write buffered access times; the caller holds the lock and commits."""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(now, key) for key, now in self._touched.items()]
+            )
+            self._touched = {}
+        self._touched_at = time.time()
+
+    def _evict(self):
+        """Drop least recently used entries down to EVICT_SLACK below max_entries."""
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if self._count <= self.max_entries:
+            return
+        excess = self._count - int(self.max_entries * (1 - EVICT_SLACK))
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)", (excess,)
+        )
+        self._count -= excess
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and the current number of entries."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries
+        }
+
+    def close(self):
+        with self._lock:
+            self._write_access_times()
+            self._conn.commit()
+            self._conn.close()
+
+
+class CachedEmbeddings:
+    """Wraps a LangChain embeddings object with an EmbeddingCache."""
+
+    def __init__(self, embeddings, model: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.cache.get_many(self.model, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            fresh = self.embeddings.embed_documents([texts[i] for i in missing])
+            self.cache.put_many(self.model, [texts[i] for i in missing], fresh)
+            for i, vector in zip(missing, fresh):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.cache.get(self.model, text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put(self.model, text, vector)
+        return vector
@@ -0,0 +1,120 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import openai
+
+from chunking import count_tokens
+
+# Small batches, so a flush of a few hundred chunks becomes enough requests to keep
+# max_in_flight busy; each request also finishes (or is retried) sooner
+DEFAULT_BATCH_ITEMS = int(os.getenv("EMBEDDING_BATCH_ITEMS", "16"))
+DEFAULT_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "8192"))
+
+class BatchEmbeddingClient:
+    """Embeds many texts with few requests and a bounded number in flight.
+
+    Texts are packed into ``embeddings.create`` calls of at most
+    ``max_batch_items`` texts and ``max_batch_tokens`` estimated tokens. Up to
+    ``max_in_flight`` batches run concurrently.
+    429 responses are retried after the server's retry-after hint, and a batch
+    rejected by the service is split until only the offending items fail.
+    """
+
+    def __init__(self, openai_client, model: str, max_batch_items: int = DEFAULT_BATCH_ITEMS,
+                 max_batch_tokens: int = DEFAULT_BATCH_TOKENS, max_item_tokens: int = 8191,
+                 max_in_flight: int = 8, max_retries: int = 6, cache=None):
+        # Retries are handled here so they respect the retry-after header
+        self.openai_client = openai_client.with_options(max_retries=0)
+        self.model = model
+        self.max_batch_items = max_batch_items
+        self.max_batch_tokens = max_batch_tokens
+        self.max_item_tokens = max_item_tokens
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        # Optional EmbeddingCache consulted before calling the service
+        self.cache = cache
+
+    def make_batches(self, texts: List[str]) -> List[List[int]]:
+        """Group text indices into batches within the item and token limits."""
+        batches, current, current_tokens = [], [], 0
+        for i, text in enumerate(texts):
+            tokens = min(count_tokens(text), self.max_item_tokens)
+            if current and (len(current) >= self.max_batch_items
+                            or current_tokens + tokens > self.max_batch_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _retry_after(self, error) -> float:
+        """Seconds to wait before retrying, taken from the response headers."""
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except ValueError:
+            pass
+        return 0.0
+
+    def _create(self, inputs: List[str]) -> List[List[float]]:
+        """Call the embeddings API, retrying on throttling and transient errors."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.openai_client.embeddings.create(input=inputs, model=self.model)
+                return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+            except (openai.RateLimitError, openai.APIConnectionError,
+                    openai.APITimeoutError, openai.InternalServerError) as e:
+                if attempt == self.max_retries:
+                    raise
+                wait = self._retry_after(e) or min(2 ** attempt, 60)
+                print(f"Embedding request throttled or failed ({type(e).__name__}), retrying in {wait:.1f}s")
+                time.sleep(wait)
+
+    def _embed_batch(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Embed one batch; on rejection, bisect so only bad items come back as None."""
+        try:
+            return self._create(texts)
+        except openai.BadRequestError as e:
+            if len(texts) == 1:
+                print(f"Error getting embedding: {str(e)}")
+                return [None]
+            mid = len(texts) // 2
+            return self._embed_batch(texts[:mid]) + self._embed_batch(texts[mid:])
+        except Exception as e:
+            print(f"Error getting embeddings for batch of {len(texts)}: {str(e)}")
+            return [None] * len(texts)
+
+    def embed(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Embed texts; the result is aligned with the input, None for failures."""
+        if self.cache is None:
+            return self._embed_uncached(texts)
+        results = self.cache.get_many(self.model, texts)
+        missing = [i for i, embedding in enumerate(results) if embedding is None]
+        if missing:
+            fresh = self._embed_uncached([texts[i] for i in missing])
+            self.cache.put_many(self.model, [texts[i] for i in missing], fresh)
+            for i, embedding in zip(missing, fresh):
+                results[i] = embedding
+        return results
+
+    def _embed_uncached(self, texts: List[str]) -> List[Optional[List[float]]]:
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        batches = self.make_batches(texts)
+        if not batches:
+            return results
+        with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(batches))) as executor:
+            futures = {
+                executor.submit(self._embed_batch, [texts[i] for i in batch]): batch
+                for batch in batches
+            }
+            for future, batch in futures.items():
+                for i, embedding in zip(batch, future.result()):
+                    results[i] = embedding
+        return results
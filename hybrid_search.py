@@ -0,0 +1,202 @@
+import os
+import asyncio
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from index_profiles import load_index_profile, embedding_kwargs, embedding_cache_model
+
+SEARCH_API_VERSION = "2023-11-01"
+
+# Fields the result formatters read; content and content_vector stay on the server
+DEFAULT_SELECT = ("id", "title")
+
+# Hits per request, and how many pages to read while looking for distinct documents
+PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+MAX_PAGES = int(os.getenv("SEARCH_MAX_PAGES", "5"))
+
+# Connections kept open to the search endpoint, and (connect, read) timeouts in seconds
+POOL_SIZE = int(os.getenv("SEARCH_POOL_SIZE", "10"))
+TIMEOUT = (float(os.getenv("SEARCH_CONNECT_TIMEOUT", "3.05")), float(os.getenv("SEARCH_READ_TIMEOUT", "10")))
+
+_query_embeddings = None
+_search_client = None
+_async_search_client = None
+_client_lock = threading.Lock()
+
+
+def query_embeddings():
+    """Shared query embedder matching the index profile, backed by the embedding cache."""
+    global _query_embeddings
+    if _query_embeddings is None:
+        from langchain_openai import AzureOpenAIEmbeddings
+
+        profile = load_index_profile()
+        embeddings = AzureOpenAIEmbeddings(
+            **embedding_kwargs(profile),
+            openai_api_key=os.getenv("AZURE_API_KEY"),
+            azure_endpoint=os.getenv("AZURE_ENDPOINT"),
+            openai_api_type="azure"
+        )
+        _query_embeddings = CachedEmbeddings(embeddings, embedding_cache_model(profile), EmbeddingCache())
+    return _query_embeddings
+
+
+def make_session(pool_size: int = POOL_SIZE) -> requests.Session:
+    """Keep-alive session whose pool reuses warm TLS connections across turns."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip", "Connection": "keep-alive"})
+    return session
+
+
+class HybridSearchClient:
+    """Keyword + vector queries against an Azure AI Search index over REST.
+
+    ``search`` returns at most ``top_docs`` hits, one per document, best
+    first. Hits are read in small pages carrying only the ``select`` fields,
+    and paging stops as soon as enough distinct documents have been seen, so
+    a turn moves kilobytes instead of every matching chunk. Without an
+    embedder, or if embedding the query fails, the query is keyword-only.
+
+    Requests go through one pooled keep-alive session with timeouts and gzip
+    responses, so share a client rather than building one per call.
+    """
+
+    def __init__(self, endpoint: str, api_key: str, index_name: str, embeddings=None,
+                 select: Sequence[str] = DEFAULT_SELECT, vector_field: str = "content_vector",
+                 group_field: str = "title", page_size: int = PAGE_SIZE, max_pages: int = MAX_PAGES,
+                 api_version: str = SEARCH_API_VERSION, session: requests.Session = None,
+                 timeout=TIMEOUT):
+        self.url = f"{endpoint}/indexes/{index_name}/docs/search?api-version={api_version}"
+        self.headers = {"Content-Type": "application/json", "api-key": api_key}
+        self.embeddings = embeddings
+        self.select = list(select)
+        if group_field not in self.select:
+            self.select.append(group_field)
+        self.vector_field = vector_field
+        self.group_field = group_field
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.session = session if session is not None else make_session()
+        self.timeout = timeout
+
+    def embed_query(self, text: str) -> Optional[List[float]]:
+        if self.embeddings is None:
+            return None
+        try:
+            return self.embeddings.embed_query(text)
+        except Exception as e:
+            print(f"Error embedding search query, falling back to keyword search: {str(e)}")
+            return None
+
+    def build_query(self, text: str, vector: Optional[List[float]], skip: int = 0) -> Dict:
+        query = {
+            "search": text,
+            "select": ",".join(self.select),
+            "top": self.page_size,
+            "skip": skip
+        }
+        if vector is not None:
+            # Enough vector candidates to cover every page that may be read
+            query["vectorQueries"] = [{
+                "kind": "vector",
+                "vector": vector,
+                "fields": self.vector_field,
+                "k": self.page_size * self.max_pages
+            }]
+        return query
+
+    def post(self, query: Dict) -> Dict:
+        res = self.session.post(self.url, headers=self.headers, json=query, timeout=self.timeout)
+        res.raise_for_status()
+        return res.json()
+
+    def _collect(self, best: Dict[str, Dict], hits: List[Dict], top_docs: int) -> bool:
+        """Add a page of hits to best; return True when no further page is needed."""
+        # Hits arrive best first, so the first hit of a document is its best chunk
+        for hit in hits:
+            key = hit.get(self.group_field) or hit.get("id")
+            if key not in best:
+                best[key] = hit
+        return len(best) >= top_docs or len(hits) < self.page_size
+
+    def search(self, text: str, top_docs: int = 5) -> List[Dict]:
+        """Return the best hit of each of the top ``top_docs`` documents.
+
+        Raises requests.exceptions.RequestException if the service call fails.
+        """
+        vector = self.embed_query(text)
+        best: Dict[str, Dict] = {}
+        for page in range(self.max_pages):
+            hits = self.post(self.build_query(text, vector, skip=page * self.page_size)).get("value", [])
+            if self._collect(best, hits, top_docs):
+                break
+        return list(best.values())[:top_docs]
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncHybridSearchClient(HybridSearchClient):
+    """HybridSearchClient for async callers, on a pooled httpx.AsyncClient."""
+
+    def __init__(self, endpoint: str, api_key: str, index_name: str, embeddings=None, **kwargs):
+        import httpx
+
+        timeout = kwargs.pop("timeout", TIMEOUT)
+        session = httpx.AsyncClient(
+            headers={"Content-Type": "application/json", "api-key": api_key, "Accept-Encoding": "gzip"},
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+            limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE)
+        )
+        super().__init__(endpoint, api_key, index_name, embeddings=embeddings, session=session,
+                         timeout=timeout, **kwargs)
+
+    async def post(self, query: Dict) -> Dict:
+        res = await self.session.post(self.url, json=query)
+        res.raise_for_status()
+        return res.json()
+
+    async def search(self, text: str, top_docs: int = 5) -> List[Dict]:
+        """Async ``search``; raises httpx.HTTPError if the service call fails."""
+        # The embedding cache and client are synchronous, so keep them off the event loop
+        vector = await asyncio.to_thread(self.embed_query, text)
+        best: Dict[str, Dict] = {}
+        for page in range(self.max_pages):
+            hits = (await self.post(self.build_query(text, vector, skip=page * self.page_size))).get("value", [])
+            if self._collect(best, hits, top_docs):
+                break
+        return list(best.values())[:top_docs]
+
+    async def close(self):
+        await self.session.aclose()
+
+
+def _client_settings():
+    return os.getenv("AZURE_SEARCH_ENDPOINT"), os.getenv("AZURE_SEARCH_KEY"), os.getenv("AZURE_SEARCH_INDEX")
+
+
+def get_search_client() -> HybridSearchClient:
+    """Process-wide client for the index named by the AZURE_SEARCH_* settings."""
+    global _search_client
+    if _search_client is None:
+        with _client_lock:
+            if _search_client is None:
+                _search_client = HybridSearchClient(*_client_settings(), embeddings=query_embeddings())
+    return _search_client
+
+
+def get_async_search_client() -> AsyncHybridSearchClient:
+    """Process-wide async client, for the Chainlit path."""
+    global _async_search_client
+    if _async_search_client is None:
+        with _client_lock:
+            if _async_search_client is None:
+                _async_search_client = AsyncHybridSearchClient(*_client_settings(), embeddings=query_embeddings())
+    return _async_search_client
@@ -1,22 +1,21 @@
 # index_blob_docs.py
 
 import os
-import tempfile
+import argparse
 import openai
 from dotenv import load_dotenv
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import ResourceNotFoundError
 from azure.search.documents import SearchClient
 from azure.search.documents.indexes import SearchIndexClient
-from azure.search.documents.indexes.models import (
-    SearchIndex, SearchField, SearchFieldDataType,
-    SimpleField, SearchableField, VectorSearch,
-    VectorSearchAlgorithmKind, HnswParameters,
-    HnswAlgorithmConfiguration, VectorSearchProfile
-)
 from azure.storage.blob import ContainerClient
-from langchain_community.document_loaders import PyPDFLoader, UnstructuredPowerPointLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import AzureOpenAIEmbeddings
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from chunking import TokenChunker
+from text_extraction import iter_document_units, open_blob_stream
+from search_indexer import SearchIndexWriter
+from blob_manifest import BlobManifest
+from index_profiles import load_index_profile, build_index, layout_changes, embedding_kwargs, embedding_cache_model
 import re
 
 # Load .env
@@ -30,6 +29,10 @@ AZURE_STORAGE_CONTAINER = os.getenv("AZURE_STORAGE_CONTAINER")
 AZURE_SEARCH_INDEX = os.getenv("AZURE_SEARCH_INDEX", "doc-index")
 AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_ENDPOINT")
 AZURE_OPENAI_KEY = os.getenv("AZURE_API_KEY")
+# Blob etags and chunk counts recorded by the last indexing run
+CHECKPOINT_PATH = os.getenv("INDEX_CHECKPOINT_PATH", f"{AZURE_SEARCH_INDEX}_checkpoint.json")
+# HNSW parameters, vector compression and embedding size (see index_profiles.py)
+INDEX_PROFILE = load_index_profile()
 # Set OpenAI config
 openai.api_type = "azure"
 openai.api_base = AZURE_OPENAI_ENDPOINT
@@ -37,89 +40,164 @@ openai.api_version = "2023-05-15"
 openai.api_key = AZURE_OPENAI_KEY
 
 embedding_model = AzureOpenAIEmbeddings(
-    deployment="text-embedding-ada-002",
+    **embedding_kwargs(INDEX_PROFILE),
     openai_api_key=AZURE_OPENAI_KEY,
     azure_endpoint=AZURE_OPENAI_ENDPOINT,
-    openai_api_type="azure",
-    openai_api_version="2023-05-15"
+    openai_api_type="azure"
 )
 
-def create_index():
-    index_client = SearchIndexClient(AZURE_SEARCH_ENDPOINT, AzureKeyCredential(AZURE_SEARCH_KEY))
-
-    fields = [
-        SimpleField(name="id", type=SearchFieldDataType.String, key=True),
-        SearchableField(name="title", type=SearchFieldDataType.String),
-        SearchableField(name="content", type=SearchFieldDataType.String),
-        SearchField(
-            name="content_vector",
-            type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
-            vector_search_dimensions=1536,
-            vector_search_profile_name="my-vector-profile"
-        )
-    ]
+# Reuse embeddings for unchanged chunk text across runs
+embedding_cache = EmbeddingCache()
+embedding_model = CachedEmbeddings(embedding_model, embedding_cache_model(INDEX_PROFILE), embedding_cache)
 
-    vector_search = VectorSearch(
-        algorithms=[
-            HnswAlgorithmConfiguration(
-                name="my-hnsw",
-                kind=VectorSearchAlgorithmKind.HNSW,
-                parameters=HnswParameters(metric="cosine", m=4)  # efConstruction removed due to Azure SDK warning
+def create_index(profile=INDEX_PROFILE, recreate=False):
+    index_client = SearchIndexClient(AZURE_SEARCH_ENDPOINT, AzureKeyCredential(AZURE_SEARCH_KEY))
+    index = build_index(AZURE_SEARCH_INDEX, profile)
+
+    # The vector field of an existing index cannot be changed in place
+    try:
+        changes = layout_changes(index_client.get_index(AZURE_SEARCH_INDEX), profile)
+    except ResourceNotFoundError:
+        changes = []
+    if changes:
+        if not recreate:
+            raise RuntimeError(
+                f"Index '{AZURE_SEARCH_INDEX}' was built with a different vector layout "
+                f"({'; '.join(changes)}). Rebuild it with --recreate, which deletes and re-indexes "
+                f"every document, or set INDEX_PROFILE to the profile it was built with."
             )
-        ],
-        profiles=[
-            VectorSearchProfile(name="my-vector-profile", algorithm_configuration_name="my-hnsw")
-        ]
-    )
-
-    index = SearchIndex(
-        name=AZURE_SEARCH_INDEX,
-        fields=fields,
-        vector_search=vector_search
-    )
-
-    print(f"🔧 Creating index: {AZURE_SEARCH_INDEX}")
+        print(f"🗑️ Deleting index {AZURE_SEARCH_INDEX} to rebuild it ({'; '.join(changes)})")
+        index_client.delete_index(AZURE_SEARCH_INDEX)
+        # Every blob has to be indexed again
+        if os.path.exists(CHECKPOINT_PATH):
+            os.remove(CHECKPOINT_PATH)
+
+    print(f"🔧 Creating index: {AZURE_SEARCH_INDEX} (profile '{profile['name']}')")
     index_client.create_or_update_index(index)
     print("✅ Index created.")
 
-def index_documents():
+def safe_key(blob_name):
+    return re.sub(r'[^A-Za-z0-9_\-=]', '_', blob_name)
+
+def chunk_ids(blob_name, count):
+    return [f"{safe_key(blob_name)}-{i}" for i in range(count)]
+
+def indexed_chunk_ids(search_client):
+    """Map each title in the index to its chunk ids.
+
+    Only used when there is no checkpoint yet, so chunks left by earlier
+    runs can still be found and cleaned up.
+    """
+    ids = {}
+    for doc in search_client.search(search_text="*", select=["id", "title"]):
+        ids.setdefault(doc.get("title") or "", []).append(doc["id"])
+    return ids
+
+def index_documents(sync=False):
     blob_client = ContainerClient.from_connection_string(AZURE_STORAGE_CONN, AZURE_STORAGE_CONTAINER)
     search_client = SearchClient(AZURE_SEARCH_ENDPOINT, AZURE_SEARCH_INDEX, AzureKeyCredential(AZURE_SEARCH_KEY))
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    # Blob etags and chunk counts from the last run
+    checkpoint = BlobManifest(CHECKPOINT_PATH)
 
-    for blob in blob_client.list_blobs():
-        if not (blob.name.lower().endswith(".pdf") or blob.name.lower().endswith(".pptx")):
-            continue
+    blobs = [
+        blob for blob in blob_client.list_blobs()
+        if blob.name.lower().endswith(".pdf") or blob.name.lower().endswith(".pptx")
+    ]
 
+    if checkpoint.entries:
+        previous_ids = {name: chunk_ids(name, entry.get("chunks", 0)) for name, entry in checkpoint.entries.items()}
+    else:
+        print("🔎 No checkpoint found, reading chunk ids from the index")
+        previous_ids = indexed_chunk_ids(search_client)
+
+    names = {blob.name for blob in blobs}
+    deleted = [name for name in previous_ids if name not in names]
+    if sync:
+        added, changed, _ = checkpoint.diff(blobs)
+        to_index = added + changed
+        print(f"🔄 Sync: {len(added)} added, {len(changed)} changed, {len(deleted)} deleted")
+    else:
+        to_index = blobs
+
+    # Same extractors and token-aware chunking as DocumentVectorizer
+    chunker = TokenChunker()
+
+    # Embeds and uploads chunks in batches from background workers
+    writer = SearchIndexWriter(search_client, embedding_model)
+    key_owners = {}
+    chunk_counts = {}
+    unreadable = set()
+
+    for blob in to_index:
         print(f"\n📄 Processing: {blob.name}")
-        blob_data = blob_client.get_blob_client(blob).download_blob().readall()
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(blob.name)[-1]) as tmp_file:
-            tmp_file.write(blob_data)
-            path = tmp_file.name
-
-        if path.lower().endswith(".pdf"):
-            loader = PyPDFLoader(path)
-        else:
-            loader = UnstructuredPowerPointLoader(path)
-        docs = loader.load_and_split(text_splitter)
-
-        for i, chunk in enumerate(docs):
-            safe_blob_name = re.sub(r'[^A-Za-z0-9_\-=]', '_', blob.name)
-            vector = embedding_model.embed_query(chunk.page_content)
-            doc = {
-                "id": f"{safe_blob_name}-{i}",
+        key_owners[safe_key(blob.name)] = blob.name
+        # Parsed straight from the download; only very large blobs spill to disk
+        try:
+            with open_blob_stream(blob_client.get_blob_client(blob)) as stream:
+                chunks = list(chunker.chunk_units(iter_document_units(blob.name, stream)))
+        except Exception as e:
+            # Nothing is uploaded and the checkpoint entry is kept so the next run tries again
+            print(f"❌ Failed to read {blob.name}: {str(e)}")
+            unreadable.add(blob.name)
+            continue
+        new_ids = chunk_ids(blob.name, len(chunks))
+        for key, chunk in zip(new_ids, chunks):
+            writer.add({
+                "id": key,
                 "title": blob.name,
-                "content": chunk.page_content,
-                "content_vector": vector
-            }
-            search_client.upload_documents(documents=[doc])
-
-        os.remove(path)
-        print(f"✅ Indexed: {blob.name}")
+                "content": chunk["text"]
+            })
+        chunk_counts[blob.name] = len(new_ids)
+
+        # Chunks past the new end are left over from a longer previous version
+        stale = set(previous_ids.get(blob.name, [])) - set(new_ids)
+        for key in sorted(stale):
+            writer.delete(key)
+
+        print(f"📤 Queued: {blob.name} ({len(new_ids)} chunks, {len(stale)} stale)")
+
+    for name in deleted:
+        key_owners[safe_key(name)] = name
+        for key in previous_ids.get(name, []):
+            writer.delete(key)
+        print(f"🗑️ Removing: {name}")
+
+    report = writer.close()
+    print(f"\n✅ Indexed {report['succeeded']} chunks, deleted {report['deleted']}, {report['failed']} failed")
+    failed_blobs = set()
+    for failure in report["failures"]:
+        print(f"❌ {failure['key']}: {failure['status_code']} {failure['error']}")
+        failed_blobs.add(key_owners.get(failure["key"].rsplit("-", 1)[0]))
+
+    # Blobs that failed to read or upload keep their old entry so the next sync retries them
+    failed_blobs |= unreadable
+    if not sync:
+        checkpoint.entries = {name: entry for name, entry in checkpoint.entries.items() if name in failed_blobs}
+    for blob in to_index:
+        if blob.name in chunk_counts and blob.name not in failed_blobs:
+            checkpoint.update(blob, chunks=chunk_counts[blob.name])
+    for name in deleted:
+        if name not in failed_blobs:
+            checkpoint.remove(name)
+    checkpoint.save()
+
+    stats = embedding_cache.stats()
+    print(f"🧠 Embedding cache: {stats['hits']} hits, {stats['misses']} misses")
 
 if __name__ == "__main__":
-    create_index()
-    index_documents()
+    parser = argparse.ArgumentParser(description="Index blob documents into Azure AI Search")
+    parser.add_argument("--sync", action="store_true",
+                        help="Only re-index blobs changed since the last checkpoint and delete stale chunks")
+    parser.add_argument("--recreate", action="store_true",
+                        help="Delete and rebuild the index if its vector layout differs from INDEX_PROFILE")
+    args = parser.parse_args()
+
+    if not args.sync or args.recreate:
+        try:
+            create_index(recreate=args.recreate)
+        except RuntimeError as e:
+            print(f"❌ {str(e)}")
+            raise SystemExit(1)
+    index_documents(sync=args.sync)
     print(f"\n📦 All documents embedded and indexed into '{AZURE_SEARCH_INDEX}'")
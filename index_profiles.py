@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import argparse
+from typing import Dict, List
+
+import numpy as np
+from azure.search.documents.indexes.models import (
+    SearchIndex, SearchField, SearchFieldDataType,
+    SimpleField, SearchableField, VectorSearch,
+    VectorSearchAlgorithmKind, HnswParameters,
+    HnswAlgorithmConfiguration, VectorSearchProfile,
+    ScalarQuantizationCompression, ScalarQuantizationParameters,
+    BinaryQuantizationCompression
+)
+
+try:
+    from azure.search.documents.indexes.models import RescoringOptions
+except ImportError:  # SDKs before 11.6 set rescoring on the compression itself
+    RescoringOptions = None
+
+# Dimensions of text-embedding-ada-002 and the text-embedding-3 models' default size
+FULL_DIMENSIONS = 1536
+
+# Named index profiles. compression is None, "scalar" (int8) or "binary"; a
+# compressed index keeps the original vectors for rescoring, oversampling
+# the quantized candidates by ``oversampling``. stored=False drops the
+# retrievable copy of each vector, which nothing reads back. dimensions below
+# 1536 need an embedding deployment that supports shortened embeddings
+# (text-embedding-3-*).
+INDEX_PROFILES: Dict[str, Dict] = {
+    "baseline": {
+        "m": 4, "ef_construction": 400, "ef_search": 500,
+        "compression": None, "oversampling": None, "stored": True,
+        "dimensions": FULL_DIMENSIONS, "embedding_deployment": "text-embedding-ada-002"
+    },
+    "balanced": {
+        "m": 16, "ef_construction": 400, "ef_search": 500,
+        "compression": "scalar", "oversampling": 4.0, "stored": False,
+        "dimensions": FULL_DIMENSIONS, "embedding_deployment": "text-embedding-ada-002"
+    },
+    "compact": {
+        "m": 16, "ef_construction": 400, "ef_search": 800,
+        "compression": "binary", "oversampling": 10.0, "stored": False,
+        "dimensions": FULL_DIMENSIONS, "embedding_deployment": "text-embedding-ada-002"
+    },
+    "reduced": {
+        "m": 16, "ef_construction": 400, "ef_search": 500,
+        "compression": "scalar", "oversampling": 4.0, "stored": False,
+        "dimensions": 512, "embedding_deployment": "text-embedding-3-large"
+    }
+}
+
+# The layout indexes were created with before profiles existed; the vector field of an
+# existing index cannot be changed in place, so other profiles need a rebuilt index
+DEFAULT_PROFILE = "baseline"
+
+
+def load_index_profile(name: str = None) -> Dict:
+    """Return the profile named by INDEX_PROFILE (default "baseline").
+
+    A JSON file at INDEX_PROFILE_PATH may add profiles or override fields of
+    the built-in ones, e.g. {"balanced": {"m": 32}}.
+    """
+    profiles = {key: dict(value) for key, value in INDEX_PROFILES.items()}
+    path = os.getenv("INDEX_PROFILE_PATH")
+    if path:
+        with open(path, 'r') as f:
+            for key, overrides in json.load(f).items():
+                profiles[key] = {**profiles.get(key, profiles[DEFAULT_PROFILE]), **overrides}
+    name = name or os.getenv("INDEX_PROFILE", DEFAULT_PROFILE)
+    if name not in profiles:
+        raise ValueError(f"Unknown index profile '{name}'. Available: {', '.join(sorted(profiles))}")
+    return {"name": name, **profiles[name]}
+
+
+def embedding_kwargs(profile: Dict) -> Dict:
+    """Keyword arguments for AzureOpenAIEmbeddings that match the profile."""
+    kwargs = {"deployment": profile["embedding_deployment"], "openai_api_version": "2023-05-15"}
+    if profile["dimensions"] != FULL_DIMENSIONS:
+        # The dimensions parameter needs a newer API version
+        kwargs["dimensions"] = profile["dimensions"]
+        kwargs["openai_api_version"] = "2024-02-01"
+    return kwargs
+
+
+def embedding_cache_model(profile: Dict) -> str:
+    """Embedding cache namespace; shortened embeddings must not share entries with full ones."""
+    if profile["dimensions"] != FULL_DIMENSIONS:
+        return f"{profile['embedding_deployment']}:{profile['dimensions']}"
+    return profile["embedding_deployment"]
+
+
+def _rescoring(profile: Dict) -> Dict:
+    """Compression keyword arguments that rescore candidates with the original vectors."""
+    if RescoringOptions is None:
+        return {"rerank_with_original_vectors": True, "default_oversampling": profile["oversampling"]}
+    return {"rescoring_options": RescoringOptions(
+        enable_rescoring=True,
+        default_oversampling=profile["oversampling"],
+        rescore_storage_method="preserveOriginals"
+    )}
+
+
+def build_index(name: str, profile: Dict) -> SearchIndex:
+    """Build the index definition (fields and vector search) for a profile."""
+    compression_name = None
+    compressions = []
+    if profile["compression"] == "scalar":
+        compression_name = "my-scalar-compression"
+        compressions.append(ScalarQuantizationCompression(
+            compression_name=compression_name,
+            parameters=ScalarQuantizationParameters(quantized_data_type="int8"),
+            **_rescoring(profile)
+        ))
+    elif profile["compression"] == "binary":
+        compression_name = "my-binary-compression"
+        compressions.append(BinaryQuantizationCompression(
+            compression_name=compression_name,
+            **_rescoring(profile)
+        ))
+    elif profile["compression"] is not None:
+        raise ValueError(f"Unknown compression '{profile['compression']}'")
+
+    fields = [
+        SimpleField(name="id", type=SearchFieldDataType.String, key=True),
+        SearchableField(name="title", type=SearchFieldDataType.String),
+        SearchableField(name="content", type=SearchFieldDataType.String),
+        SearchField(
+            name="content_vector",
+            type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+            searchable=True,
+            stored=profile["stored"],
+            vector_search_dimensions=profile["dimensions"],
+            vector_search_profile_name="my-vector-profile"
+        )
+    ]
+
+    vector_search = VectorSearch(
+        algorithms=[
+            HnswAlgorithmConfiguration(
+                name="my-hnsw",
+                kind=VectorSearchAlgorithmKind.HNSW,
+                parameters=HnswParameters(
+                    metric="cosine",
+                    m=profile["m"],
+                    ef_construction=profile["ef_construction"],
+                    ef_search=profile["ef_search"]
+                )
+            )
+        ],
+        profiles=[
+            VectorSearchProfile(
+                name="my-vector-profile",
+                algorithm_configuration_name="my-hnsw",
+                compression_name=compression_name
+            )
+        ],
+        compressions=compressions or None
+    )
+
+    return SearchIndex(name=name, fields=fields, vector_search=vector_search)
+
+
+def _vector_layout(index: SearchIndex) -> Dict:
+    """Settings of the content_vector field that Azure AI Search cannot update in place."""
+    field = next((f for f in index.fields if f.name == "content_vector"), None)
+    if field is None:
+        return {}
+    vector_search = index.vector_search
+    profile = next((p for p in (vector_search.profiles or []) if p.name == field.vector_search_profile_name), None)
+    compression_name = profile.compression_name if profile else None
+    compression = next((c for c in (vector_search.compressions or []) if c.compression_name == compression_name), None)
+    if isinstance(compression, ScalarQuantizationCompression):
+        compression = "scalar"
+    elif isinstance(compression, BinaryQuantizationCompression):
+        compression = "binary"
+    return {
+        "dimensions": field.vector_search_dimensions,
+        # The service reports an unset stored attribute as None, which means stored
+        "stored": field.stored is not False,
+        "compression": compression
+    }
+
+
+def layout_changes(existing: SearchIndex, profile: Dict) -> List[str]:
+    """Differences between an existing index's vector field and the profile.
+
+    Any difference means the index has to be deleted and rebuilt to use the
+    profile; create_or_update_index rejects the change.
+    """
+    current = _vector_layout(existing)
+    if not current:
+        return ["content_vector field is missing"]
+    wanted = _vector_layout(build_index(existing.name, profile))
+    return [f"{key}: index has {current[key]}, profile '{profile['name']}' has {wanted[key]}"
+            for key in wanted if current[key] != wanted[key]]
+
+
+def _prepare(vectors: np.ndarray, dimensions: int) -> np.ndarray:
+    """Shorten vectors to the profile's dimensions and re-normalize them."""
+    vectors = vectors[:, :dimensions]
+    norms = np.linalg.norm(vectors, axis=1)
+    return vectors / np.where(norms > 0, norms, 1.0)[:, None]
+
+
+def benchmark_profiles(index_client, search_client_factory, vectors: np.ndarray, profiles: List[Dict],
+                       k: int = 10, num_queries: int = 200, index_prefix: str = "profile-bench",
+                       keep: bool = False, seed: int = 0) -> List[Dict]:
+    """Measure recall@k and query latency of each profile against brute force.
+
+    Every profile gets a scratch index loaded with the same vectors. Queries
+    are rows of ``vectors`` and ground truth is an exact cosine scan of the
+    full-dimension vectors, so reduced profiles are scored against what they
+    approximate. Shortening stored ada-002 vectors only approximates a
+    text-embedding-3 model's shortened output.
+    """
+    from azure.search.documents.models import VectorizedQuery
+
+    rng = np.random.default_rng(seed)
+    normalized = _prepare(np.asarray(vectors, dtype=np.float32), vectors.shape[1])
+    picks = rng.choice(len(normalized), min(num_queries, len(normalized)), replace=False)
+
+    truth, brute_times = [], []
+    for p in picks:
+        started = time.perf_counter()
+        scores = normalized @ normalized[p]
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+        truth.append({int(i) for i in top})
+        brute_times.append(time.perf_counter() - started)
+
+    report = [{'profile': 'brute_force', 'recall': 1.0,
+               'mean_ms': 1000 * float(np.mean(brute_times)), 'p95_ms': 1000 * float(np.percentile(brute_times, 95))}]
+    for profile in profiles:
+        name = f"{index_prefix}-{profile['name']}"
+        index_client.create_or_update_index(build_index(name, profile))
+        search_client = search_client_factory(name)
+        try:
+            prepared = _prepare(normalized, profile["dimensions"])
+            for start in range(0, len(prepared), 200):
+                search_client.upload_documents(documents=[
+                    {"id": str(i), "content_vector": prepared[i].tolist()}
+                    for i in range(start, min(start + 200, len(prepared)))
+                ])
+            # Uploads are searchable shortly after they are accepted
+            deadline = time.monotonic() + 300
+            while search_client.get_document_count() < len(prepared) and time.monotonic() < deadline:
+                time.sleep(2)
+
+            hits, times = 0, []
+            for p, expected in zip(picks, truth):
+                query = VectorizedQuery(vector=prepared[p].tolist(), k_nearest_neighbors=k, fields="content_vector")
+                started = time.perf_counter()
+                results = list(search_client.search(search_text=None, vector_queries=[query], select=["id"], top=k))
+                times.append(time.perf_counter() - started)
+                hits += len({int(r["id"]) for r in results} & expected)
+            report.append({
+                'profile': profile['name'], 'recall': hits / (k * len(picks)),
+                'mean_ms': 1000 * float(np.mean(times)), 'p95_ms': 1000 * float(np.percentile(times, 95))
+            })
+        finally:
+            if not keep:
+                index_client.delete_index(name)
+    return report
+
+
+def main():
+    from dotenv import load_dotenv
+    from azure.core.credentials import AzureKeyCredential
+    from azure.search.documents import SearchClient
+    from azure.search.documents.indexes import SearchIndexClient
+    from vector_store import VectorStore, ResidentIndex
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Benchmark Azure AI Search index profiles against brute force")
+    parser.add_argument('container', help="container whose local vector store supplies the vectors")
+    parser.add_argument('--vectors-dir', default="vectors")
+    parser.add_argument('--profiles', nargs='+', default=sorted(INDEX_PROFILES))
+    parser.add_argument('--docs', type=int, default=20000, help="vectors loaded into each scratch index")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--keep', action='store_true', help="keep the scratch indexes afterwards")
+    args = parser.parse_args()
+
+    resident = ResidentIndex(VectorStore(os.path.join(args.vectors_dir, args.container)))
+    if not len(resident):
+        print(f"No vectors found for container {args.container}")
+        return
+    rng = np.random.default_rng(0)
+    sample = resident.vectors[np.sort(rng.choice(len(resident), min(args.docs, len(resident)), replace=False))]
+
+    endpoint = os.getenv("AZURE_SEARCH_ENDPOINT")
+    credential = AzureKeyCredential(os.getenv("AZURE_SEARCH_KEY"))
+    index_client = SearchIndexClient(endpoint, credential)
+    report = benchmark_profiles(
+        index_client,
+        lambda name: SearchClient(endpoint, name, credential),
+        sample,
+        [load_index_profile(name) for name in args.profiles],
+        k=args.k, num_queries=args.queries, keep=args.keep
+    )
+    print(f"{'profile':>12} {'recall@' + str(args.k):>10} {'mean ms':>9} {'p95 ms':>9}")
+    for row in report:
+        print(f"{row['profile']:>12} {row['recall']:>10.3f} {row['mean_ms']:>9.2f} {row['p95_ms']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import io
+import os
+import time
+import signal
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from text_extraction import iter_document_units
+from chunking import TokenChunker
+
+# SIGALRM lets a worker abort its own extraction; elsewhere stuck files are abandoned
+HAS_ALARM = hasattr(signal, "SIGALRM")
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise ExtractionTimeout()
+
+
+def extract_chunks(blob_name: str, payload, chunker: TokenChunker, timeout: float = 0) -> List[Dict]:
+    """Extract and chunk one document inside a worker process.
+
+    payload is either the blob's bytes or the path of a temporary file holding
+    them. The file is left for the caller to remove once the result has been
+    consumed, so the document can be resubmitted if the pool breaks.
+    """
+    if HAS_ALARM and timeout:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        if isinstance(payload, bytes):
+            stream = io.BytesIO(payload)
+        else:
+            stream = open(payload, 'rb')
+        with stream:
+            return list(chunker.chunk_units(iter_document_units(blob_name, stream)))
+    finally:
+        if HAS_ALARM and timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def download_blob(container_client, blob, inline_max_bytes: int):
+    """Download a blob as bytes, or into a temporary file when it is large."""
+    downloader = container_client.get_blob_client(blob.name).download_blob(max_concurrency=4)
+    if blob.size is not None and blob.size <= inline_max_bytes:
+        return downloader.readall()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(blob.name)[-1]) as tmp_file:
+        downloader.readinto(tmp_file)
+        return tmp_file.name
+
+
+def _discard(payload):
+    if isinstance(payload, str) and os.path.exists(payload):
+        os.remove(payload)
+
+
+class IngestPipeline:
+    """Download thread pool feeding a process pool for extraction and OCR.
+
+    ``run`` yields (blob, chunks) as documents finish extracting; the caller
+    embeds them before asking for the next one. At most ``max_pending``
+    documents, holding at most ``max_inflight_bytes`` of blob data, are
+    downloaded or extracted ahead of the caller, so a slow embedding stage
+    throttles downloads instead of filling memory. Blobs above
+    ``inline_max_bytes`` reach the workers as a temporary file path rather
+    than pickled bytes. Extraction of a single file is aborted after
+    ``file_timeout`` seconds.
+
+    If a worker dies (a crash or the OOM killer) the pool is rebuilt and the
+    documents that were on it are retried one at a time in a single-worker
+    pool, where a second crash singles out the document that caused it; only
+    that document is skipped.
+    """
+
+    def __init__(self, download_workers: int = 8, extract_workers: int = None,
+                 file_timeout: float = 300, max_pending: int = None,
+                 inline_max_bytes: int = 1024 * 1024, max_inflight_bytes: int = 256 * 1024 * 1024,
+                 chunker: TokenChunker = None):
+        self.download_workers = download_workers
+        self.extract_workers = extract_workers or os.cpu_count() or 1
+        self.file_timeout = file_timeout
+        self.max_pending = max_pending or self.download_workers + self.extract_workers
+        self.inline_max_bytes = inline_max_bytes
+        self.max_inflight_bytes = max_inflight_bytes
+        self.chunker = chunker or TokenChunker()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """Build a pipeline from INGEST_* environment variables."""
+        extract_workers = os.getenv('INGEST_EXTRACT_WORKERS')
+        return cls(
+            download_workers=int(os.getenv('INGEST_DOWNLOAD_WORKERS', '8')),
+            extract_workers=int(extract_workers) if extract_workers else None,
+            file_timeout=float(os.getenv('INGEST_FILE_TIMEOUT', '300')),
+            max_inflight_bytes=int(os.getenv('INGEST_MAX_INFLIGHT_MB', '256')) * 1024 * 1024,
+            **kwargs
+        )
+
+    def _abandon_after(self) -> float:
+        # Without SIGALRM a queued task's wait counts too, so allow for the queue ahead of it
+        return self.file_timeout * (1 + self.max_pending / self.extract_workers)
+
+    @staticmethod
+    def _terminate(executor: ProcessPoolExecutor):
+        """Stop a pool without waiting for its workers, killing any that are still busy."""
+        processes = list((getattr(executor, '_processes', None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    def run(self, container_client, blobs: Iterable) -> Iterator[Tuple[object, List[Dict]]]:
+        blob_iter = iter(blobs)
+        held = []  # next blob, waiting for in-flight bytes to drop
+        # future -> (blob, stage, payload, submitted_at); stage is 'download', 'extract'
+        # or 'isolate' (retried alone after the pool broke)
+        in_flight = {}
+        inflight_bytes = 0
+        downloads = ThreadPoolExecutor(max_workers=self.download_workers)
+        pools = {'extract': ProcessPoolExecutor(max_workers=self.extract_workers), 'isolate': None}
+
+        def fill():
+            nonlocal inflight_bytes
+            while len(in_flight) < self.max_pending:
+                blob = held.pop() if held else next(blob_iter, None)
+                if blob is None:
+                    return
+                size = blob.size or 0
+                # One document always goes through, however large it is
+                if in_flight and inflight_bytes + size > self.max_inflight_bytes:
+                    held.append(blob)
+                    return
+                inflight_bytes += size
+                future = downloads.submit(download_blob, container_client, blob, self.inline_max_bytes)
+                in_flight[future] = (blob, 'download', None, time.monotonic())
+
+        def finish(blob, payload=None):
+            nonlocal inflight_bytes
+            inflight_bytes -= blob.size or 0
+            _discard(payload)
+
+        def extract(blob, payload, stage='extract'):
+            if pools[stage] is None:
+                pools[stage] = ProcessPoolExecutor(max_workers=1)
+            future = pools[stage].submit(extract_chunks, blob.name, payload, self.chunker, self.file_timeout)
+            in_flight[future] = (blob, stage, payload, time.monotonic())
+
+        def unfinished(future):
+            # Futures that completed before the pool broke keep their result and are consumed as usual
+            if not future.done() or future.cancelled():
+                return True
+            return isinstance(future.exception(), BrokenProcessPool)
+
+        def restart(stage, skip=(), retry_stage=None):
+            """Replace a pool and resubmit, in order, what was queued or running on it except ``skip``."""
+            self._terminate(pools[stage])
+            pools[stage] = None if stage == 'isolate' else ProcessPoolExecutor(max_workers=self.extract_workers)
+            moved = sorted(((future, entry) for future, entry in in_flight.items()
+                            if entry[1] == stage and unfinished(future)),
+                           key=lambda item: item[1][3])
+            for future, (blob, _, payload, _) in moved:
+                in_flight.pop(future)
+                if blob.name in skip:
+                    finish(blob, payload)
+                else:
+                    extract(blob, payload, retry_stage or stage)
+
+        try:
+            fill()
+            while in_flight:
+                done, _ = wait(list(in_flight), timeout=1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    entry = in_flight.get(future)
+                    if entry is None:
+                        continue  # resubmitted after a pool restart
+                    blob, stage, payload, _ = entry
+                    if stage == 'download':
+                        in_flight.pop(future)
+                        try:
+                            payload = future.result()
+                        except Exception as e:
+                            print(f"Error reading blob {blob.name}: {str(e)}")
+                            finish(blob)
+                            fill()
+                            continue
+                        extract(blob, payload)
+                        continue
+
+                    try:
+                        chunks = future.result()
+                    except BrokenProcessPool:
+                        if stage == 'extract':
+                            print("An extraction worker died. Retrying its documents one at a time.")
+                            restart('extract', retry_stage='isolate')
+                        else:
+                            # One worker, first in first out: the oldest document was the one running
+                            culprit = min((e for f, e in in_flight.items() if e[1] == 'isolate' and unfinished(f)),
+                                          key=lambda e: e[3])[0]
+                            print(f"Extraction worker died on {culprit.name}. Skipping.")
+                            restart('isolate', skip={culprit.name})
+                        fill()
+                        continue
+                    except ExtractionTimeout:
+                        print(f"Timed out extracting {blob.name} after {self.file_timeout}s. Skipping.")
+                        chunks = None
+                    except UnicodeDecodeError:
+                        print(f"Warning: Could not decode {blob.name} as text. Skipping.")
+                        chunks = None
+                    except Exception as e:
+                        print(f"Error extracting text from {blob.name}: {str(e)}")
+                        chunks = None
+                    in_flight.pop(future)
+                    finish(blob, payload)
+                    fill()
+                    if chunks:
+                        yield blob, chunks
+
+                if not HAS_ALARM:
+                    now = time.monotonic()
+                    for stage in ('extract', 'isolate'):
+                        stuck = {entry[0].name for future, entry in in_flight.items()
+                                 if entry[1] == stage and not future.done() and now - entry[3] > self._abandon_after()}
+                        if stuck:
+                            print(f"Timed out extracting {', '.join(sorted(stuck))}. Skipping.")
+                            # The workers cannot be interrupted, so replace them
+                            restart(stage, skip=stuck)
+                    fill()
+        finally:
+            downloads.shutdown(wait=False, cancel_futures=True)
+            for pool in pools.values():
+                if pool is not None:
+                    self._terminate(pool)
+            for blob, stage, payload, _ in in_flight.values():
+                _discard(payload)
@@ -0,0 +1,244 @@
+import os
+import re
+import json
+import math
+import argparse
+import threading
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+INTENTS = ("chat", "doc_search")
+
+# Local classifier trained from logged LLM decisions, and the log it learns from. The log
+# stores user prompts verbatim; set ROUTER_LOG_PATH to an empty string to turn it off
+ROUTER_MODEL_PATH = os.getenv("ROUTER_MODEL_PATH", "vectors/router_model.json")
+ROUTER_LOG_PATH = os.getenv("ROUTER_LOG_PATH", "vectors/router_log.jsonl")
+# Past this size the log is rotated to <path>.1, replacing the previous rotation
+ROUTER_LOG_MAX_BYTES = int(os.getenv("ROUTER_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+
+# Below this posterior the classifier defers to the LLM
+ROUTER_CONFIDENCE = float(os.getenv("ROUTER_CONFIDENCE", "0.9"))
+
+# Nouns that only name files; "report" and "article" are also everyday subjects, so they
+# (and verbs such as get/show/give/list) are left to the classifier and the LLM
+_DOC_NOUNS = r"(docs?|documents?|files?|papers?|whitepapers?|pdfs?|slides?|decks?|presentations?|manuals?)"
+_DOC_RULES = [
+    # Only as a request ("find ...", "search for ..."), not "how do I find large files";
+    # a file noun is required, since "search for X" is as often a plain question
+    re.compile(rf"^\s*(please\s+)?((can|could)\s+you\s+)?(find|search|look\s*up|locate|fetch|pull\s*up)\b.{{0,60}}\b{_DOC_NOUNS}\b",
+               re.IGNORECASE),
+    # "papers on X", but not in a question such as "how do I find large files on Windows"
+    re.compile(rf"^(?!\s*(how|why|what|when|where|who|which|is|are|do|does|can|could|should)\b)"
+               rf".*\b{_DOC_NOUNS}\s+(on|about|regarding|related\s+to|covering)\b", re.IGNORECASE),
+]
+# Any mention of documents makes a question ambiguous
+_DOC_NOUN = re.compile(rf"\b({_DOC_NOUNS[1:-1]}|reports?|articles?)\b", re.IGNORECASE)
+_CHAT_RULES = [
+    re.compile(r"^\s*(hi|hello|hey|thanks|thank\s+you|good\s+(morning|afternoon|evening)|bye|ok|okay)\b", re.IGNORECASE),
+    re.compile(r"^\s*(what|who|why|how|when|explain|define|describe|tell\s+me|can\s+you\s+explain)\b", re.IGNORECASE),
+]
+_TOKEN = re.compile(r"\w+")
+
+
+def match_rules(text: str) -> Optional[str]:
+    """Return the intent fixed by a keyword rule, or None if no rule is decisive."""
+    if any(rule.search(text) for rule in _DOC_RULES):
+        return "doc_search"
+    # A question that mentions documents is ambiguous, so only plain questions count as chat
+    if any(rule.search(text) for rule in _CHAT_RULES) and not _DOC_NOUN.search(text):
+        return "chat"
+    return None
+
+
+def ngrams(text: str) -> List[str]:
+    words = _TOKEN.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class NgramClassifier:
+    """Multinomial naive Bayes over word unigrams and bigrams.
+
+    Small enough to train in a second from the router log and to score a
+    message in microseconds; the posterior serves as the confidence.
+    """
+
+    def __init__(self, priors: Dict[str, float] = None, counts: Dict[str, Dict[str, int]] = None,
+                 totals: Dict[str, int] = None, vocabulary_size: int = 0, examples: int = 0):
+        self.priors = priors or {}
+        self.counts = counts or {}
+        self.totals = totals or {}
+        self.vocabulary_size = vocabulary_size
+        self.examples = examples
+
+    @classmethod
+    def fit(cls, texts: Iterable[str], labels: Iterable[str]) -> "NgramClassifier":
+        counts = {label: Counter() for label in INTENTS}
+        docs = Counter()
+        for text, label in zip(texts, labels):
+            counts[label].update(ngrams(text))
+            docs[label] += 1
+        examples = sum(docs.values())
+        vocabulary = set()
+        for label_counts in counts.values():
+            vocabulary.update(label_counts)
+        return cls(
+            priors={label: (docs[label] + 1) / (examples + len(INTENTS)) for label in INTENTS},
+            counts={label: dict(counts[label]) for label in INTENTS},
+            totals={label: sum(counts[label].values()) for label in INTENTS},
+            vocabulary_size=len(vocabulary),
+            examples=examples
+        )
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Return (intent, posterior probability)."""
+        features = ngrams(text)
+        scores = {}
+        for label in INTENTS:
+            counts = self.counts.get(label, {})
+            denominator = self.totals.get(label, 0) + self.vocabulary_size + 1
+            score = math.log(self.priors.get(label, 0.5))
+            for feature in features:
+                score += math.log((counts.get(feature, 0) + 1) / denominator)
+            scores[label] = score
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / total
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'priors': self.priors, 'counts': self.counts, 'totals': self.totals,
+                       'vocabulary_size': self.vocabulary_size, 'examples': self.examples}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["NgramClassifier"]:
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as f:
+                return cls(**json.load(f))
+        except Exception as e:
+            print(f"Error loading router model {path}: {str(e)}")
+            return None
+
+
+class IntentRouter:
+    """Tiered chat/doc_search classifier.
+
+    Keyword rules decide first, then the local n-gram classifier if it is at
+    least ``threshold`` confident, and only the remaining turns reach
+    ``llm_classify``. Every LLM decision is appended to ``log_path`` as
+    training data for the classifier (see ``train_router``); the log holds
+    the raw user text and is rotated at ``log_max_bytes``. ``route``
+    reports the deciding tier, and ``tier_counts`` tallies them.
+    """
+
+    def __init__(self, llm_classify: Callable[[str], str], model_path: str = ROUTER_MODEL_PATH,
+                 log_path: str = ROUTER_LOG_PATH, threshold: float = ROUTER_CONFIDENCE,
+                 min_examples: int = 50, log_max_bytes: int = ROUTER_LOG_MAX_BYTES):
+        self.llm_classify = llm_classify
+        self.log_path = log_path
+        self.log_max_bytes = log_max_bytes
+        self.threshold = threshold
+        classifier = NgramClassifier.load(model_path)
+        # A classifier trained on a handful of turns is confidently wrong, so ignore it
+        self.classifier = classifier if classifier is not None and classifier.examples >= min_examples else None
+        self.tier_counts = Counter()
+        self._lock = threading.Lock()
+
+    def _local(self, text: str) -> Optional[Dict]:
+        """Decide with the rules or the classifier, or return None to defer to the LLM."""
+        intent = match_rules(text)
+        if intent is not None:
+            return self._decided(intent, "rules", 1.0)
+
+        if self.classifier is not None:
+            intent, confidence = self.classifier.predict(text)
+            if confidence >= self.threshold:
+                return self._decided(intent, "classifier", confidence)
+        return None
+
+    def _from_llm(self, text: str, decision) -> Dict:
+        extra = {}
+        if isinstance(decision, dict):
+            extra = {key: value for key, value in decision.items() if key != "intent"}
+            decision = decision.get("intent")
+        if decision not in INTENTS:
+            decision = "chat"
+        else:
+            self._log(text, decision)
+        return self._decided(decision, "llm", None, **extra)
+
+    def route(self, text: str, llm_classify: Callable = None) -> Dict:
+        """Return {'intent', 'tier', 'confidence'} for a user message.
+
+        ``llm_classify`` overrides the LLM tier for this call. It may return
+        the intent or a dict with an 'intent' and other fields (such as a
+        search topic), which are passed through in the result.
+        """
+        decided = self._local(text)
+        if decided is not None:
+            return decided
+        return self._from_llm(text, (llm_classify or self.llm_classify)(text))
+
+    async def aroute(self, text: str, llm_classify: Callable) -> Dict:
+        """``route`` with an async LLM tier; ``llm_classify`` is awaited."""
+        decided = self._local(text)
+        if decided is not None:
+            return decided
+        return self._from_llm(text, await llm_classify(text))
+
+    def _decided(self, intent: str, tier: str, confidence: Optional[float], **extra) -> Dict:
+        with self._lock:
+            self.tier_counts[tier] += 1
+        return {"intent": intent, "tier": tier, "confidence": confidence, **extra}
+
+    def _log(self, text: str, intent: str):
+        if not self.log_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            with self._lock:
+                if os.path.exists(self.log_path) and os.path.getsize(self.log_path) >= self.log_max_bytes:
+                    os.replace(self.log_path, f"{self.log_path}.1")
+                with open(self.log_path, 'a') as f:
+                    f.write(json.dumps({"text": text, "intent": intent}) + "\n")
+        except Exception as e:
+            print(f"Error writing router log: {str(e)}")
+
+
+def train_router(log_path: str = ROUTER_LOG_PATH, model_path: str = ROUTER_MODEL_PATH) -> Optional[NgramClassifier]:
+    """Train the n-gram classifier from the router log (and its rotation) and save it."""
+    texts, labels = [], []
+    for path in (f"{log_path}.1", log_path):
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("intent") in INTENTS:
+                    texts.append(record["text"])
+                    labels.append(record["intent"])
+    if not texts:
+        print(f"No labelled turns in {log_path}")
+        return None
+    classifier = NgramClassifier.fit(texts, labels)
+    classifier.save(model_path)
+    print(f"Trained router classifier on {len(texts)} turns -> {model_path}")
+    return classifier
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the local intent classifier from logged router decisions")
+    parser.add_argument('--log', default=ROUTER_LOG_PATH)
+    parser.add_argument('--model', default=ROUTER_MODEL_PATH)
+    args = parser.parse_args()
+    train_router(args.log, args.model)
+
+
+if __name__ == "__main__":
+    main()
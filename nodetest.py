@@ -5,9 +5,16 @@ warnings.filterwarnings("ignore")
 
 from langchain_openai import AzureChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
-import re, requests, os, json
-from nodes import generate_blob_sas_url  # imported for SAS URL generation
-import os
+import re, requests, os, json, asyncio, time
+import httpx
+from sas_service import get_sas_service  # shared SAS signing
+from hybrid_search import get_search_client, get_async_search_client, query_embeddings
+from intent_router import IntentRouter
+from semantic_cache import SemanticCache, file_stamp, is_standalone, is_shareable
+from conversation_memory import ConversationMemory, messages_tokens
+from chunking import count_tokens
+from document_retriever import DocumentRetriever
+from vector_store import MANIFEST_NAME
 
 
 llm = AzureChatOpenAI(
@@ -20,11 +27,35 @@ parser = StrOutputParser()
 
 AZURE_BLOB_CONTAINER = os.getenv("AZURE_BLOB_CONTAINER", "contentiq")
 
+# Written by index_blob_docs.py on every (re)index; a new stamp invalidates cached search results.
+# The stamp is read from the local file, so it only notices indexing runs on this machine (or a
+# shared path); after a sync from elsewhere, cached results last until SEMANTIC_CACHE_TTL_SECONDS
+INDEX_CHECKPOINT_PATH = os.getenv(
+    "INDEX_CHECKPOINT_PATH", f"{os.getenv('AZURE_SEARCH_INDEX', 'doc-index')}_checkpoint.json"
+)
 
-def router_node(input):
-    query = input["user_input"].lower()
-    print(f"Router Node received: {query}")
+# Rewritten by vectorize_documents.py whenever the local vector store changes
+VECTOR_MANIFEST_PATH = os.path.join("vectors", AZURE_BLOB_CONTAINER, MANIFEST_NAME)
+
+# Answers to standalone questions, reused for near-identical later questions.
+# Only ungrounded chat replies are cached, i.e. ones retrieve_context found no sources
+# for; a changed store may now have sources, so it invalidates them
+response_cache = SemanticCache(
+    lambda text: query_embeddings().embed_query(text),
+    versions={
+        "search": lambda: file_stamp(INDEX_CHECKPOINT_PATH),
+        "chat": lambda: file_stamp(VECTOR_MANIFEST_PATH)
+    }
+)
 
+# Recent turns verbatim, older ones folded into a rolling summary
+memory = ConversationMemory(lambda prompt: llm.invoke(prompt).content)
+
+async def acomplete(prompt):
+    return (await llm.ainvoke(prompt)).content
+
+
+def classify_intent_with_llm(user_input):
     intent_prompt = (
     "You are a routing classifier that decides whether a user input is meant for chatting with the assistant "
     "(e.g., asking questions, seeking definitions, conversational replies) OR searching for documents "
@@ -37,51 +68,261 @@ def router_node(input):
     "- 'Find docs about Microsoft Fabric' -> doc_search\n"
     "- 'Give me whitepapers on machine learning' -> doc_search\n"
     "- 'What’s the use of Power Apps?' -> chat\n\n"
-    f"User input: {input['user_input']}"
+    f"User input: {user_input}"
     )
-    
+
     try:
-        intent = llm.invoke(intent_prompt).content.strip().lower()
+        return llm.invoke(intent_prompt).content.strip().lower()
     except Exception as e:
         print(f"Error classifying intent with LLM: {e}. Defaulting to chat.")
-        intent = "chat"
+        return None  # the router falls back to chat without logging a label
+
+# Rules first, then the local classifier, then the LLM
+intent_router = IntentRouter(classify_intent_with_llm)
+
 
-    print(f"LLM classified intent as: {intent}")
+def router_node(input):
+    query = input["user_input"].lower()
+    print(f"Router Node received: {query}")
+
+    route = intent_router.route(input["user_input"])
+    intent = route["intent"]
+
+    print(f"Router ({route['tier']}) classified intent as: {intent}")
     return {
         "next": "extract_topic" if intent == "doc_search" else "chat_node",
+        "route_tier": route["tier"],
         "user_input": input["user_input"],
         "chat_history": input.get("chat_history", [])
     }
 
-def chat_node(input):
-    print(f"Chat Node received: {input['user_input']}")
+def route_prompt(user_input, chat_history, summary=""):
+    recent_context = memory.context(summary, chat_history)  # Summary plus the recent turns
+
+    return (
+        "You are a routing assistant. Decide whether the user input is meant for chatting with the assistant "
+        "(questions, definitions, conversational replies) or for searching documents "
+        "(requesting files, papers, PDFs, or documents). For a document search, also give the exact topic "
+        "being searched for in one short phrase, using the recent conversation if the topic is vague.\n\n"
+        'Respond with JSON only: {"intent": "chat" or "doc_search", "topic": "<short phrase>" or null}\n\n'
+        "Examples:\n"
+        '- \'What is Power Automate?\' -> {"intent": "chat", "topic": null}\n'
+        '- \'Find docs about Microsoft Fabric\' -> {"intent": "doc_search", "topic": "Microsoft Fabric"}\n'
+        '- \'Give me whitepapers on machine learning\' -> {"intent": "doc_search", "topic": "machine learning"}\n\n'
+        f"Recent Conversation:\n{recent_context}\n"
+        f"User input: {user_input}"
+    )
+
+def parse_route(content):
+    # Tolerate a fenced ```json block around the object
+    content = content.strip()
+    content = content[content.find("{"):content.rfind("}") + 1]
+    decision = json.loads(content)
+    return {"intent": str(decision.get("intent", "")).strip().lower(), "topic": decision.get("topic")}
+
+def route_failed(e):
+    print(f"Error classifying intent with LLM: {e}. Defaulting to chat.")
+    return None  # the router falls back to chat without logging a label
+
+def classify_and_extract_with_llm(user_input, chat_history, summary=""):
+    try:
+        return parse_route(llm.invoke(route_prompt(user_input, chat_history, summary)).content)
+    except Exception as e:
+        return route_failed(e)
+
+async def aclassify_and_extract_with_llm(user_input, chat_history, summary=""):
+    try:
+        return parse_route((await llm.ainvoke(route_prompt(user_input, chat_history, summary))).content)
+    except Exception as e:
+        return route_failed(e)
+
+def route_and_extract_node(input):
+    """Router that also extracts the search topic when the LLM decides the intent.
+
+    Returns the router_node fields; for a doc_search decided by the LLM the
+    topic comes back in the same call and the graph skips extract_topic.
+    """
     user_input = input["user_input"]
     chat_history = input.get("chat_history", [])
+    print(f"Router Node received: {user_input.lower()}")
 
-    messages = [{"role": "system", "content": "You are a helpful assistant."}]
-    for turn in chat_history:
-        messages.append({"role": "user", "content": turn["user"]})
-        messages.append({"role": "assistant", "content": turn["assistant"]})
-    messages.append({"role": "user", "content": user_input})
+    route = intent_router.route(
+        user_input,
+        llm_classify=lambda text: classify_and_extract_with_llm(text, chat_history, input.get("summary", ""))
+    )
+    return route_result(route, user_input, chat_history)
+
+async def aroute_and_extract_node(input):
+    user_input = input["user_input"]
+    chat_history = input.get("chat_history", [])
+    print(f"Router Node received: {user_input.lower()}")
+
+    route = await intent_router.aroute(
+        user_input,
+        llm_classify=lambda text: aclassify_and_extract_with_llm(text, chat_history, input.get("summary", ""))
+    )
+    return route_result(route, user_input, chat_history)
 
-    response = llm.invoke(messages)
-    assistant_reply = response.content
+def route_result(route, user_input, chat_history):
+    intent = route["intent"]
+    topic = route.get("topic")
+
+    print(f"Router ({route['tier']}) classified intent as: {intent}")
+    result = {
+        "next": "chat_node",
+        "route_tier": route["tier"],
+        "user_input": user_input,
+        "chat_history": chat_history
+    }
+    if intent == "doc_search":
+        if topic:
+            print(f"Extracted topic: {topic}")
+            result.update({"next": "search_index", "topic": topic})
+        else:
+            result["next"] = "extract_topic"
+    return result
+
+def cache_lookup_node(input):
+    """Answer from the semantic response cache when a near-identical question was seen.
+
+    Only messages whose answers are cached at all are looked up (and embedded):
+    the answer to a follow-up depends on the conversation, and one about the
+    user is never shared.
+    """
+    user_input = input["user_input"]
+    chat_history = input.get("chat_history", [])
+    result = {"next": "router", "user_input": user_input, "chat_history": chat_history}
+    if not is_shareable(user_input):
+        return result
+
+    hit = response_cache.lookup(user_input, ("chat", "search"))
+    if hit is None:
+        return result
+    namespace, value, similarity = hit
+    print(f"Response cache hit ({namespace}, similarity {similarity:.3f})")
+    if namespace == "chat":
+        chat_history.append({"user": user_input, "assistant": value})
+        result.update({"next": "final_output_node", "response": value, "cache_hit": namespace})
+    else:
+        result.update({"next": "format_results", "docs": value["docs"], "topic": value["topic"], "cache_hit": namespace})
+    return result
+
+async def acache_lookup_node(input):
+    # Embedding the query may call the API, so keep it off the event loop
+    return await asyncio.to_thread(cache_lookup_node, input)
+
+def chat_messages(input):
+    return memory.messages("You are a helpful assistant.", input.get("summary", ""),
+                           input.get("chat_history", []), input["user_input"])
+
+def turn_usage(input, prompt_tokens):
+    usage = memory.usage(input.get("summary", ""), input.get("chat_history", []), prompt_tokens)
+    print(f"Token usage: {usage}")
+    return usage
+
+def remember_chat(input, messages, assistant_reply, cache=True):
+    user_input = input["user_input"]
+    chat_history = input.get("chat_history", [])
+    # Without earlier turns the reply depends only on the question, so it can be reused,
+    # but the cache is shared by every user, so not when the question is about the user
+    if cache and not chat_history and not input.get("summary") and is_shareable(user_input):
+        response_cache.put(user_input, "chat", assistant_reply)
 
+    usage = turn_usage(input, messages_tokens(messages))
     chat_history.append({"user": user_input, "assistant": assistant_reply})
-    return {"response": assistant_reply, "chat_history": chat_history}
+    return {"response": assistant_reply, "chat_history": chat_history, "token_usage": usage}
 
-def extract_topic_node(input):
-    print(f"Extract Topic Node received: {input['user_input']}")
+# The reply is streamed so graph stream callers can show tokens as they arrive;
+# config carries their callbacks into the LLM call
+def chat_node(input, config=None):
+    print(f"Chat Node received: {input['user_input']}")
+    messages = chat_messages(input)
+
+    reply = "".join(chunk.content for chunk in llm.stream(messages, config=config))
+    return remember_chat(input, messages, reply, cache=not input.get("retrieval_skipped"))
+
+async def achat_node(input, config=None):
+    print(f"Chat Node received: {input['user_input']}")
+    messages = chat_messages(input)
+
+    reply = ""
+    async for chunk in llm.astream(messages, config=config):
+        reply += chunk.content
+    return await asyncio.to_thread(remember_chat, input, messages, reply, not input.get("retrieval_skipped"))
+
+# Local vector store the grounded answers are drawn from, loaded on first use
+_retriever = None
+
+def get_retriever():
+    global _retriever
+    if _retriever is None:
+        _retriever = DocumentRetriever()
+    return _retriever
+
+def retrieval_query(input):
+    # A follow-up is searched together with the question it follows
     user_input = input["user_input"]
     chat_history = input.get("chat_history", [])
+    if chat_history and not is_standalone(user_input):
+        return f"{chat_history[-1]['user']}\n{user_input}"
+    return user_input
 
-    # Collect recent context to help resolve pronouns like "it"
-    recent_context = ""
-    for turn in chat_history[-3:]:  # Use last 3 exchanges for context
-        recent_context += f"User: {turn['user']}\nAssistant: {turn['assistant']}\n"
+def retrieve_context_node(input):
+    """Find passages for a chat turn; covered questions go to qa_node, the rest to chat_node.
+
+    retrieval_skipped is set when the store was still loading or retrieval
+    failed, so the ungrounded reply is not cached for later turns that could
+    be grounded.
+    """
+    started = time.perf_counter()
+    try:
+        passages = get_retriever().build_context(retrieval_query(input), AZURE_BLOB_CONTAINER)
+    except Exception as e:
+        print(f"Error retrieving context: {e}")
+        passages = None
+    if passages is None:
+        print("Retrieval skipped")
+        return {"passages": [], "retrieval_skipped": True, "next": "chat_node"}
+    print(f"Retrieved {len(passages)} passages in {1000 * (time.perf_counter() - started):.1f} ms")
+    return {"passages": passages, "retrieval_skipped": False, "next": "qa_node" if passages else "chat_node"}
+
+async def aretrieve_context_node(input):
+    # The query embedding may call the API and scoring is numpy work, so keep both off the event loop
+    return await asyncio.to_thread(retrieve_context_node, input)
+
+def qa_messages(input):
+    grounded = get_retriever().qa_messages(input["user_input"], input["passages"])
+    return memory.messages(grounded[0]["content"], input.get("summary", ""),
+                           input.get("chat_history", []), grounded[1]["content"])
+
+def grounded_reply(input, messages, reply):
+    # Grounded answers depend on the indexed documents, so they are not put in the response cache
+    result = remember_chat(input, messages, reply, cache=False)
+    sources = get_retriever().citations(input["passages"])
+    result["response"] = f"{reply}\n\n**Sources:**\n{sources}"
+    return result
+
+def qa_node(input, config=None):
+    print(f"QA Node received: {input['user_input']}")
+    messages = qa_messages(input)
+
+    reply = "".join(chunk.content for chunk in llm.stream(messages, config=config))
+    return grounded_reply(input, messages, reply)
+
+async def aqa_node(input, config=None):
+    print(f"QA Node received: {input['user_input']}")
+    messages = qa_messages(input)
+
+    reply = ""
+    async for chunk in llm.astream(messages, config=config):
+        reply += chunk.content
+    return await asyncio.to_thread(grounded_reply, input, messages, reply)
+
+def topic_prompt(user_input, chat_history, summary=""):
+    recent_context = memory.context(summary, chat_history)  # Summary plus the recent turns
 
     # Prompt for LLM to extract topic with context
-    prompt = (
+    return (
         "You are an assistant that extracts the most relevant topic from a user message, "
         "using the recent conversation for reference if the topic is vague.\n\n"
         f"Recent Conversation:\n{recent_context}\n"
@@ -89,44 +330,71 @@ def extract_topic_node(input):
         "Return the exact topic being referred to in one short phrase."
     )
 
-    try:
-        topic = llm.invoke(prompt).content.strip()
-    except Exception as e:
-        print(f"Error in topic extraction: {e}")
-        topic = "unknown"
+def topic_request(input):
+    print(f"Extract Topic Node received: {input['user_input']}")
+    return topic_prompt(input["user_input"], input.get("chat_history", []), input.get("summary", ""))
+
+def topic_failed(e):
+    print(f"Error in topic extraction: {e}")
+    return "unknown"
 
+def topic_result(input, prompt, topic):
     print(f"Extracted topic: {topic}")
     return {
         "topic": topic,
-        "chat_history": chat_history,
-        "user_input": user_input
+        "chat_history": input.get("chat_history", []),
+        "user_input": input["user_input"],
+        "token_usage": turn_usage(input, count_tokens(prompt))
     }
 
-def search_index_node(input):
-    print(f"Search Index Node received topic: {input['topic']}")
-    AZURE_SEARCH_ENDPOINT = os.getenv("AZURE_SEARCH_ENDPOINT")
-    AZURE_SEARCH_KEY = os.getenv("AZURE_SEARCH_KEY")
-    INDEX_NAME = os.getenv("AZURE_SEARCH_INDEX")
-
-    headers = {"Content-Type": "application/json", "api-key": AZURE_SEARCH_KEY}
-    search_url = f"{AZURE_SEARCH_ENDPOINT}/indexes/{INDEX_NAME}/docs/search?api-version=2023-07-01-preview"
-    data = {"search": input["topic"], "top": 1000
-            }
+def extract_topic_node(input):
+    prompt = topic_request(input)
+    try:
+        topic = llm.invoke(prompt).content.strip()
+    except Exception as e:
+        topic = topic_failed(e)
+    return topic_result(input, prompt, topic)
 
+async def aextract_topic_node(input):
+    prompt = topic_request(input)
     try:
-        res = requests.post(search_url, headers=headers, json=data)
-        res.raise_for_status()
-        hits = res.json().get("value", [])
-    except requests.exceptions.RequestException as e:
-        print(f"Error during Azure AI Search: {e}")
-        hits = []
+        topic = (await llm.ainvoke(prompt)).content.strip()
+    except Exception as e:
+        topic = topic_failed(e)
+    return topic_result(input, prompt, topic)
 
+def search_result(input, hits):
+    if hits and is_shareable(input["user_input"]):
+        response_cache.put(input["user_input"], "search", {"docs": hits, "topic": input["topic"]})
     return {
         "docs": hits,
         "chat_history": input.get("chat_history", []),
         "user_input": input["user_input"]
     }
 
+def search_failed(input, e):
+    print(f"Error during Azure AI Search: {e}")
+    return search_result(input, [])
+
+def search_index_node(input):
+    print(f"Search Index Node received topic: {input['topic']}")
+    try:
+        # Shared client: settings read once, connections kept warm between turns.
+        # Hybrid keyword + vector query; one hit per document, only id and title returned
+        hits = get_search_client().search(input["topic"], top_docs=5)
+    except requests.exceptions.RequestException as e:
+        return search_failed(input, e)
+    return search_result(input, hits)
+
+async def asearch_index_node(input):
+    print(f"Search Index Node received topic: {input['topic']}")
+    try:
+        hits = await get_async_search_client().search(input["topic"], top_docs=5)
+    except httpx.HTTPError as e:
+        return search_failed(input, e)
+    # Caching the hits embeds the query, so keep it off the event loop
+    return await asyncio.to_thread(search_result, input, hits)
+
 def format_results_node(input):
     results = input["docs"]
     if not results:
@@ -141,6 +409,9 @@ def format_results_node(input):
 
     unique_results = list(grouped.values())
 
+    # Sign every link of the page at once; cached URLs are reused until close to expiry
+    sas_urls = get_sas_service().urls(AZURE_BLOB_CONTAINER, [doc.get("title", "Untitled") for doc in unique_results[:5]])
+
     response = f"\n📚 *Top Matching Documents*\n{'='*35}\nFound {len(unique_results)} unique result(s):\n"
     for i, doc in enumerate(unique_results[:5], 1):
         title  = doc.get("title", "Untitled")
@@ -149,7 +420,7 @@ def format_results_node(input):
 
         # Generate a time-limited SAS link for the blob
         blob_name = title  # adjust if blob naming differs
-        sas_url    = generate_blob_sas_url(AZURE_BLOB_CONTAINER, blob_name)
+        sas_url    = sas_urls[blob_name]
 
         response += f"\n🔹 *{i}. {title}*\n"
         response += f"   - 🆔 ID: ⁠ {doc_id} ⁠\n"
@@ -160,5 +431,14 @@ def format_results_node(input):
     response += "\n" + "="*35
     return {"response": response.strip(), "chat_history": input.get("chat_history", [])}
 
+async def aformat_results_node(input):
+    # Signing is cached, but a user delegation key refresh is a network call
+    return await asyncio.to_thread(format_results_node, input)
+
 def final_output_node(input):
-    return {"response": input["response"], "chat_history": input.get("chat_history", [])}
+    # Turns beyond the memory budget are folded into the summary before the state is saved
+    return {"response": input["response"], **memory.fold(input.get("summary", ""), input.get("chat_history", []))}
+
+async def afinal_output_node(input):
+    folded = await memory.afold(input.get("summary", ""), input.get("chat_history", []), acomplete)
+    return {"response": input["response"], **folded}
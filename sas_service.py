@@ -0,0 +1,132 @@
+import os
+import time
+import threading
+import urllib.parse
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional
+
+from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
+
+DEFAULT_EXPIRY_MINUTES = 10
+
+# Cached URLs are re-signed once this fraction of their lifetime has passed, so a link
+# handed out always has at least the rest of it left for slow downloads and later clicks
+REFRESH_FRACTION = float(os.getenv("SAS_REFRESH_FRACTION", "0.5"))
+
+# User delegation keys are requested for this long and renewed an hour before they lapse
+DELEGATION_KEY_HOURS = 24
+
+_services: Dict[str, "SasService"] = {}
+_services_lock = threading.Lock()
+
+
+class SasService:
+    """Signs read-only blob URLs for one storage account.
+
+    The BlobServiceClient is built once, and signed URLs are cached per
+    (container, blob, expiry) until half their lifetime has passed, so rendering
+    a page of results does not parse connection strings or create clients.
+    Accounts without a shared key sign with a user delegation key, which is
+    itself cached and renewed before it lapses.
+    """
+
+    def __init__(self, blob_service_client: BlobServiceClient, use_user_delegation: bool = False,
+                 refresh_fraction: float = REFRESH_FRACTION, max_entries: int = 10000):
+        self.client = blob_service_client
+        self.account_name = blob_service_client.account_name
+        self.base_url = blob_service_client.url.rstrip("/")
+        self.account_key = getattr(blob_service_client.credential, "account_key", None)
+        self.use_user_delegation = use_user_delegation or self.account_key is None
+        self.refresh_fraction = refresh_fraction
+        self.max_entries = max_entries
+        self._urls: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (url, expires_at)
+        self._delegation_key = None
+        self._delegation_key_expires_at = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_connection_string(cls, connection_string: str, **kwargs) -> "SasService":
+        return cls(BlobServiceClient.from_connection_string(connection_string), **kwargs)
+
+    @classmethod
+    def from_account_url(cls, account_url: str, credential=None, **kwargs) -> "SasService":
+        """Sign with a user delegation key obtained through an Entra ID credential."""
+        if credential is None:
+            from azure.identity import DefaultAzureCredential
+            credential = DefaultAzureCredential()
+        return cls(BlobServiceClient(account_url, credential=credential), use_user_delegation=True, **kwargs)
+
+    def _signing_key(self, now: datetime) -> Dict:
+        if not self.use_user_delegation:
+            return {"account_key": self.account_key}
+        if self._delegation_key is None or time.time() > self._delegation_key_expires_at:
+            self._delegation_key = self.client.get_user_delegation_key(
+                key_start_time=now - timedelta(minutes=5),
+                key_expiry_time=now + timedelta(hours=DELEGATION_KEY_HOURS)
+            )
+            self._delegation_key_expires_at = time.time() + (DELEGATION_KEY_HOURS - 1) * 3600
+        return {"user_delegation_key": self._delegation_key}
+
+    def _sign(self, container_name: str, blob_name: str, expiry_minutes: int, now: datetime, key: Dict) -> str:
+        sas_token = generate_blob_sas(
+            account_name=self.account_name,
+            container_name=container_name,
+            blob_name=blob_name,
+            permission=BlobSasPermissions(read=True),
+            expiry=now + timedelta(minutes=expiry_minutes),
+            **key
+        )
+        return f"{self.base_url}/{container_name}/{urllib.parse.quote(blob_name)}?{sas_token}"
+
+    def urls(self, container_name: str, blob_names: Iterable[str],
+             expiry_minutes: int = DEFAULT_EXPIRY_MINUTES) -> Dict[str, str]:
+        """Return {blob_name: url} for a page of results, signing only what is not cached."""
+        now = datetime.now(timezone.utc)
+        fresh_until = time.time() + expiry_minutes * 60 * (1 - self.refresh_fraction)
+        result = {}
+        with self._lock:
+            key = None
+            for blob_name in blob_names:
+                cache_key = (container_name, blob_name, expiry_minutes)
+                cached = self._urls.get(cache_key)
+                if cached is not None and cached[1] > fresh_until:
+                    self._urls.move_to_end(cache_key)
+                    result[blob_name] = cached[0]
+                    continue
+                if key is None:
+                    key = self._signing_key(now)
+                url = self._sign(container_name, blob_name, expiry_minutes, now, key)
+                self._urls[cache_key] = (url, time.time() + expiry_minutes * 60)
+                self._urls.move_to_end(cache_key)
+                result[blob_name] = url
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+        return result
+
+    def url(self, container_name: str, blob_name: str, expiry_minutes: int = DEFAULT_EXPIRY_MINUTES) -> str:
+        return self.urls(container_name, [blob_name], expiry_minutes)[blob_name]
+
+
+def get_sas_service(connection_string: Optional[str] = None) -> SasService:
+    """Shared SasService per connection string.
+
+    Defaults to AZURE_CONNECTION_STRING; when that is unset, AZURE_STORAGE_ACCOUNT_URL
+    is used with a user delegation key.
+    """
+    connection_string = connection_string or os.getenv("AZURE_CONNECTION_STRING")
+    account_url = None if connection_string else os.getenv("AZURE_STORAGE_ACCOUNT_URL")
+    cache_key = connection_string or account_url
+    if not cache_key:
+        raise ValueError("Set AZURE_CONNECTION_STRING or AZURE_STORAGE_ACCOUNT_URL to sign blob URLs")
+    service = _services.get(cache_key)
+    if service is None:
+        with _services_lock:
+            service = _services.get(cache_key)
+            if service is None:
+                if connection_string:
+                    service = SasService.from_connection_string(connection_string)
+                else:
+                    service = SasService.from_account_url(account_url)
+                _services[cache_key] = service
+    return service
@@ -0,0 +1,159 @@
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from azure.core.exceptions import HttpResponseError
+
+# Azure AI Search accepts at most 1000 actions and 16 MB per indexing request
+MAX_BATCH_DOCS = 1000
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+
+# Per-document status codes worth retrying; others (e.g. 400) are reported as failures
+RETRYABLE_STATUS_CODES = {409, 422, 429, 503}
+
+
+class SearchIndexWriter:
+    """Buffers chunks and indexes them in batches from concurrent workers.
+
+    Chunks are added without vectors. Each flush embeds the buffered texts
+    with one ``embed_documents`` call and sends ``merge_or_upload_documents``
+    requests sized to the service's count and payload limits. Keys queued
+    with ``delete`` go out in ``delete_documents`` batches the same way.
+    Documents the service rejects with a retryable status are retried on
+    their own, and the rest are collected in ``failures``.
+    """
+
+    def __init__(self, search_client, embeddings, vector_field: str = "content_vector",
+                 text_field: str = "content", key_field: str = "id", buffer_size: int = 256,
+                 max_workers: int = 4, max_retries: int = 4):
+        self.search_client = search_client
+        self.embeddings = embeddings
+        self.vector_field = vector_field
+        self.text_field = text_field
+        self.key_field = key_field
+        self.buffer_size = buffer_size
+        self.max_retries = max_retries
+        self.succeeded = 0
+        self.deleted = 0
+        self.failures: List[Dict] = []
+        self._buffer: List[Dict] = []
+        self._deletes: List[str] = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Limit outstanding flushes so adding chunks blocks when workers fall behind
+        self._slots = threading.BoundedSemaphore(max_workers * 2)
+        self._futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, doc: Dict):
+        self._buffer.append(doc)
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def delete(self, key: str):
+        """Queue a document key for deletion."""
+        self._deletes.append(key)
+        if len(self._deletes) >= MAX_BATCH_DOCS:
+            self.flush()
+
+    def _submit(self, fn, *args):
+        self._slots.acquire()
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def flush(self):
+        if self._deletes:
+            keys, self._deletes = self._deletes, []
+            self._submit(self._send, self.search_client.delete_documents,
+                         [{self.key_field: key} for key in keys])
+        if self._buffer:
+            docs, self._buffer = self._buffer, []
+            self._submit(self._index, docs)
+
+    def close(self) -> Dict:
+        """Flush, wait for every batch and return a summary."""
+        self.flush()
+        for future in self._futures:
+            future.result()
+        self._futures = []
+        self._executor.shutdown(wait=True)
+        return {'succeeded': self.succeeded, 'deleted': self.deleted,
+                'failed': len(self.failures), 'failures': self.failures}
+
+    def _index(self, docs: List[Dict]):
+        try:
+            vectors = self.embeddings.embed_documents([doc[self.text_field] for doc in docs])
+        except Exception as e:
+            self._record_failures(docs, f"embedding failed: {str(e)}")
+            return
+        for doc, vector in zip(docs, vectors):
+            doc[self.vector_field] = vector
+        for batch in self._batches(docs):
+            self._send(self.search_client.merge_or_upload_documents, batch)
+
+    def _batches(self, docs: List[Dict]):
+        """Split docs into requests within the document-count and payload limits."""
+        batch, batch_bytes = [], 0
+        for doc in docs:
+            size = len(json.dumps(doc))
+            if batch and (len(batch) >= MAX_BATCH_DOCS or batch_bytes + size > MAX_BATCH_BYTES * 0.9):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(doc)
+            batch_bytes += size
+        if batch:
+            yield batch
+
+    def _send(self, action, docs: List[Dict]):
+        """Run an indexing action, retrying only the documents that failed."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                results = action(documents=docs)
+            except HttpResponseError as e:
+                if e.status_code == 413 and len(docs) > 1:
+                    mid = len(docs) // 2
+                    self._send(action, docs[:mid])
+                    self._send(action, docs[mid:])
+                    return
+                if e.status_code in (429, 503) and attempt < self.max_retries:
+                    time.sleep(min(2 ** attempt, 30))
+                    continue
+                self._record_failures(docs, str(e))
+                return
+            except Exception as e:
+                self._record_failures(docs, str(e))
+                return
+
+            by_key = {doc[self.key_field]: doc for doc in docs}
+            retry = []
+            with self._lock:
+                for result in results:
+                    if result.succeeded:
+                        if action == self.search_client.delete_documents:
+                            self.deleted += 1
+                        else:
+                            self.succeeded += 1
+                    elif result.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                        retry.append(by_key[result.key])
+                    else:
+                        self.failures.append({'key': result.key, 'status_code': result.status_code,
+                                              'error': result.error_message})
+            if not retry:
+                return
+            # Only the documents that failed are sent again
+            docs = retry
+            time.sleep(min(2 ** attempt, 30))
+
+    def _record_failures(self, docs: List[Dict], error: str):
+        print(f"Error indexing {len(docs)} documents: {error}")
+        with self._lock:
+            for doc in docs:
+                self.failures.append({'key': doc[self.key_field], 'status_code': None, 'error': error})
@@ -0,0 +1,259 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from embedding_cache import normalize_text
+
+# Cosine similarity a cached query needs to answer a new one. ada-002 puts templated
+# questions about different things ("what is Power BI" / "what is Power Apps") near
+# 0.95, so the similarity alone is not trusted; see the term guard and calibrate_threshold
+DEFAULT_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.97'))
+
+# Share of content words the two queries must have in common (Jaccard)
+DEFAULT_MIN_OVERLAP = float(os.getenv('SEMANTIC_CACHE_MIN_OVERLAP', '0.6'))
+DEFAULT_TTL_SECONDS = float(os.getenv('SEMANTIC_CACHE_TTL_SECONDS', '3600'))
+DEFAULT_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '2000'))
+
+# Words that make a message depend on earlier turns, so its answer cannot be reused
+_CONTEXT_WORDS = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|she|above|previous|earlier|again|more|same|"
+    r"first|second|last|one)\b",
+    re.IGNORECASE
+)
+
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an the is are was were be been am do does did what whats who whom which how why when where "
+    "can could would should will shall may might must i me my we our you your of to in on for with "
+    "about at by from as and or please tell explain give show s".split()
+)
+
+
+def query_terms(text: str) -> frozenset:
+    """Content words of a query, lower-cased and without stopwords."""
+    return frozenset(word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS)
+
+
+def terms_match(a: frozenset, b: frozenset, min_overlap: float = DEFAULT_MIN_OVERLAP) -> bool:
+    """True if two queries share enough content words and exactly the same numbers."""
+    if {t for t in a if any(c.isdigit() for c in t)} != {t for t in b if any(c.isdigit() for c in t)}:
+        return False
+    if not a and not b:
+        return True
+    return len(a & b) / len(a | b) >= min_overlap
+
+
+_PERSONAL = re.compile(
+    r"\b(i|i'm|im|i've|i'd|me|my|mine|myself|we|our|ours|us)\b|\S+@\S+\.\w+|\d{5,}",
+    re.IGNORECASE
+)
+
+
+def normalize_query(text: str) -> str:
+    """Lower-case, collapse whitespace and drop trailing punctuation."""
+    return normalize_text(text).lower().rstrip(" ?!.")
+
+
+def is_standalone(text: str) -> bool:
+    """True if the message does not refer back to the conversation."""
+    return not _CONTEXT_WORDS.search(text)
+
+
+def is_personal(text: str) -> bool:
+    """True if the message is about the user (first person, e-mail addresses, long numbers).
+
+    A first-turn reply can only mention what the question told it, so replies
+    to impersonal questions are safe to share between users and others are not.
+    """
+    return bool(_PERSONAL.search(text))
+
+
+def is_shareable(text: str) -> bool:
+    """True if the answer to a message may be cached and reused, for any user."""
+    return is_standalone(text) and not is_personal(text)
+
+
+class SemanticCache:
+    """In-memory cache of answers keyed by query embedding similarity.
+
+    ``lookup`` embeds the normalized query and returns the value stored for
+    the most similar cached query when the cosine similarity reaches
+    ``threshold`` and the two queries share enough content words
+    (``terms_match``), so templated questions about different subjects do
+    not answer each other. Entries expire after ``ttl_seconds`` and the least
+    recently used are evicted past ``max_entries``. A namespace may have a
+    ``version`` callable (e.g. the index checkpoint's stamp); when its value
+    changes, that namespace is cleared.
+    """
+
+    def __init__(self, embed: Callable[[str], List[float]], threshold: float = DEFAULT_THRESHOLD,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 versions: Dict[str, Callable[[], Any]] = None, min_overlap: float = DEFAULT_MIN_OVERLAP):
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.versions = versions or {}
+        self.min_overlap = min_overlap
+        self._namespaces: Dict[str, Dict] = {}
+        # (namespace, key) pairs, least recently used first
+        self._lru: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _namespace(self, name: str) -> Dict:
+        namespace = self._namespaces.get(name)
+        if namespace is None:
+            namespace = {'entries': OrderedDict(), 'vectors': None, 'version': None}
+            self._namespaces[name] = namespace
+        version_fn = self.versions.get(name)
+        if version_fn is not None:
+            version = version_fn()
+            if version != namespace['version']:
+                if namespace['entries']:
+                    self.invalidations += 1
+                self._clear(name)
+                namespace['version'] = version
+        return namespace
+
+    def _vector(self, query: str) -> Optional[np.ndarray]:
+        try:
+            vector = np.asarray(self.embed(normalize_query(query)), dtype=np.float32)
+        except Exception as e:
+            print(f"Error embedding query for the response cache: {str(e)}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, query: str, namespaces: Tuple[str, ...]) -> Optional[Tuple[str, Any, float]]:
+        """Return (namespace, value, similarity) of the best hit across namespaces, or None."""
+        vector = self._vector(query)
+        if vector is None:
+            return None
+        terms = query_terms(normalize_query(query))
+        now = time.time()
+        best = None
+        with self._lock:
+            for name in namespaces:
+                namespace = self._namespace(name)
+                entries = namespace['entries']
+                # Drop expired entries; the oldest come first
+                while entries and next(iter(entries.values()))['created'] + self.ttl_seconds < now:
+                    key, _ = entries.popitem(last=False)
+                    self._lru.pop((name, key), None)
+                    namespace['vectors'] = None
+                if not entries:
+                    continue
+                if namespace['vectors'] is None:
+                    namespace['keys'] = list(entries)
+                    namespace['vectors'] = np.stack([entry['vector'] for entry in entries.values()])
+                scores = namespace['vectors'] @ vector
+                # Most similar first; the first candidate whose wording also matches wins
+                candidates = np.flatnonzero(scores >= self.threshold)
+                for position in candidates[np.argsort(-scores[candidates])]:
+                    if best is not None and scores[position] <= best[2]:
+                        break
+                    key = namespace['keys'][position]
+                    if terms_match(terms, entries[key]['terms'], self.min_overlap):
+                        best = (name, key, float(scores[position]))
+                        break
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._lru.move_to_end((best[0], best[1]))
+            return best[0], self._namespaces[best[0]]['entries'][best[1]]['value'], best[2]
+
+    def get(self, query: str, namespace: str) -> Optional[Any]:
+        hit = self.lookup(query, (namespace,))
+        return hit[1] if hit else None
+
+    def put(self, query: str, namespace: str, value: Any):
+        vector = self._vector(query)
+        if vector is None:
+            return
+        key = normalize_query(query)
+        with self._lock:
+            ns = self._namespace(namespace)
+            # Re-insert so entries stay in creation order for TTL expiry
+            ns['entries'].pop(key, None)
+            ns['entries'][key] = {'vector': vector, 'value': value, 'created': time.time(),
+                                  'terms': query_terms(key)}
+            ns['vectors'] = None
+            self._lru.pop((namespace, key), None)
+            self._lru[(namespace, key)] = None
+            while len(self._lru) > self.max_entries:
+                (name, old_key), _ = self._lru.popitem(last=False)
+                self._namespaces[name]['entries'].pop(old_key, None)
+                self._namespaces[name]['vectors'] = None
+                self.evictions += 1
+
+    def _clear(self, name: str):
+        namespace = self._namespaces[name]
+        for key in namespace['entries']:
+            self._lru.pop((name, key), None)
+        namespace.update({'entries': OrderedDict(), 'vectors': None})
+
+    def invalidate(self, namespace: str = None):
+        """Clear one namespace, or everything."""
+        with self._lock:
+            names = [namespace] if namespace else list(self._namespaces)
+            for name in names:
+                if name in self._namespaces and self._namespaces[name]['entries']:
+                    self._clear(name)
+                    self.invalidations += 1
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters, hit rate, evictions and entries per namespace."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': {name: len(ns['entries']) for name, ns in self._namespaces.items()}
+            }
+
+
+def calibrate_threshold(embed: Callable[[str], List[float]], same: List[Tuple[str, str]],
+                        different: List[Tuple[str, str]]) -> Dict[str, float]:
+    """Suggest a similarity threshold from labelled query pairs.
+
+    ``same`` pairs should share an answer and ``different`` pairs should not.
+    The suggestion is just above the most similar ``different`` pair, and
+    'recall' is the share of ``same`` pairs it still lets through.
+    """
+    def similarity(a: str, b: str) -> float:
+        va = np.asarray(embed(normalize_query(a)), dtype=np.float32)
+        vb = np.asarray(embed(normalize_query(b)), dtype=np.float32)
+        return float(va @ vb / ((np.linalg.norm(va) * np.linalg.norm(vb)) or 1.0))
+
+    same_scores = [similarity(a, b) for a, b in same]
+    different_scores = [similarity(a, b) for a, b in different]
+    threshold = min(1.0, max(different_scores, default=0.0) + 0.005)
+    return {
+        'threshold': threshold,
+        'recall': sum(score >= threshold for score in same_scores) / len(same_scores) if same_scores else 0.0,
+        'max_different': max(different_scores, default=0.0),
+        'min_same': min(same_scores, default=0.0)
+    }
+
+
+def file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    """(mtime_ns, size) of a file, or None; used to notice a re-synced index."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
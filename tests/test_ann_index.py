@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+
+from ann_index import IVFPQIndex, recall_report
+from vector_store import VectorStore
+
+
+def clustered_store(root, n=2000, dim=32, clusters=20, seed=0):
+    """A store of noisy points around random centres, several chunks per blob."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim))
+    vectors = centres[rng.integers(0, clusters, n)] + 0.3 * rng.normal(size=(n, dim))
+    store = VectorStore(str(root))
+    documents = [{
+        "blob_name": f"blob-{i // 4}.pdf",
+        "container": "docs",
+        "content": f"chunk {i}",
+        "embedding": vector,
+        "last_modified": "2025-01-01T00:00:00",
+        "size": 1,
+        "chunk_index": i % 4
+    } for i, vector in enumerate(vectors)]
+    # Two segments so the index spans several
+    store.apply_delta(documents[:n // 2])
+    store.apply_delta(documents[n // 2:])
+    return store
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    return clustered_store(tmp_path_factory.mktemp("ann") / "docs")
+
+
+@pytest.fixture(scope="module")
+def index(store):
+    return IVFPQIndex.build(store, nlist=32, m=8, nbits=6, iters=10)
+
+
+def recall(report, nprobe, rerank):
+    return next(row["recall"] for row in report if row["nprobe"] == nprobe and row["rerank"] == rerank)
+
+
+def test_recall_against_brute_force(store, index):
+    report = recall_report(store, index, k=10, num_queries=50, nprobes=(4, 32), reranks=(0, 100))
+
+    # Exact re-ranking of the candidates recovers nearly all true neighbours
+    assert recall(report, 32, 100) >= 0.95
+    assert recall(report, 4, 100) >= 0.8
+    # Probing more lists never hurts, and re-ranking beats raw PQ distances
+    assert recall(report, 32, 100) >= recall(report, 4, 100)
+    assert recall(report, 32, 100) >= recall(report, 32, 0)
+
+
+def test_search_returns_the_query_row_first(store, index):
+    segment = store.open_segments()[1]
+    query = np.asarray(segment.vectors[7], dtype=np.float32)
+
+    positions, scores = index.search(query, 5)
+
+    assert index.document(positions[0])["content"] == f"chunk {1000 + 7}"
+    assert scores[0] == pytest.approx(1.0, abs=1e-5)
+    assert np.all(np.diff(scores) <= 1e-6)
+
+
+def test_search_unique_returns_one_chunk_per_blob(store, index):
+    query = np.asarray(store.open_segments()[0].vectors[0], dtype=np.float32)
+
+    positions, _ = index.search_unique(query, 10)
+
+    blobs = [int(index.blob_ids[p]) for p in positions]
+    assert len(positions) == 10 and len(set(blobs)) == 10
+
+
+def test_index_is_stale_after_the_store_changes(tmp_path):
+    store = clustered_store(tmp_path / "docs", n=400)
+    index = IVFPQIndex.build(store, nlist=8, m=8, nbits=4, iters=5)
+    stamp = IVFPQIndex.meta_stamp(store)
+    assert index.is_current() and IVFPQIndex.exists(store)
+
+    store.apply_delta([], tombstones=["blob-0.pdf"])
+    assert not index.is_current()
+
+    rebuilt = IVFPQIndex.build(store, trained=index)
+    assert rebuilt.is_current()
+    assert len(rebuilt) == 396
+    assert IVFPQIndex.meta_stamp(store) != stamp
+
+
+def dominated_store(root, dim=16, seed=3):
+    """Most rows near the query belong to one blob; the other blobs are spread out."""
+    rng = np.random.default_rng(seed)
+    direction = np.zeros(dim)
+    direction[0] = 1.0
+    near = direction + 0.05 * rng.normal(size=(600, dim))
+    far = rng.normal(size=(200, dim))
+    store = VectorStore(str(root))
+    documents = [{"blob_name": "big.pdf", "container": "docs", "content": f"big {i}", "embedding": v,
+                  "last_modified": "2025-01-01T00:00:00", "size": 1, "chunk_index": i}
+                 for i, v in enumerate(near)]
+    documents += [{"blob_name": f"small-{i}.pdf", "container": "docs", "content": f"small {i}", "embedding": v,
+                   "last_modified": "2025-01-01T00:00:00", "size": 1, "chunk_index": 0}
+                  for i, v in enumerate(far)]
+    store.apply_delta(documents)
+    return store, direction
+
+
+def test_search_unique_gives_up_instead_of_reranking_the_corpus(tmp_path, monkeypatch):
+    store, query = dominated_store(tmp_path / "docs")
+    index = IVFPQIndex.build(store, nlist=8, m=8, nbits=4, iters=5)
+    index.rerank = 20
+    reranked = []
+    vector = IVFPQIndex.vector
+    monkeypatch.setattr(IVFPQIndex, "vector", lambda self, i: reranked.append(i) or vector(self, i))
+
+    assert index.search_unique(query, 10) is None
+    # Widening stops at 4 x max(rerank, 3k) = 120 rows instead of growing towards all 800
+    assert len(reranked) <= 30 + 120
+
+    found = index.search_unique(query, 10, max_candidates=len(index))
+    assert found is not None and len(found[0]) == 10
+
+
+def test_retriever_falls_back_to_exact_scoring(tmp_path, monkeypatch):
+    monkeypatch.setenv("AZURE_API_KEY", "test")
+    monkeypatch.setenv("AZURE_ENDPOINT", "https://example.openai.azure.com")
+    monkeypatch.chdir(tmp_path)
+    from document_retriever import DocumentRetriever
+
+    store, query = dominated_store(tmp_path / "vectors" / "docs")
+    IVFPQIndex.build(store, nlist=8, m=8, nbits=4, iters=5)
+    retriever = DocumentRetriever(ann_rerank=20)
+    monkeypatch.setattr(retriever, "get_embedding", lambda text: query.tolist())
+
+    results = retriever.semantic_search("anything", "docs", top_k=10)
+
+    blobs = [result["document"]["blob_name"] for result in results]
+    assert len(blobs) == 10 and len(set(blobs)) == 10 and blobs[0] == "big.pdf"
+    assert retriever.is_loaded("docs")
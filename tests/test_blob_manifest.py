@@ -0,0 +1,56 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from blob_manifest import BlobManifest
+
+
+def blob(name, etag="1", size=10, day=1):
+    return SimpleNamespace(name=name, etag=etag, size=size,
+                           last_modified=datetime(2025, 1, day, tzinfo=timezone.utc))
+
+
+def test_empty_manifest_reports_everything_as_added(tmp_path):
+    manifest = BlobManifest(str(tmp_path / "manifest.json"))
+
+    added, changed, deleted = manifest.diff([blob("a.pdf"), blob("b.pdf")])
+
+    assert [b.name for b in added] == ["a.pdf", "b.pdf"]
+    assert changed == [] and deleted == []
+
+
+def test_diff_detects_changed_and_deleted_blobs(tmp_path):
+    manifest = BlobManifest(str(tmp_path / "manifest.json"))
+    for b in (blob("same.pdf"), blob("etag.pdf"), blob("size.pdf"), blob("date.pdf"), blob("gone.pdf")):
+        manifest.update(b)
+
+    added, changed, deleted = manifest.diff([
+        blob("same.pdf"), blob("etag.pdf", etag="2"), blob("size.pdf", size=11),
+        blob("date.pdf", day=2), blob("new.pdf")
+    ])
+
+    assert [b.name for b in added] == ["new.pdf"]
+    assert sorted(b.name for b in changed) == ["date.pdf", "etag.pdf", "size.pdf"]
+    assert deleted == ["gone.pdf"]
+
+
+def test_save_and_reload_keep_extra_fields(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    manifest = BlobManifest(path)
+    manifest.update(blob("a.pdf"), chunks=3)
+    manifest.update(blob("b.pdf"))
+    manifest.remove("b.pdf")
+    manifest.save()
+
+    reloaded = BlobManifest(path)
+
+    assert list(reloaded.entries) == ["a.pdf"]
+    assert reloaded.entries["a.pdf"]["chunks"] == 3
+    assert reloaded.is_current(blob("a.pdf"))
+    assert not (tmp_path / "manifest.json.tmp").exists()
+
+
+def test_corrupt_manifest_starts_empty(tmp_path):
+    path = tmp_path / "manifest.json"
+    path.write_text("{not json")
+
+    assert BlobManifest(str(path)).entries == {}
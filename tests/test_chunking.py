@@ -0,0 +1,116 @@
+import pytest
+
+import chunking
+from chunking import TokenChunker, count_tokens
+
+
+def paragraph(word, sentences=4):
+    return " ".join(f"{word.capitalize()} sentence number {i} talks about {word}." for i in range(sentences))
+
+
+def test_short_text_is_one_chunk():
+    chunks = TokenChunker(max_tokens=200, overlap_tokens=20).chunk_text("Hello world.\n\nSecond paragraph.")
+
+    assert len(chunks) == 1
+    assert chunks[0]["text"] == "Hello world.\n\nSecond paragraph."
+    assert chunks[0]["page_start"] == chunks[0]["page_end"] == 1
+
+
+def test_chunks_stay_within_max_tokens():
+    text = "\n\n".join(paragraph(word) for word in ("alpha", "beta", "gamma", "delta", "epsilon"))
+    chunker = TokenChunker(max_tokens=40, overlap_tokens=10)
+    chunks = chunker.chunk_text(text)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk["token_count"] <= 40
+        assert count_tokens(chunk["text"]) <= 40 + 5
+
+
+def test_paragraphs_and_sentences_are_not_cut():
+    sentences = [f"Sentence {i} is here." for i in range(30)]
+    text = " ".join(sentences)
+    chunks = TokenChunker(max_tokens=30, overlap_tokens=0).chunk_text(text)
+
+    for chunk in chunks:
+        assert chunk["text"].startswith("Sentence ")
+        assert chunk["text"].endswith(".")
+    # Without overlap every sentence appears exactly once
+    assert " ".join(chunk["text"] for chunk in chunks) == text
+
+
+def test_overlap_repeats_the_end_of_the_previous_chunk():
+    text = " ".join(f"Sentence {i} is here." for i in range(30))
+    chunks = TokenChunker(max_tokens=30, overlap_tokens=10).chunk_text(text)
+
+    assert len(chunks) > 1
+    for previous, current in zip(chunks, chunks[1:]):
+        overlap = text[current["start_offset"]:previous["end_offset"]]
+        assert overlap and previous["text"].endswith(overlap) and current["text"].startswith(overlap)
+        # overlap_tokens, plus a little for the joining spaces
+        assert count_tokens(overlap) <= 12
+
+
+def test_oversized_sentence_is_split_by_tokens():
+    text = " ".join(f"word{i}" for i in range(400))
+    chunks = TokenChunker(max_tokens=50, overlap_tokens=0).chunk_text(text)
+
+    assert len(chunks) > 1
+    assert all(chunk["token_count"] <= 50 for chunk in chunks)
+    assert "".join(chunk["text"] for chunk in chunks).replace(" ", "") == text.replace(" ", "")
+
+
+@pytest.fixture
+def estimated_tokens(monkeypatch):
+    """Use the character-based estimate as if tiktoken were missing."""
+    monkeypatch.setattr(chunking, "_encoding", None)
+
+
+def test_estimated_split_keeps_original_whitespace(estimated_tokens):
+    text = "word\t  other  words\u00a0and " * 60
+    chunks = TokenChunker(max_tokens=20, overlap_tokens=0).chunk_text(text)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert count_tokens(chunk["text"]) <= 20
+        assert text[chunk["start_offset"]:chunk["end_offset"]] == chunk["text"]
+
+
+def test_estimated_split_cuts_words_longer_than_the_budget(estimated_tokens):
+    text = "short " + "x" * 500 + " tail"
+    chunks = TokenChunker(max_tokens=20, overlap_tokens=0).chunk_text(text)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert count_tokens(chunk["text"]) <= 20
+        assert text[chunk["start_offset"]:chunk["end_offset"]] == chunk["text"]
+    assert "".join(chunk["text"] for chunk in chunks).replace(" ", "") == text.replace(" ", "")
+
+
+def test_offsets_point_into_the_joined_document():
+    units = [(1, paragraph("alpha")), (2, paragraph("beta")), (3, paragraph("gamma"))]
+    document = "\n".join(text for _, text in units)
+    chunks = list(TokenChunker(max_tokens=30, overlap_tokens=0).chunk_units(units))
+
+    for chunk in chunks:
+        assert document[chunk["start_offset"]:chunk["end_offset"]] == chunk["text"]
+
+
+def test_pages_are_tracked_across_units():
+    units = [(1, paragraph("alpha", 2)), (2, paragraph("beta", 2)), (3, paragraph("gamma", 2))]
+    chunks = list(TokenChunker(max_tokens=60, overlap_tokens=0).chunk_units(units))
+
+    assert chunks[0]["page_start"] == 1
+    assert chunks[-1]["page_end"] == 3
+    for chunk in chunks:
+        assert chunk["page_start"] <= chunk["page_end"]
+    assert [c["page_start"] for c in chunks] == sorted(c["page_start"] for c in chunks)
+
+
+def test_blank_units_produce_no_chunks():
+    assert list(TokenChunker().chunk_units([(1, ""), (2, "   \n\n  ")])) == []
+
+
+def test_overlap_must_be_smaller_than_max_tokens():
+    with pytest.raises(ValueError):
+        TokenChunker(max_tokens=10, overlap_tokens=10)
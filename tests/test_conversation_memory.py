@@ -0,0 +1,124 @@
+import asyncio
+
+from chunking import count_tokens
+from conversation_memory import ConversationMemory, messages_tokens, turn_tokens
+
+
+def turns(n, words=20):
+    return [{"user": f"question {i} " + "word " * words, "assistant": f"answer {i} " + "word " * words}
+            for i in range(n)]
+
+
+class FakeLLM:
+    def __init__(self, reply="summary of earlier turns", error=None):
+        self.reply = reply
+        self.error = error
+        self.prompts = []
+
+    def __call__(self, prompt):
+        self.prompts.append(prompt)
+        if self.error:
+            raise self.error
+        return self.reply
+
+
+def test_within_budget_nothing_is_folded():
+    llm = FakeLLM()
+    memory = ConversationMemory(llm, recent_budget=10_000)
+    history = turns(3)
+
+    assert memory.fold("", history) == {"summary": "", "chat_history": history}
+    assert llm.prompts == []
+
+
+def test_split_keeps_about_half_the_budget_and_the_latest_turn():
+    history = turns(10)
+    budget = 3 * turn_tokens(history[0])
+    older, recent = ConversationMemory(FakeLLM(), recent_budget=budget).split(history)
+
+    assert older + recent == history
+    assert recent[-1] == history[-1]
+    assert sum(turn_tokens(turn) for turn in recent) <= budget // 2 or len(recent) == 1
+
+
+def test_split_keeps_an_oversized_latest_turn():
+    history = turns(2) + [{"user": "word " * 500, "assistant": "word " * 500}]
+    older, recent = ConversationMemory(FakeLLM(), recent_budget=100).split(history)
+
+    assert recent == history[-1:] and older == history[:-1]
+
+
+def test_fold_summarizes_the_overflow_with_the_old_summary():
+    llm = FakeLLM(reply="  new summary  ")
+    history = turns(10)
+    memory = ConversationMemory(llm, recent_budget=3 * turn_tokens(history[0]), summary_budget=50)
+
+    folded = memory.fold("old summary", history)
+
+    assert folded["summary"] == "new summary"
+    assert folded["chat_history"] == history[-len(folded["chat_history"]):]
+    assert len(llm.prompts) == 1
+    assert "old summary" in llm.prompts[0] and "question 0" in llm.prompts[0]
+    assert "at most 50 tokens" in llm.prompts[0]
+    # Turns kept verbatim are not sent for summarizing
+    assert history[-1]["user"] not in llm.prompts[0]
+
+
+def test_failed_summary_keeps_the_old_summary_and_stays_bounded():
+    history = turns(10)
+    memory = ConversationMemory(FakeLLM(error=RuntimeError("timeout")), recent_budget=3 * turn_tokens(history[0]))
+
+    folded = memory.fold("old summary", history)
+
+    assert folded["summary"] == "old summary"
+    assert len(folded["chat_history"]) < len(history)
+
+
+def test_afold_awaits_the_async_llm():
+    history = turns(10)
+    memory = ConversationMemory(FakeLLM(), recent_budget=3 * turn_tokens(history[0]))
+
+    async def acomplete(prompt):
+        return "async summary"
+
+    folded = asyncio.run(memory.afold("", history, acomplete))
+
+    assert folded["summary"] == "async summary"
+
+
+def test_prompt_size_stays_flat_as_the_conversation_grows():
+    memory = ConversationMemory(FakeLLM(reply="short summary"), recent_budget=400)
+    summary, history, sizes = "", [], []
+    for turn in turns(40):
+        history.append(turn)
+        folded = memory.fold(summary, history)
+        summary, history = folded["summary"], folded["chat_history"]
+        sizes.append(messages_tokens(memory.messages("system", summary, history, "next")))
+
+    assert max(sizes[10:]) <= 400 + 100
+
+
+def test_context_and_messages_include_the_summary():
+    memory = ConversationMemory(FakeLLM())
+    history = [{"user": "hi", "assistant": "hello"}]
+
+    assert memory.context("", history) == "User: hi\nAssistant: hello\n"
+    assert memory.context("talked about Fabric", history).startswith(
+        "Summary of earlier conversation: talked about Fabric\n")
+
+    messages = memory.messages("You are helpful.", "talked about Fabric", history, "and Power BI?")
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+    assert "talked about Fabric" in messages[0]["content"]
+    assert messages[-1]["content"] == "and Power BI?"
+
+
+def test_usage_counts_summary_and_recent_turns():
+    memory = ConversationMemory(FakeLLM())
+    history = turns(2)
+
+    usage = memory.usage("a summary", history, prompt_tokens=123)
+
+    assert usage == {"summary_tokens": count_tokens("a summary"),
+                     "recent_tokens": sum(turn_tokens(turn) for turn in history),
+                     "recent_turns": 2, "prompt_tokens": 123}
+    assert "prompt_tokens" not in memory.usage("", [])
@@ -0,0 +1,105 @@
+import asyncio
+from types import SimpleNamespace
+from typing import TypedDict
+
+import pytest
+
+pytest.importorskip("langgraph")
+
+from langgraph.graph import END, StateGraph
+
+import conversation_store
+from conversation_store import SessionMemorySaver, make_checkpointer, session_config, sqlite_saver
+
+
+class State(TypedDict):
+    turns: int
+
+
+def counter_graph(checkpointer):
+    """A one-node graph that counts the turns of each session."""
+    graph = StateGraph(State)
+    graph.add_node("count", lambda state: {"turns": state.get("turns", 0) + 1})
+    graph.set_entry_point("count")
+    graph.add_edge("count", END)
+    return graph.compile(checkpointer=checkpointer)
+
+
+def turn(app, session_id):
+    return app.invoke({}, config=session_config(session_id))["turns"]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    state = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(conversation_store, "time", SimpleNamespace(time=lambda: state.now))
+    return state
+
+
+def test_sessions_keep_separate_state():
+    app = counter_graph(SessionMemorySaver())
+
+    assert [turn(app, "a"), turn(app, "a"), turn(app, "b"), turn(app, "a")] == [1, 2, 1, 3]
+
+
+def test_least_recently_used_sessions_are_evicted():
+    saver = SessionMemorySaver(max_sessions=2)
+    app = counter_graph(saver)
+    turn(app, "a"), turn(app, "b"), turn(app, "a")
+
+    turn(app, "c")
+
+    assert saver.sessions() == 2 and saver.evictions == 1
+    # a was used after b, so b was forgotten
+    assert turn(app, "a") == 3
+    assert turn(app, "b") == 1
+
+
+def test_idle_sessions_are_evicted(clock):
+    saver = SessionMemorySaver(idle_seconds=60)
+    app = counter_graph(saver)
+    turn(app, "a"), turn(app, "b")
+
+    clock.now += 30
+    turn(app, "b")
+    clock.now += 45
+    turn(app, "c")
+
+    assert saver.evictions == 1
+    assert turn(app, "b") == 3
+    assert turn(app, "a") == 1
+
+
+def test_sqlite_sessions_are_shared_between_workers(tmp_path):
+    path = str(tmp_path / "conversations.sqlite")
+    first, second = counter_graph(sqlite_saver(path)), counter_graph(sqlite_saver(path))
+
+    assert [turn(first, "a"), turn(second, "a"), turn(first, "a")] == [1, 2, 3]
+
+
+def test_sqlite_idle_sessions_are_pruned(tmp_path, clock):
+    app = counter_graph(sqlite_saver(str(tmp_path / "conversations.sqlite"), idle_seconds=600))
+    turn(app, "a"), turn(app, "b")
+
+    clock.now += 500
+    turn(app, "b")
+    clock.now += 200
+    turn(app, "c")
+
+    assert turn(app, "b") == 3
+    assert turn(app, "a") == 1
+
+
+def test_sqlite_saver_runs_async_graphs(tmp_path):
+    app = counter_graph(sqlite_saver(str(tmp_path / "conversations.sqlite")))
+
+    async def turns():
+        return [(await app.ainvoke({}, config=session_config("a")))["turns"] for _ in range(2)]
+
+    assert asyncio.run(turns()) == [1, 2]
+
+
+def test_unknown_backend_is_rejected():
+    assert isinstance(make_checkpointer("memory"), SessionMemorySaver)
+    with pytest.raises(ValueError):
+        make_checkpointer("postgres")
@@ -0,0 +1,152 @@
+import time
+
+import numpy as np
+import pytest
+
+import document_retriever
+from vector_store import VectorStore
+
+
+def make_docs(blob_name, vectors, container="docs", words=5):
+    return [{
+        "blob_name": blob_name,
+        "container": container,
+        "content": f"{blob_name} chunk {i} " + "word " * words,
+        "embedding": vector,
+        "last_modified": "2025-01-01T00:00:00",
+        "size": 100,
+        "chunk_index": i
+    } for i, vector in enumerate(vectors)]
+
+
+def unit(similarity, dim=8, axis=1):
+    """A unit vector whose cosine with the first basis vector is ``similarity``."""
+    vector = np.zeros(dim)
+    vector[0], vector[axis] = similarity, np.sqrt(1 - similarity ** 2)
+    return vector
+
+
+@pytest.fixture
+def retriever(monkeypatch, tmp_path):
+    monkeypatch.setenv("AZURE_API_KEY", "test")
+    monkeypatch.setenv("AZURE_ENDPOINT", "https://example.openai.azure.com")
+    monkeypatch.setattr(document_retriever, "QA_MIN_SIMILARITY", None)
+    monkeypatch.chdir(tmp_path)
+    retriever = document_retriever.DocumentRetriever(use_ann=False)
+    retriever.store = VectorStore(str(tmp_path / "vectors" / "docs"))
+    retriever.query = np.eye(8)[0]
+    monkeypatch.setattr(retriever, "get_embedding", lambda text: list(retriever.query))
+    return retriever
+
+
+def context(retriever, **kwargs):
+    """build_context once the background load (and calibration) has finished."""
+    deadline = time.monotonic() + 10
+    while True:
+        passages = retriever.build_context("question", "docs", **kwargs)
+        if passages is not None or time.monotonic() > deadline:
+            return passages
+        time.sleep(0.01)
+
+
+def test_context_is_skipped_while_the_store_loads(retriever):
+    retriever.store.apply_delta(make_docs("a.pdf", [unit(0.9)]))
+
+    assert retriever.build_context("question", "docs", min_similarity=0.5) is None
+    assert [p["blob_name"] for p in context(retriever, min_similarity=0.5)] == ["a.pdf"]
+
+
+def test_no_local_store_is_not_a_skip(retriever):
+    assert retriever.build_context("question", "docs", min_similarity=0.5) == []
+
+
+def test_chunks_below_the_threshold_are_left_out(retriever):
+    retriever.store.apply_delta(make_docs("strong.pdf", [unit(0.95)]))
+    retriever.store.apply_delta(make_docs("weak.pdf", [unit(0.6, axis=2)]))
+
+    assert [p["blob_name"] for p in context(retriever, min_similarity=0.8)] == ["strong.pdf"]
+    assert context(retriever, min_similarity=0.99) == []
+
+
+def test_chunks_per_document_are_capped_and_kept_in_reading_order(retriever):
+    # Chunks on different sides of the query, so none is dropped as a near-duplicate
+    retriever.store.apply_delta(make_docs("a.pdf", [unit(0.7 - 0.01 * i, axis=1 + i) for i in range(5)]))
+    retriever.store.apply_delta(make_docs("b.pdf", [unit(0.6, axis=7)]))
+
+    passages = context(retriever, min_similarity=0.5, max_per_document=2, diversity=0.0)
+
+    assert [(p["blob_name"], p["chunk_index"]) for p in passages] == [("a.pdf", 0), ("a.pdf", 1), ("b.pdf", 0)]
+
+
+def test_token_budget_skips_chunks_that_do_not_fit(retriever):
+    retriever.store.apply_delta(make_docs("long.pdf", [unit(0.99)], words=200))
+    retriever.store.apply_delta(make_docs("short.pdf", [unit(0.9, axis=2)]))
+
+    passages = context(retriever, min_similarity=0.5, max_tokens=50)
+
+    assert [p["blob_name"] for p in passages] == ["short.pdf"]
+    assert sum(p["tokens"] for p in passages) <= 50
+
+
+def clustered(retriever, clusters=4, docs_per_cluster=3, chunks=4, seed=0):
+    """Documents on a few well separated subjects; returns the subject centres."""
+    rng = np.random.default_rng(seed)
+    centres = np.eye(32)[:clusters]
+    for c, centre in enumerate(centres):
+        for d in range(docs_per_cluster):
+            vectors = centre + 0.15 * rng.normal(size=(chunks, 32))
+            retriever.store.apply_delta(make_docs(f"subject{c}-{d}.pdf", vectors))
+    return centres
+
+
+def test_calibrated_cut_off_separates_covered_and_unrelated_questions(retriever):
+    centres = clustered(retriever)
+
+    retriever.query = centres[2] + 0.1 * np.eye(32)[31]
+    covered = context(retriever)
+    cut_off = retriever.min_similarity("docs")
+    retriever.query = np.eye(32)[20]
+    unrelated = context(retriever)
+
+    assert 0.3 < cut_off < 0.99
+    assert covered and {p["blob_name"].split("-")[0] for p in covered} == {"subject2"}
+    assert unrelated == []
+
+
+def test_calibration_follows_the_store(retriever):
+    centres = clustered(retriever, clusters=2)
+    retriever.query = centres[0]
+    context(retriever)
+    assert retriever.min_similarity("docs") is not None
+
+    retriever.store.apply_delta(make_docs("new.pdf", [np.ones(32)]))
+    assert retriever.min_similarity("docs") is None
+    assert retriever.build_context("question", "docs") is None
+
+
+def test_single_document_store_leaves_grounding_off(retriever):
+    retriever.store.apply_delta(make_docs("only.pdf", [unit(0.99), unit(0.98, axis=2)]))
+
+    assert context(retriever) == []
+    assert retriever.calibrate_min_similarity("docs") is None
+
+
+def test_configured_cut_off_wins(retriever, monkeypatch):
+    monkeypatch.setattr(document_retriever, "QA_MIN_SIMILARITY", 0.9)
+    retriever.store.apply_delta(make_docs("a.pdf", [unit(0.95)]))
+    retriever.store.apply_delta(make_docs("b.pdf", [unit(0.85, axis=2)]))
+
+    assert [p["blob_name"] for p in context(retriever)] == ["a.pdf"]
+
+
+def test_calibration_uses_the_ann_index(retriever):
+    from ann_index import IVFPQIndex
+
+    clustered(retriever)
+    IVFPQIndex.build(retriever.store, nlist=4, m=8)
+    retriever.use_ann = True
+
+    assert retriever.load_ann_index("docs") is not None
+    cut_off = retriever.calibrate_min_similarity("docs")
+    retriever.use_ann = False
+    assert cut_off == pytest.approx(retriever.calibrate_min_similarity("docs"), abs=0.02)
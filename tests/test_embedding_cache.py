@@ -0,0 +1,112 @@
+import sqlite3
+
+import pytest
+
+import embedding_cache
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), max_entries=10)
+    yield cache
+    cache.close()
+
+
+def stored_access_times(path):
+    with sqlite3.connect(path) as conn:
+        return dict(conn.execute("SELECT key, last_access FROM embeddings"))
+
+
+def test_round_trip_and_normalized_keys(cache):
+    cache.put("ada", "Hello   world ", [0.5, 1.5])
+
+    assert cache.get("ada", "Hello world") == [0.5, 1.5]
+    assert cache.get("other-model", "Hello world") is None
+    assert cache.get_many("ada", ["nope", "Hello world"]) == [None, [0.5, 1.5]]
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+
+
+def test_failed_embeddings_are_not_stored(cache):
+    cache.put_many("ada", ["a", "b"], [None, [1.0]])
+
+    assert cache.stats()["entries"] == 1
+
+
+def test_eviction_drops_least_recently_used_below_the_limit(cache):
+    for i in range(10):
+        cache.put("ada", f"text {i}", [float(i)])
+    # Reading text 0 makes it recent; the write reaches disk with the next put
+    cache.get("ada", "text 0")
+    cache.put("ada", "text 10", [10.0])
+
+    entries = cache.stats()["entries"]
+    assert entries == int(10 * (1 - embedding_cache.EVICT_SLACK))
+    assert cache.get("ada", "text 0") == [0.0]
+    assert cache.get("ada", "text 1") is None
+    assert cache.get("ada", "text 10") == [10.0]
+
+
+def test_eviction_does_not_run_on_every_put(cache, monkeypatch):
+    counts = []
+    evict = EmbeddingCache._evict
+    monkeypatch.setattr(EmbeddingCache, "_evict", lambda self: counts.append(1) or evict(self))
+    for i in range(30):
+        cache.put("ada", f"text {i}", [float(i)])
+
+    assert cache.stats()["entries"] <= 10
+    assert 0 < len(counts) < 30
+
+
+def test_access_times_are_buffered_until_flushed(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "ACCESS_FLUSH_KEYS", 3)
+    path = str(tmp_path / "cache.db")
+    cache = EmbeddingCache(path)
+    cache.put_many("ada", ["a", "b", "c"], [[1.0], [2.0], [3.0]])
+    written = stored_access_times(path)
+
+    cache.get_many("ada", ["a", "b"])
+    assert stored_access_times(path) == written
+
+    cache.get("ada", "c")
+    flushed = stored_access_times(path)
+    assert all(flushed[key] > written[key] for key in written)
+
+    cache.get("ada", "a")
+    cache.close()
+    assert stored_access_times(path)[EmbeddingCache.make_key("ada", "a")] > flushed[EmbeddingCache.make_key("ada", "a")]
+
+
+def test_count_survives_reopening(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = EmbeddingCache(path, max_entries=5)
+    cache.put_many("ada", [f"t{i}" for i in range(4)], [[float(i)] for i in range(4)])
+    cache.close()
+
+    reopened = EmbeddingCache(path, max_entries=5)
+    reopened.put_many("ada", ["x", "y"], [[1.0], [2.0]])
+
+    assert reopened.stats()["entries"] <= 5
+    reopened.close()
+
+
+def test_cached_embeddings_only_embeds_misses(cache):
+    class FakeEmbeddings:
+        def __init__(self):
+            self.calls = []
+
+        def embed_documents(self, texts):
+            self.calls.append(list(texts))
+            return [[float(len(text))] for text in texts]
+
+        def embed_query(self, text):
+            self.calls.append([text])
+            return [float(len(text))]
+
+    fake = FakeEmbeddings()
+    cached = CachedEmbeddings(fake, "ada", cache)
+
+    assert cached.embed_documents(["ab", "abc"]) == [[2.0], [3.0]]
+    assert cached.embed_documents(["abc", "abcd"]) == [[3.0], [4.0]]
+    assert cached.embed_query("ab") == [2.0]
+    assert fake.calls == [["ab", "abc"], ["abcd"]]
@@ -0,0 +1,131 @@
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import embedding_client
+from embedding_client import BatchEmbeddingClient
+from chunking import count_tokens
+
+
+def api_error(cls, status, headers=None):
+    request = httpx.Request("POST", "https://example.openai.azure.com/embeddings")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return cls(f"status {status}", response=response, body=None)
+
+
+class FakeOpenAI:
+    """Embeds each text as [len(text)]; ``errors`` are raised by the next calls in order,
+    and texts containing ``bad`` are rejected with a 400."""
+
+    def __init__(self, errors=(), bad="BAD"):
+        self.errors = list(errors)
+        self.bad = bad
+        self.calls = []
+        self.embeddings = SimpleNamespace(create=self.create)
+
+    def with_options(self, **kwargs):
+        return self
+
+    def create(self, input, model):
+        self.calls.append(list(input))
+        if self.errors:
+            raise self.errors.pop(0)
+        if any(self.bad in text for text in input):
+            raise api_error(openai.BadRequestError, 400)
+        # Out of order, as the service does not promise ordering
+        data = [SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+        return SimpleNamespace(data=list(reversed(data)))
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    waits = []
+    monkeypatch.setattr(embedding_client.time, "sleep", waits.append)
+    return waits
+
+
+def test_batches_respect_item_and_token_limits():
+    texts = ["word " * 50] * 10
+    client = BatchEmbeddingClient(FakeOpenAI(), "ada", max_batch_items=4,
+                                  max_batch_tokens=3 * count_tokens(texts[0]))
+
+    batches = client.make_batches(texts)
+
+    assert [len(batch) for batch in batches] == [3, 3, 3, 1]
+    assert [i for batch in batches for i in batch] == list(range(10))
+
+
+def test_small_default_batches_fill_the_concurrency_limit():
+    client = BatchEmbeddingClient(FakeOpenAI(), "ada")
+
+    assert len(client.make_batches(["short text"] * 256)) >= client.max_in_flight
+
+
+def test_embed_keeps_input_order_across_batches():
+    fake = FakeOpenAI()
+    client = BatchEmbeddingClient(fake, "ada", max_batch_items=2, max_in_flight=3)
+    texts = ["a" * n for n in range(1, 8)]
+
+    assert client.embed(texts) == [[float(n)] for n in range(1, 8)]
+    assert len(fake.calls) == 4
+
+
+def test_throttling_waits_for_the_retry_after_header(sleeps):
+    fake = FakeOpenAI(errors=[api_error(openai.RateLimitError, 429, {"retry-after-ms": "1500"}),
+                              api_error(openai.RateLimitError, 429, {"retry-after": "2"})])
+    client = BatchEmbeddingClient(fake, "ada")
+
+    assert client.embed(["abc"]) == [[3.0]]
+    assert sleeps == [1.5, 2.0]
+
+
+def test_throttling_without_a_hint_backs_off_exponentially(sleeps):
+    fake = FakeOpenAI(errors=[api_error(openai.InternalServerError, 500) for _ in range(3)])
+    client = BatchEmbeddingClient(fake, "ada")
+
+    client.embed(["abc"])
+
+    assert sleeps == [1, 2, 4]
+
+
+def test_retries_are_bounded(sleeps):
+    fake = FakeOpenAI(errors=[api_error(openai.RateLimitError, 429) for _ in range(10)])
+    client = BatchEmbeddingClient(fake, "ada", max_retries=2)
+
+    assert client.embed(["abc", "de"]) == [None, None]
+    assert len(fake.calls) == 3
+
+
+def test_rejected_batch_is_bisected_down_to_the_bad_items():
+    fake = FakeOpenAI()
+    client = BatchEmbeddingClient(fake, "ada", max_batch_items=8)
+    texts = ["aa", "bbb", "BAD", "c", "dddd", "BAD!", "ee", "f"]
+
+    results = client.embed(texts)
+
+    assert results == [[2.0], [3.0], None, [1.0], [4.0], None, [2.0], [1.0]]
+    # Good halves are sent once more, not item by item
+    assert len(fake.calls) < 2 * len(texts)
+
+
+def test_cache_is_consulted_and_filled():
+    class DictCache:
+        def __init__(self):
+            self.entries = {("ada", "cached"): [9.0]}
+
+        def get_many(self, model, texts):
+            return [self.entries.get((model, text)) for text in texts]
+
+        def put_many(self, model, texts, embeddings):
+            for text, embedding in zip(texts, embeddings):
+                if embedding:
+                    self.entries[(model, text)] = embedding
+
+    fake, cache = FakeOpenAI(), DictCache()
+    client = BatchEmbeddingClient(fake, "ada", cache=cache)
+
+    assert client.embed(["cached", "new"]) == [[9.0], [3.0]]
+    assert fake.calls == [["new"]]
+    assert cache.entries[("ada", "new")] == [3.0]
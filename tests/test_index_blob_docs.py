@@ -0,0 +1,138 @@
+import importlib
+import json
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+
+def blob(name, etag="1"):
+    return SimpleNamespace(name=name, etag=etag, size=10, last_modified=datetime(2025, 1, 1, tzinfo=timezone.utc))
+
+
+class FakeContainer:
+    def __init__(self, blobs):
+        self.blobs = blobs
+
+    def list_blobs(self):
+        return list(self.blobs)
+
+    def get_blob_client(self, blob):
+        return blob
+
+
+class FakeWriter:
+    """Records queued uploads and deletes; keys in fail are reported as failed."""
+
+    def __init__(self, fail=()):
+        self.added, self.deleted, self.fail = [], [], set(fail)
+
+    def add(self, doc):
+        self.added.append(doc)
+
+    def delete(self, key):
+        self.deleted.append(key)
+
+    def close(self):
+        failures = [{"key": doc["id"], "status_code": 500, "error": "boom"}
+                    for doc in self.added if doc["id"] in self.fail]
+        return {"succeeded": len(self.added) - len(failures), "deleted": len(self.deleted),
+                "failed": len(failures), "failures": failures}
+
+
+@pytest.fixture
+def indexer(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("AZURE_ENDPOINT", "https://example.openai.azure.com")
+    monkeypatch.setenv("AZURE_API_KEY", "key")
+    module = importlib.import_module("index_blob_docs")
+    monkeypatch.setattr(module, "CHECKPOINT_PATH", str(tmp_path / "checkpoint.json"))
+    # No checkpoint yet and nothing in the index
+    monkeypatch.setattr(module, "SearchClient", lambda *args: SimpleNamespace(search=lambda **kwargs: []))
+    monkeypatch.setattr(module, "AzureKeyCredential", lambda key: None)
+    monkeypatch.setattr(module, "embedding_cache", SimpleNamespace(stats=lambda: {"hits": 0, "misses": 0}))
+
+    # A blob's content is the list of its page texts; "unreadable" raises part-way through
+    contents = {}
+
+    @contextmanager
+    def open_stream(blob):
+        yield contents[blob.name]
+
+    def units(name, pages):
+        for number, text in enumerate(pages, 1):
+            if text == "unreadable":
+                raise IOError("truncated download")
+            yield number, text
+
+    monkeypatch.setattr(module, "open_blob_stream", open_stream)
+    monkeypatch.setattr(module, "iter_document_units", units)
+
+    def run(blobs, sync=False, fail=()):
+        writer = FakeWriter(fail)
+        monkeypatch.setattr(module, "ContainerClient", SimpleNamespace(
+            from_connection_string=lambda *args: FakeContainer(blobs)))
+        monkeypatch.setattr(module, "SearchIndexWriter", lambda *args: writer)
+        module.index_documents(sync=sync)
+        with open(module.CHECKPOINT_PATH) as f:
+            return writer, json.load(f)
+
+    module.contents = contents
+    return module, run
+
+
+def pages(count):
+    # Each page is big enough to be its own chunk
+    return [f"Page {i}. " + "word " * 300 for i in range(count)]
+
+
+def test_full_run_records_chunk_counts(indexer):
+    module, run = indexer
+    module.contents.update({"a.pdf": pages(3), "b.pdf": pages(1)})
+
+    writer, checkpoint = run([blob("a.pdf"), blob("b.pdf")])
+
+    assert [doc["id"] for doc in writer.added] == ["a_pdf-0", "a_pdf-1", "a_pdf-2", "b_pdf-0"]
+    assert checkpoint["a.pdf"]["chunks"] == 3 and checkpoint["b.pdf"]["chunks"] == 1
+
+
+def test_sync_indexes_changes_and_deletes_stale_chunks(indexer):
+    module, run = indexer
+    module.contents.update({"a.pdf": pages(3), "b.pdf": pages(1), "c.pdf": pages(2)})
+    run([blob("a.pdf"), blob("b.pdf"), blob("c.pdf")])
+
+    module.contents.update({"a.pdf": pages(1), "d.pdf": pages(1)})
+    writer, checkpoint = run([blob("a.pdf", etag="2"), blob("b.pdf"), blob("d.pdf")], sync=True)
+
+    assert sorted(doc["id"] for doc in writer.added) == ["a_pdf-0", "d_pdf-0"]
+    # a.pdf shrank to one chunk and c.pdf was deleted from the container
+    assert sorted(writer.deleted) == ["a_pdf-1", "a_pdf-2", "c_pdf-0", "c_pdf-1"]
+    assert sorted(checkpoint) == ["a.pdf", "b.pdf", "d.pdf"]
+    assert checkpoint["a.pdf"] == {"etag": "2", "size": 10, "last_modified": checkpoint["b.pdf"]["last_modified"],
+                                   "chunks": 1}
+
+
+@pytest.mark.parametrize("sync", [False, True])
+def test_unreadable_blob_uploads_nothing_and_keeps_its_entry(indexer, sync):
+    module, run = indexer
+    module.contents.update({"a.pdf": pages(2), "b.pdf": pages(1)})
+    run([blob("a.pdf"), blob("b.pdf")])
+
+    module.contents["a.pdf"] = pages(2) + ["unreadable"]
+    writer, checkpoint = run([blob("a.pdf", etag="2"), blob("b.pdf", etag="2")], sync=sync)
+
+    assert [doc["id"] for doc in writer.added] == ["b_pdf-0"]
+    assert writer.deleted == []
+    # The old entry stays, so the next sync still sees a.pdf as changed
+    assert checkpoint["a.pdf"]["etag"] == "1" and checkpoint["b.pdf"]["etag"] == "2"
+
+
+def test_upload_failure_keeps_the_previous_entry(indexer):
+    module, run = indexer
+    module.contents.update({"a.pdf": pages(1), "b.pdf": pages(1)})
+    run([blob("a.pdf"), blob("b.pdf")])
+
+    writer, checkpoint = run([blob("a.pdf", etag="2"), blob("b.pdf", etag="2")], sync=True, fail={"a_pdf-0"})
+
+    assert checkpoint["a.pdf"]["etag"] == "1" and checkpoint["b.pdf"]["etag"] == "2"
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+pytest.importorskip("azure.search.documents")
+
+from index_profiles import (
+    INDEX_PROFILES, build_index, embedding_cache_model, embedding_kwargs, layout_changes, load_index_profile
+)
+
+
+def test_same_profile_has_no_layout_changes():
+    for name in INDEX_PROFILES:
+        profile = load_index_profile(name)
+        assert layout_changes(build_index("docs", profile), profile) == []
+
+
+def test_compression_storage_and_dimensions_are_layout_changes():
+    existing = build_index("docs", load_index_profile("baseline"))
+
+    changes = layout_changes(existing, load_index_profile("reduced"))
+
+    assert sorted(change.split(":")[0] for change in changes) == ["compression", "dimensions", "stored"]
+    assert "index has None, profile 'reduced' has scalar" in " ".join(changes)
+
+
+def test_hnsw_parameters_are_not_layout_changes():
+    # m and ef_* can be updated in place
+    existing = build_index("docs", load_index_profile("balanced"))
+    profile = {**load_index_profile("balanced"), "m": 32, "ef_search": 900}
+
+    assert layout_changes(existing, profile) == []
+
+
+def test_unset_stored_attribute_means_stored():
+    existing = build_index("docs", load_index_profile("baseline"))
+    next(f for f in existing.fields if f.name == "content_vector").stored = None
+
+    assert layout_changes(existing, load_index_profile("baseline")) == []
+
+
+def test_missing_vector_field_is_reported():
+    existing = build_index("docs", load_index_profile("baseline"))
+    existing.fields = [f for f in existing.fields if f.name != "content_vector"]
+
+    assert layout_changes(existing, load_index_profile("baseline")) == ["content_vector field is missing"]
+
+
+def test_profile_overrides_from_file(monkeypatch, tmp_path):
+    path = tmp_path / "profiles.json"
+    path.write_text(json.dumps({"balanced": {"m": 32}, "tiny": {"dimensions": 256}}))
+    monkeypatch.setenv("INDEX_PROFILE_PATH", str(path))
+
+    assert load_index_profile("balanced")["m"] == 32
+    assert load_index_profile("balanced")["compression"] == "scalar"
+    # New profiles start from the default profile
+    assert load_index_profile("tiny")["compression"] is None
+    with pytest.raises(ValueError):
+        load_index_profile("missing")
+
+
+def test_shortened_embeddings_use_their_own_settings():
+    reduced = load_index_profile("reduced")
+
+    assert embedding_kwargs(reduced)["dimensions"] == 512
+    assert "dimensions" not in embedding_kwargs(load_index_profile("baseline"))
+    assert embedding_cache_model(reduced) == "text-embedding-3-large:512"
+    assert embedding_cache_model(load_index_profile("baseline")) == "text-embedding-ada-002"
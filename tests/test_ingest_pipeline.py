@@ -0,0 +1,124 @@
+import os
+import time
+
+import pytest
+
+import ingest_pipeline
+from ingest_pipeline import IngestPipeline
+
+
+class ScriptedChunker:
+    """Chunks a document into one chunk of its text; a document reading "crash" kills the
+    worker process and one reading "hang" never finishes."""
+
+    def chunk_units(self, units):
+        text = "".join(text for _, text in units)
+        if text == "crash":
+            os._exit(1)
+        if text == "hang":
+            time.sleep(600)
+        time.sleep(0.02)
+        return [{"text": text}]
+
+
+class FakeDownloader:
+    def __init__(self, data):
+        self.data = data
+
+    def readall(self):
+        return self.data
+
+    def readinto(self, stream):
+        stream.write(self.data)
+
+
+class FakeContainerClient:
+    def __init__(self, contents):
+        self.contents = contents
+
+    def get_blob_client(self, name):
+        data = self.contents[name]
+        return type("BlobClient", (), {"download_blob": lambda self, max_concurrency=1: FakeDownloader(data)})()
+
+
+class Blob:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+
+def run(pipeline, contents):
+    blobs = [Blob(name, len(data)) for name, data in contents.items()]
+    return {blob.name: chunks[0]["text"] for blob, chunks in pipeline.run(FakeContainerClient(contents), blobs)}
+
+
+@pytest.fixture
+def temp_files(monkeypatch, tmp_path):
+    """Send every payload through a temporary file under tmp_path."""
+    monkeypatch.setattr(ingest_pipeline.tempfile, "tempdir", str(tmp_path))
+    return tmp_path
+
+
+def test_documents_are_extracted_in_workers():
+    contents = {f"doc{i}.txt": f"text {i}".encode() for i in range(10)}
+    pipeline = IngestPipeline(download_workers=2, extract_workers=2, chunker=ScriptedChunker())
+
+    assert run(pipeline, contents) == {name: data.decode() for name, data in contents.items()}
+
+
+def test_in_flight_bytes_are_bounded(monkeypatch):
+    held = []
+    download = ingest_pipeline.download_blob
+
+    def counting_download(container_client, blob, inline_max_bytes):
+        held.append(blob.size)
+        return download(container_client, blob, inline_max_bytes)
+
+    monkeypatch.setattr(ingest_pipeline, "download_blob", counting_download)
+    contents = {f"doc{i}.txt": b"x" * 100 for i in range(8)}
+    pipeline = IngestPipeline(download_workers=4, extract_workers=2, max_inflight_bytes=250,
+                              chunker=ScriptedChunker())
+    results = pipeline.run(FakeContainerClient(contents), [Blob(name, 100) for name in contents])
+
+    next(results)
+    # Two 100-byte documents fit under the cap; the rest wait until the caller consumes results
+    assert len(held) <= 3
+    assert len(list(results)) == 7
+
+
+def test_crashed_worker_costs_only_its_own_document(temp_files):
+    contents = {f"doc{i}.txt": f"text {i}".encode() for i in range(8)}
+    contents["bad.txt"] = b"crash"
+    pipeline = IngestPipeline(download_workers=2, extract_workers=3, inline_max_bytes=0,
+                              chunker=ScriptedChunker())
+
+    results = run(pipeline, contents)
+
+    assert sorted(results) == sorted(name for name in contents if name != "bad.txt")
+    assert os.listdir(temp_files) == []
+
+
+def test_hung_document_is_skipped_with_alarm():
+    if not ingest_pipeline.HAS_ALARM:
+        pytest.skip("needs SIGALRM")
+    contents = {"a.txt": b"a", "stuck.txt": b"hang", "b.txt": b"b"}
+    pipeline = IngestPipeline(download_workers=1, extract_workers=2, file_timeout=0.5,
+                              chunker=ScriptedChunker())
+
+    started = time.monotonic()
+    assert run(pipeline, contents) == {"a.txt": "a", "b.txt": "b"}
+    assert time.monotonic() - started < 30
+
+
+def test_hung_worker_is_replaced_without_alarm(monkeypatch, temp_files):
+    monkeypatch.setattr(ingest_pipeline, "HAS_ALARM", False)
+    contents = {"a.txt": b"a", "stuck.txt": b"hang", "b.txt": b"b", "c.txt": b"c"}
+    pipeline = IngestPipeline(download_workers=1, extract_workers=2, file_timeout=0.3, max_pending=2,
+                              inline_max_bytes=0, chunker=ScriptedChunker())
+
+    started = time.monotonic()
+    results = run(pipeline, contents)
+
+    assert results == {"a.txt": "a", "b.txt": "b", "c.txt": "c"}
+    assert time.monotonic() - started < 30
+    assert os.listdir(temp_files) == []
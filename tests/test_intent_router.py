@@ -0,0 +1,129 @@
+import asyncio
+import json
+
+import pytest
+
+from intent_router import IntentRouter, NgramClassifier, match_rules, train_router
+
+
+@pytest.mark.parametrize("text", [
+    "Find documents about Microsoft Fabric",
+    "can you find the slides on Power BI governance",
+    "Please look up whitepapers related to data mesh",
+    "fetch the PDF covering onboarding",
+    "papers on machine learning",
+    "search for documents on Azure landing zones",
+])
+def test_document_requests_match_the_doc_rules(text):
+    assert match_rules(text) == "doc_search"
+
+
+@pytest.mark.parametrize("text", [
+    "Show me how to share reports in Power BI",
+    "Give me an overview of Power BI reports",
+    "List the steps to publish a report",
+    "search engine optimization tips",
+    "How do I find large files on Windows?",
+    "What documents do we have on Fabric?",
+    "search for Azure landing zones",
+    "search for the best way to learn Python",
+])
+def test_ambiguous_messages_are_left_to_later_tiers(text):
+    assert match_rules(text) is None
+
+
+@pytest.mark.parametrize("text", ["hi there", "Thanks!", "What is Power Automate?", "explain delta lakes"])
+def test_plain_questions_and_greetings_are_chat(text):
+    assert match_rules(text) == "chat"
+
+
+def make_router(tmp_path, llm_classify, **kwargs):
+    return IntentRouter(llm_classify, model_path=str(tmp_path / "model.json"),
+                        log_path=str(tmp_path / "log.jsonl"), **kwargs)
+
+
+def read_log(tmp_path):
+    with open(tmp_path / "log.jsonl") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_rules_decide_without_calling_the_llm(tmp_path):
+    def llm(text):
+        raise AssertionError("LLM should not be called")
+
+    router = make_router(tmp_path, llm)
+    route = router.route("Find documents about Fabric")
+
+    assert route == {"intent": "doc_search", "tier": "rules", "confidence": 1.0}
+    assert router.tier_counts["rules"] == 1
+
+
+def test_llm_decisions_are_logged_and_extra_fields_passed_through(tmp_path):
+    router = make_router(tmp_path, lambda text: "chat")
+    route = router.route("Give me an overview of Power BI reports",
+                         llm_classify=lambda text: {"intent": "doc_search", "topic": "Power BI reports"})
+
+    assert route["tier"] == "llm" and route["intent"] == "doc_search"
+    assert route["topic"] == "Power BI reports"
+    assert read_log(tmp_path) == [{"text": "Give me an overview of Power BI reports", "intent": "doc_search"}]
+
+
+def test_unusable_llm_answers_default_to_chat_without_logging(tmp_path):
+    router = make_router(tmp_path, lambda text: None)
+    route = router.route("search engine optimization tips")
+
+    assert route["intent"] == "chat" and route["tier"] == "llm"
+    assert not (tmp_path / "log.jsonl").exists()
+
+
+def test_aroute_awaits_the_llm(tmp_path):
+    async def llm(text):
+        return "doc_search"
+
+    router = make_router(tmp_path, None)
+    route = asyncio.run(router.aroute("List the steps to publish a report", llm))
+
+    assert route["intent"] == "doc_search" and route["tier"] == "llm"
+
+
+def test_trained_classifier_answers_before_the_llm(tmp_path):
+    with open(tmp_path / "log.jsonl", "w") as f:
+        for i in range(40):
+            f.write(json.dumps({"text": f"overview of quarterly sales report {i}", "intent": "doc_search"}) + "\n")
+            f.write(json.dumps({"text": f"tell a joke about number {i}", "intent": "chat"}) + "\n")
+    train_router(str(tmp_path / "log.jsonl"), str(tmp_path / "model.json"))
+
+    router = make_router(tmp_path, lambda text: pytest.fail("LLM should not be called"), min_examples=50)
+    route = router.route("overview of quarterly sales report 99")
+
+    assert route["tier"] == "classifier" and route["intent"] == "doc_search"
+    assert route["confidence"] >= router.threshold
+
+
+def test_undertrained_classifier_is_ignored(tmp_path):
+    NgramClassifier.fit(["quarterly sales report"], ["doc_search"]).save(str(tmp_path / "model.json"))
+
+    router = make_router(tmp_path, lambda text: "chat")
+
+    assert router.classifier is None
+    assert router.route("quarterly sales report")["tier"] == "llm"
+
+
+def test_log_is_rotated_at_its_size_cap(tmp_path):
+    router = make_router(tmp_path, lambda text: "doc_search", log_max_bytes=200)
+    for i in range(10):
+        router.route(f"overview of quarterly sales report number {i}")
+
+    rotated = tmp_path / "log.jsonl.1"
+    assert rotated.exists()
+    assert (tmp_path / "log.jsonl").stat().st_size < 200 + 100
+    assert rotated.stat().st_size < 200 + 100
+    # Training reads the rotated log as well
+    assert train_router(str(tmp_path / "log.jsonl"), str(tmp_path / "model.json")).examples > len(read_log(tmp_path))
+
+
+def test_empty_log_path_disables_logging(tmp_path):
+    router = IntentRouter(lambda text: "doc_search", model_path=str(tmp_path / "model.json"), log_path="")
+    router.route("overview of quarterly sales report")
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,168 @@
+import asyncio
+import importlib
+from types import SimpleNamespace
+
+import httpx
+import numpy as np
+import pytest
+import requests
+
+from semantic_cache import SemanticCache
+
+
+@pytest.fixture
+def nodes(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    for name, value in (("AZURE_ENDPOINT", "https://example.openai.azure.com"), ("AZURE_API_KEY", "key"),
+                        ("AZURE_OPENAI_API_KEY", "key"), ("OPENAI_API_VERSION", "2023-05-15")):
+        monkeypatch.setenv(name, value)
+    return importlib.import_module("nodetest")
+
+
+@pytest.fixture
+def cache(nodes, monkeypatch):
+    embedded = []
+
+    def embed(text):
+        embedded.append(text)
+        return np.ones(4)
+
+    cache = SemanticCache(embed)
+    cache.embedded = embedded
+    monkeypatch.setattr(nodes, "response_cache", cache)
+    return cache
+
+
+@pytest.mark.parametrize("text", ["Tell me more about it", "What is my leave balance?"])
+def test_cache_lookup_skips_messages_whose_answers_are_never_cached(nodes, cache, text):
+    result = nodes.cache_lookup_node({"user_input": text, "chat_history": []})
+
+    assert result["next"] == "router"
+    assert cache.embedded == []
+
+
+def test_cache_lookup_answers_a_repeated_question(nodes, cache):
+    cache.put("What is Microsoft Fabric?", "chat", "A data platform.")
+
+    result = nodes.cache_lookup_node({"user_input": "what is microsoft fabric", "chat_history": []})
+
+    assert result["next"] == "final_output_node" and result["response"] == "A data platform."
+    assert result["chat_history"][-1] == {"user": "what is microsoft fabric", "assistant": "A data platform."}
+
+
+def test_search_results_about_the_user_are_not_cached(nodes, cache):
+    nodes.search_result({"user_input": "find my expense reports", "topic": "expense reports"}, [{"title": "a"}])
+    nodes.search_result({"user_input": "find expense reports", "topic": "expense reports"}, [{"title": "a"}])
+
+    assert cache.stats()["entries"] == {"search": 1}
+
+
+class FakeLLM:
+    """Answers every prompt with ``content``, or raises it if it is an exception."""
+
+    def __init__(self, content):
+        self.content = content
+
+    def invoke(self, prompt):
+        if isinstance(self.content, Exception):
+            raise self.content
+        return SimpleNamespace(content=self.content)
+
+    async def ainvoke(self, prompt):
+        return self.invoke(prompt)
+
+
+class FakeSearchClient:
+    def __init__(self, hits, error=None):
+        self.hits, self.error = hits, error
+
+    def search(self, topic, top_docs):
+        if self.error:
+            raise self.error
+        return self.hits
+
+
+class FakeAsyncSearchClient(FakeSearchClient):
+    async def search(self, topic, top_docs):
+        return FakeSearchClient.search(self, topic, top_docs)
+
+
+def both(sync_node, async_node, *args):
+    return sync_node(*args), asyncio.run(async_node(*args))
+
+
+@pytest.mark.parametrize("content, topic", [(" Power BI governance \n", "Power BI governance"),
+                                            (RuntimeError("down"), "unknown")])
+def test_extract_topic_nodes_agree(nodes, monkeypatch, content, topic):
+    monkeypatch.setattr(nodes, "llm", FakeLLM(content))
+    state = {"user_input": "find slides on it", "chat_history": []}
+
+    sync_result, async_result = both(nodes.extract_topic_node, nodes.aextract_topic_node, state)
+
+    assert sync_result == async_result
+    assert sync_result["topic"] == topic and sync_result["token_usage"]
+
+
+@pytest.mark.parametrize("content, route", [
+    ('```json\n{"intent": "Doc_Search", "topic": "Fabric"}\n```', {"intent": "doc_search", "topic": "Fabric"}),
+    ("not json", None),
+    (RuntimeError("down"), None),
+])
+def test_classify_and_extract_agree(nodes, monkeypatch, content, route):
+    monkeypatch.setattr(nodes, "llm", FakeLLM(content))
+
+    results = both(nodes.classify_and_extract_with_llm, nodes.aclassify_and_extract_with_llm, "Fabric docs?", [])
+
+    assert results == (route, route)
+
+
+def test_search_index_nodes_agree(nodes, cache, monkeypatch):
+    hits = [{"id": "a", "title": "a.pdf"}]
+    monkeypatch.setattr(nodes, "get_search_client", lambda: FakeSearchClient(hits))
+    monkeypatch.setattr(nodes, "get_async_search_client", lambda: FakeAsyncSearchClient(hits))
+    state = {"user_input": "find Fabric slides", "topic": "Fabric", "chat_history": []}
+
+    sync_result, async_result = both(nodes.search_index_node, nodes.asearch_index_node, state)
+
+    assert sync_result == async_result == {"docs": hits, "chat_history": [], "user_input": "find Fabric slides"}
+
+
+def test_search_errors_return_no_documents(nodes, cache, monkeypatch):
+    monkeypatch.setattr(nodes, "get_search_client",
+                        lambda: FakeSearchClient([], requests.exceptions.ConnectionError("down")))
+    monkeypatch.setattr(nodes, "get_async_search_client",
+                        lambda: FakeAsyncSearchClient([], httpx.ConnectError("down")))
+    state = {"user_input": "find Fabric slides", "topic": "Fabric", "chat_history": []}
+
+    sync_result, async_result = both(nodes.search_index_node, nodes.asearch_index_node, state)
+
+    assert sync_result == async_result and sync_result["docs"] == []
+    assert cache.embedded == []
+
+
+class FakeRetriever:
+    def __init__(self, passages):
+        self.passages = passages
+
+    def build_context(self, question, container_name):
+        if isinstance(self.passages, Exception):
+            raise self.passages
+        return self.passages
+
+
+class FakeStreamingLLM:
+    def stream(self, messages, config=None):
+        yield SimpleNamespace(content="A reply.")
+
+
+@pytest.mark.parametrize("passages, skipped", [(None, True), (RuntimeError("down"), True), ([], False)])
+def test_chat_reply_is_cached_only_when_retrieval_ran(nodes, cache, monkeypatch, passages, skipped):
+    monkeypatch.setattr(nodes, "get_retriever", lambda: FakeRetriever(passages))
+    monkeypatch.setattr(nodes, "llm", FakeStreamingLLM())
+    state = {"user_input": "What is Microsoft Fabric?", "chat_history": []}
+
+    state.update(nodes.retrieve_context_node(state))
+    nodes.chat_node(state)
+
+    assert state["next"] == "chat_node" and state["retrieval_skipped"] is skipped
+    assert cache.stats()["entries"] == ({} if skipped else {"chat": 1})
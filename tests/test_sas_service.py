@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+
+import pytest
+
+import sas_service
+from sas_service import SasService
+
+
+class FakeServiceClient:
+    def __init__(self, account_key="a2V5"):
+        self.account_name = "account"
+        self.url = "https://account.blob.core.windows.net/"
+        self.credential = SimpleNamespace(account_key=account_key) if account_key else object()
+        self.delegation_keys = 0
+
+    def get_user_delegation_key(self, key_start_time, key_expiry_time):
+        self.delegation_keys += 1
+        return f"delegation-{self.delegation_keys}"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.time() and a record of every signature."""
+    state = SimpleNamespace(now=1000.0, signed=[])
+    monkeypatch.setattr(sas_service, "time", SimpleNamespace(time=lambda: state.now))
+
+    def sign(**kwargs):
+        state.signed.append(kwargs)
+        return f"sig={len(state.signed)}"
+
+    monkeypatch.setattr(sas_service, "generate_blob_sas", sign)
+    return state
+
+
+def test_urls_are_cached_per_blob(clock):
+    service = SasService(FakeServiceClient())
+
+    first = service.urls("docs", ["a.pdf", "b c.pdf"])
+    again = service.urls("docs", ["a.pdf", "b c.pdf"])
+
+    assert first == again
+    assert first["b c.pdf"] == "https://account.blob.core.windows.net/docs/b%20c.pdf?sig=2"
+    assert len(clock.signed) == 2
+    assert clock.signed[0]["account_key"] == "a2V5"
+
+
+def test_urls_are_re_signed_after_half_their_lifetime(clock):
+    service = SasService(FakeServiceClient())
+    url = service.url("docs", "a.pdf", expiry_minutes=10)
+
+    clock.now += 4 * 60
+    assert service.url("docs", "a.pdf", expiry_minutes=10) == url
+    clock.now += 2 * 60
+    assert service.url("docs", "a.pdf", expiry_minutes=10) != url
+    assert len(clock.signed) == 2
+
+
+def test_expiry_is_part_of_the_cache_key(clock):
+    service = SasService(FakeServiceClient())
+
+    service.url("docs", "a.pdf", expiry_minutes=10)
+    service.url("docs", "a.pdf", expiry_minutes=60)
+    service.url("other", "a.pdf", expiry_minutes=10)
+
+    assert len(clock.signed) == 3
+
+
+def test_least_recently_used_urls_are_evicted(clock):
+    service = SasService(FakeServiceClient(), max_entries=2)
+    service.urls("docs", ["a.pdf", "b.pdf"])
+    service.url("docs", "a.pdf")
+
+    service.url("docs", "c.pdf")
+    service.url("docs", "a.pdf")
+    service.url("docs", "b.pdf")
+
+    # a.pdf was used most recently, so b.pdf was the one evicted
+    assert len(clock.signed) == 4
+
+
+def test_user_delegation_key_is_cached_and_renewed(clock):
+    client = FakeServiceClient(account_key=None)
+    service = SasService(client)
+
+    service.urls("docs", ["a.pdf", "b.pdf"])
+    service.url("docs", "c.pdf")
+    assert client.delegation_keys == 1
+    assert clock.signed[-1]["user_delegation_key"] == "delegation-1"
+
+    clock.now += sas_service.DELEGATION_KEY_HOURS * 3600
+    service.url("docs", "d.pdf")
+    assert client.delegation_keys == 2
+
+
+def test_get_sas_service_is_shared_per_connection_string(monkeypatch):
+    monkeypatch.setattr(sas_service, "_services", {})
+    monkeypatch.setattr(SasService, "from_connection_string",
+                        classmethod(lambda cls, connection_string: SasService(FakeServiceClient())))
+    monkeypatch.setenv("AZURE_CONNECTION_STRING", "first")
+
+    service = sas_service.get_sas_service()
+
+    assert sas_service.get_sas_service("first") is service
+    assert sas_service.get_sas_service("second") is not service
+    monkeypatch.delenv("AZURE_CONNECTION_STRING")
+    monkeypatch.delenv("AZURE_STORAGE_ACCOUNT_URL", raising=False)
+    with pytest.raises(ValueError):
+        sas_service.get_sas_service()
@@ -0,0 +1,160 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("azure.core")
+from azure.core.exceptions import HttpResponseError
+
+import search_indexer
+from search_indexer import SearchIndexWriter
+
+
+class FakeEmbeddings:
+    def embed_documents(self, texts):
+        return [[float(len(text))] for text in texts]
+
+
+class FakeSearchClient:
+    """Records every request; ``max_docs`` makes larger requests fail with 413 and
+    ``statuses`` gives per-key status codes, one per attempt, before the key succeeds."""
+
+    def __init__(self, max_docs=None, statuses=None):
+        self.max_docs = max_docs
+        self.statuses = {key: list(codes) for key, codes in (statuses or {}).items()}
+        self.requests = []
+
+    def _results(self, documents):
+        if self.max_docs is not None and len(documents) > self.max_docs:
+            error = HttpResponseError(message="Request Entity Too Large")
+            error.status_code = 413
+            raise error
+        self.requests.append([doc["id"] for doc in documents])
+        results = []
+        for doc in documents:
+            codes = self.statuses.get(doc["id"])
+            status = codes.pop(0) if codes else 200
+            results.append(SimpleNamespace(key=doc["id"], succeeded=status < 300, status_code=status,
+                                           error_message=None if status < 300 else f"status {status}"))
+        return results
+
+    def merge_or_upload_documents(self, documents):
+        return self._results(documents)
+
+    def delete_documents(self, documents):
+        return self._results(documents)
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(search_indexer.time, "sleep", lambda seconds: None)
+
+
+def docs(n, size=10):
+    return [{"id": f"doc-{i}", "content": "x" * size} for i in range(n)]
+
+
+def test_batches_respect_document_count(monkeypatch):
+    monkeypatch.setattr(search_indexer, "MAX_BATCH_DOCS", 10)
+    client = FakeSearchClient()
+    writer = SearchIndexWriter(client, FakeEmbeddings(), buffer_size=25)
+    for doc in docs(25):
+        writer.add(doc)
+    report = writer.close()
+
+    assert [len(request) for request in client.requests] == [10, 10, 5]
+    assert report["succeeded"] == 25 and report["failed"] == 0
+
+
+def test_batches_respect_payload_size(monkeypatch):
+    monkeypatch.setattr(search_indexer, "MAX_BATCH_BYTES", 1000)
+    client = FakeSearchClient()
+    writer = SearchIndexWriter(client, FakeEmbeddings(), buffer_size=20)
+    for doc in docs(20, size=200):
+        writer.add(doc)
+    writer.close()
+
+    assert len(client.requests) > 1
+    assert sum(len(request) for request in client.requests) == 20
+
+
+def test_vectors_are_attached_before_upload():
+    client = FakeSearchClient()
+    captured = []
+    client.merge_or_upload_documents = lambda documents: captured.extend(documents) or client._results(documents)
+    with SearchIndexWriter(client, FakeEmbeddings(), buffer_size=2) as writer:
+        writer.add({"id": "a", "content": "abc"})
+        writer.add({"id": "b", "content": "abcde"})
+
+    assert {doc["id"]: doc["content_vector"] for doc in captured} == {"a": [3.0], "b": [5.0]}
+
+
+def test_request_too_large_is_split_until_accepted():
+    client = FakeSearchClient(max_docs=4)
+    writer = SearchIndexWriter(client, FakeEmbeddings(), buffer_size=16)
+    for doc in docs(16):
+        writer.add(doc)
+    report = writer.close()
+
+    assert all(len(request) <= 4 for request in client.requests)
+    assert sorted(key for request in client.requests for key in request) == sorted(d["id"] for d in docs(16))
+    assert report["succeeded"] == 16 and report["failed"] == 0
+
+
+def test_single_document_too_large_is_reported():
+    client = FakeSearchClient(max_docs=0)
+    writer = SearchIndexWriter(client, FakeEmbeddings())
+    writer.add({"id": "huge", "content": "x"})
+    report = writer.close()
+
+    assert report["failed"] == 1
+    assert report["failures"][0]["key"] == "huge"
+
+
+def test_only_retryable_failures_are_sent_again():
+    client = FakeSearchClient(statuses={"doc-1": [503], "doc-2": [429, 422]})
+    writer = SearchIndexWriter(client, FakeEmbeddings(), buffer_size=4)
+    for doc in docs(4):
+        writer.add(doc)
+    report = writer.close()
+
+    assert client.requests == [["doc-0", "doc-1", "doc-2", "doc-3"], ["doc-1", "doc-2"], ["doc-2"]]
+    assert report["succeeded"] == 4 and report["failed"] == 0
+
+
+def test_non_retryable_and_exhausted_failures_are_reported():
+    client = FakeSearchClient(statuses={"doc-0": [400], "doc-1": [503] * 10})
+    writer = SearchIndexWriter(client, FakeEmbeddings(), buffer_size=2, max_retries=2)
+    for doc in docs(2):
+        writer.add(doc)
+    report = writer.close()
+
+    failures = {failure["key"]: failure["status_code"] for failure in report["failures"]}
+    assert failures == {"doc-0": 400, "doc-1": 503}
+    assert len(client.requests) == 3
+    assert report["succeeded"] == 0
+
+
+def test_deletes_are_batched_and_counted():
+    client = FakeSearchClient()
+    writer = SearchIndexWriter(client, FakeEmbeddings())
+    for i in range(5):
+        writer.delete(f"old-{i}")
+    report = writer.close()
+
+    assert client.requests == [[f"old-{i}" for i in range(5)]]
+    assert report["deleted"] == 5 and report["succeeded"] == 0
+
+
+def test_embedding_failure_marks_the_batch_failed():
+    class BrokenEmbeddings:
+        def embed_documents(self, texts):
+            raise RuntimeError("quota exceeded")
+
+    client = FakeSearchClient()
+    writer = SearchIndexWriter(client, BrokenEmbeddings(), buffer_size=3)
+    for doc in docs(3):
+        writer.add(doc)
+    report = writer.close()
+
+    assert report["failed"] == 3
+    assert client.requests == []
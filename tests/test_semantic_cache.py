@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+
+from semantic_cache import (SemanticCache, calibrate_threshold, is_personal, is_shareable, is_standalone,
+                            normalize_query, query_terms, terms_match)
+
+
+def unit(similarity):
+    """A 2-d unit vector whose cosine with [1, 0] is ``similarity``."""
+    return [similarity, float(np.sqrt(1 - similarity ** 2))]
+
+
+class FakeEmbeddings:
+    """Embeds normalized queries to fixed vectors; unknown queries embed to zero and match nothing."""
+
+    def __init__(self, vectors):
+        self.vectors = {normalize_query(text): vector for text, vector in vectors.items()}
+        self.calls = []
+
+    def __call__(self, text):
+        self.calls.append(text)
+        return self.vectors.get(text, [0.0, 0.0])
+
+
+def make_cache(vectors, **kwargs):
+    return SemanticCache(FakeEmbeddings(vectors), **kwargs)
+
+
+def test_near_identical_question_hits():
+    cache = make_cache({"What is Power BI?": [1.0, 0.0], "what's power bi": unit(0.99)}, threshold=0.97)
+    cache.put("What is Power BI?", "chat", "A BI tool.")
+
+    assert cache.lookup("what's power bi", ("chat",)) == ("chat", "A BI tool.", pytest.approx(0.99))
+    assert cache.stats()["hits"] == 1
+
+
+def test_similar_embedding_with_different_subject_misses():
+    cache = make_cache({"What is Power BI?": [1.0, 0.0], "What is Power Apps?": unit(0.99)}, threshold=0.97)
+    cache.put("What is Power BI?", "chat", "A BI tool.")
+
+    assert cache.lookup("What is Power Apps?", ("chat",)) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_below_threshold_misses():
+    cache = make_cache({"what is fabric": [1.0, 0.0], "what is fabric exactly": unit(0.9)}, threshold=0.97)
+    cache.put("what is fabric", "chat", "A data platform.")
+
+    assert cache.get("what is fabric exactly", "chat") is None
+
+
+def test_best_matching_namespace_wins():
+    cache = make_cache({"fabric docs": [1.0, 0.0], "fabric documents": unit(0.98),
+                        "find fabric docs": unit(0.995)}, threshold=0.97, min_overlap=0.3)
+    cache.put("fabric documents", "chat", "chat answer")
+    cache.put("find fabric docs", "search", "search answer")
+
+    assert cache.lookup("fabric docs", ("chat", "search"))[0] == "search"
+
+
+def test_version_change_clears_only_that_namespace():
+    version = {"value": 1}
+    cache = make_cache({"q": [1.0, 0.0]}, versions={"search": lambda: version["value"]})
+    cache.put("q", "search", "hits")
+    cache.put("q", "chat", "reply")
+
+    version["value"] = 2
+
+    assert cache.get("q", "search") is None
+    assert cache.get("q", "chat") == "reply"
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_expired_entries_are_dropped():
+    cache = make_cache({"q": [1.0, 0.0]}, ttl_seconds=-1)
+    cache.put("q", "chat", "reply")
+
+    assert cache.get("q", "chat") is None
+    assert cache.stats()["entries"] == {"chat": 0}
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = make_cache({"a": [1.0, 0.0], "b": [0.0, 1.0], "c": unit(0.5)}, max_entries=2)
+    cache.put("a", "chat", 1)
+    cache.put("b", "chat", 2)
+    assert cache.get("a", "chat") == 1
+    cache.put("c", "chat", 3)
+
+    assert cache.get("b", "chat") is None
+    assert cache.get("a", "chat") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_embedding_failure_is_a_miss():
+    def broken(text):
+        raise RuntimeError("service unavailable")
+
+    cache = SemanticCache(broken)
+    cache.put("q", "chat", "reply")
+
+    assert cache.lookup("q", ("chat",)) is None
+
+
+def test_terms_match_requires_the_same_numbers():
+    assert terms_match(query_terms("sales report 2023"), query_terms("2023 sales report"))
+    assert not terms_match(query_terms("sales report 2023"), query_terms("sales report 2024"))
+    assert not terms_match(query_terms("what is power bi"), query_terms("what is power apps"))
+
+
+def test_standalone_and_personal_messages():
+    assert is_standalone("What is Microsoft Fabric?")
+    assert not is_standalone("Tell me more about it")
+    assert is_personal("What is my leave balance?")
+    assert is_personal("email jane.doe@example.com the report")
+    assert is_personal("status of order 1234567")
+    assert not is_personal("What is Microsoft Fabric?")
+    assert is_shareable("What is Microsoft Fabric?")
+    assert not is_shareable("Tell me more about it")
+    assert not is_shareable("What is my leave balance?")
+
+
+def test_calibrate_threshold_sits_above_the_closest_different_pair():
+    embed = FakeEmbeddings({"what is power bi": [1.0, 0.0], "whats power bi": unit(0.99),
+                            "what is power apps": unit(0.95), "define power bi": unit(0.96)})
+    report = calibrate_threshold(embed, same=[("what is power bi", "whats power bi"),
+                                             ("what is power bi", "define power bi")],
+                                 different=[("what is power bi", "what is power apps")])
+
+    assert report["max_different"] == pytest.approx(0.95)
+    assert report["threshold"] == pytest.approx(0.955)
+    assert report["recall"] == 1.0
+    assert report["min_same"] == pytest.approx(0.96)
@@ -0,0 +1,75 @@
+import numpy as np
+
+from topk import batch_top_k_unique, mmr_order, top_k_unique
+
+
+def test_top_k_unique_keeps_best_row_per_group():
+    scores = np.array([0.9, 0.8, 0.7, 0.6, 0.5], dtype=np.float32)
+    groups = np.array([0, 0, 1, 1, 2])
+
+    assert top_k_unique(scores, groups, 3) == [0, 2, 4]
+
+
+def test_top_k_unique_widens_when_one_group_dominates():
+    # The 30 best rows all belong to group 0, beyond the initial candidate pool
+    scores = np.concatenate([np.linspace(1.0, 0.9, 30), [0.5, 0.4]]).astype(np.float32)
+    groups = np.array([0] * 30 + [1, 2])
+
+    assert top_k_unique(scores, groups, 3, initial_factor=2) == [0, 30, 31]
+
+
+def test_top_k_unique_skips_dead_rows_and_handles_small_inputs():
+    scores = np.array([-np.inf, 0.3, 0.2], dtype=np.float32)
+    groups = np.array([0, 1, 1])
+
+    assert top_k_unique(scores, groups, 5) == [1]
+    assert top_k_unique(np.zeros(0), np.zeros(0), 3) == []
+    assert top_k_unique(scores, groups, 0) == []
+
+
+def test_top_k_unique_matches_a_full_sort():
+    rng = np.random.default_rng(0)
+    scores = rng.random(1000).astype(np.float32)
+    groups = rng.integers(0, 50, 1000)
+
+    expected, seen = [], set()
+    for idx in np.argsort(-scores, kind="stable"):
+        if groups[idx] not in seen:
+            seen.add(groups[idx])
+            expected.append(int(idx))
+    assert top_k_unique(scores, groups, 10) == expected[:10]
+
+
+def test_batch_top_k_unique_matches_single_queries():
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(200, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = rng.normal(size=(5, 16)).astype(np.float32)
+    groups = rng.integers(0, 20, 200)
+
+    results = batch_top_k_unique(vectors, queries, groups, 4)
+    for query, (indices, scores) in zip(queries, results):
+        expected = top_k_unique(vectors @ (query / np.linalg.norm(query)), groups, 4)
+        assert indices == expected
+        assert np.all(np.diff(scores) <= 1e-6)
+
+
+
+def test_mmr_order_drops_duplicates_and_prefers_diversity():
+    vectors = np.array([[1.0, 0.0], [1.0, 0.0], [0.8, 0.6], [0.0, 1.0]], dtype=np.float32)
+    scores = np.array([0.9, 0.89, 0.85, 0.6], dtype=np.float32)
+
+    order = mmr_order(scores, vectors, diversity=0.5, duplicate_threshold=0.99)
+
+    assert order[0] == 0
+    assert 1 not in order
+    # The orthogonal candidate beats the more relevant but similar one
+    assert order[1] == 3
+
+
+def test_mmr_order_without_diversity_is_relevance_order():
+    vectors = np.eye(3, dtype=np.float32)
+    scores = np.array([0.2, 0.9, 0.5], dtype=np.float32)
+
+    assert mmr_order(scores, vectors, diversity=0.0) == [1, 2, 0]
+    assert mmr_order(np.zeros(0), np.zeros((0, 3))) == []
@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+import pytest
+
+from vector_store import ResidentIndex, VectorStore
+
+
+def make_docs(blob_name, vectors, container="docs"):
+    return [{
+        "blob_name": blob_name,
+        "container": container,
+        "content": f"{blob_name} chunk {i}",
+        "embedding": vector,
+        "last_modified": "2025-01-01T00:00:00",
+        "size": 100,
+        "chunk_index": i,
+        "page_start": i + 1,
+        "page_end": i + 1,
+        "start_offset": 10 * i
+    } for i, vector in enumerate(vectors)]
+
+
+def live_names(store):
+    index = ResidentIndex(store)
+    return sorted((index.document(i)["blob_name"], index.document(i)["chunk_index"]) for i in range(len(index)))
+
+
+@pytest.fixture
+def store(tmp_path):
+    rng = np.random.default_rng(0)
+    store = VectorStore(str(tmp_path / "docs"))
+    store.apply_delta(make_docs("a.pdf", rng.normal(size=(3, 8))))
+    store.apply_delta(make_docs("b.pdf", rng.normal(size=(2, 8))))
+    return store
+
+
+def test_documents_round_trip(store):
+    index = ResidentIndex(store)
+    documents = [index.document(i) for i in range(len(index))]
+
+    assert len(index) == 5
+    first = next(doc for doc in documents if doc["blob_name"] == "a.pdf" and doc["chunk_index"] == 1)
+    assert first["content"] == "a.pdf chunk 1"
+    assert (first["page_start"], first["page_end"], first["start_offset"]) == (2, 2, 10)
+    assert np.allclose(np.linalg.norm(index.vectors, axis=1), 1.0, atol=1e-5)
+
+
+def test_tombstone_hides_rows_of_older_segments(store):
+    store.apply_delta([], tombstones=["a.pdf"])
+
+    assert live_names(store) == [("b.pdf", 0), ("b.pdf", 1)]
+    assert store.dead_fraction() == pytest.approx(3 / 5)
+    segment = store.open_segments()[0]
+    assert np.isneginf(segment.scores(np.ones(8))).all()
+
+
+def test_replacing_a_blob_keeps_only_the_new_version(store):
+    store.apply_delta(make_docs("a.pdf", np.ones((1, 8))), tombstones=["a.pdf"])
+
+    assert live_names(store) == [("a.pdf", 0), ("b.pdf", 0), ("b.pdf", 1)]
+    index = ResidentIndex(store)
+    (position,) = [i for i in range(len(index)) if index.document(i)["blob_name"] == "a.pdf"]
+    assert index.scores(np.ones(8))[position] == pytest.approx(1.0)
+
+
+def test_compact_drops_dead_rows_and_old_segments(store):
+    store.apply_delta(make_docs("c.pdf", np.eye(8)[:2]), tombstones=["a.pdf"])
+    before = live_names(store)
+    old_ids = [info["id"] for info in store.read_manifest()["segments"]]
+    query = np.arange(8, dtype=np.float32)
+    old_index = ResidentIndex(store)
+    old_scores = {(old_index.document(i)["blob_name"], old_index.document(i)["chunk_index"]): s
+                  for i, s in enumerate(old_index.scores(query))}
+
+    store.compact()
+
+    manifest = store.read_manifest()
+    assert len(manifest["segments"]) == 1 and manifest["tombstones"] == {}
+    assert store.dead_fraction() == 0.0
+    assert live_names(store) == before
+    for segment_id in old_ids:
+        assert not os.path.exists(os.path.join(store.root, f"seg_{segment_id:06d}.vectors.npy"))
+    index = ResidentIndex(store)
+    for i, score in enumerate(index.scores(query)):
+        document = index.document(i)
+        assert score == pytest.approx(old_scores[(document["blob_name"], document["chunk_index"])], abs=1e-5)
+        assert document["content"] == f"{document['blob_name']} chunk {document['chunk_index']}"
+
+
+def test_compact_of_fully_tombstoned_store_is_empty(store):
+    store.apply_delta([], tombstones=["a.pdf", "b.pdf"])
+    store.compact()
+
+    assert store.is_empty()
+    assert len(ResidentIndex(store)) == 0
+
+
+def test_replace_publishes_a_rebuild(store):
+    version = store.version()
+    store.apply_delta(make_docs("z.pdf", np.ones((1, 8))), replace=True)
+
+    assert store.version() == version + 1
+    assert live_names(store) == [("z.pdf", 0)]
+    assert len(store.read_manifest()["segments"]) == 1
+
+
+def test_manifest_stamp_changes_with_each_write(tmp_path):
+    store = VectorStore(str(tmp_path / "empty"))
+    assert store.manifest_stamp() is None
+    store.apply_delta(make_docs("a.pdf", np.ones((1, 4))))
+    first = store.manifest_stamp()
+    store.apply_delta([], tombstones=["a.pdf"])
+
+    assert first is not None and store.manifest_stamp() != first
+
+
+def test_float16_store_scores_like_float32(tmp_path):
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(20, 16))
+    full = VectorStore(str(tmp_path / "f32"))
+    half = VectorStore(str(tmp_path / "f16"), dtype="float16")
+    full.apply_delta(make_docs("a.pdf", vectors))
+    half.apply_delta(make_docs("a.pdf", vectors))
+    query = rng.normal(size=16)
+
+    assert np.allclose(ResidentIndex(full).scores(query), ResidentIndex(half).scores(query), atol=1e-2)
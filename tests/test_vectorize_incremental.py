@@ -0,0 +1,99 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from blob_manifest import BlobManifest
+from vector_store import ResidentIndex
+from vectorize_documents import DocumentVectorizer
+
+
+def blob(name, etag="1"):
+    return SimpleNamespace(name=name, etag=etag, size=10,
+                           last_modified=datetime(2025, 1, 1, tzinfo=timezone.utc))
+
+
+class FakeBlobService:
+    def __init__(self):
+        self.blobs = []
+
+    def get_container_client(self, name):
+        return SimpleNamespace(list_blobs=lambda: list(self.blobs))
+
+
+@pytest.fixture
+def vectorizer(tmp_path):
+    """A DocumentVectorizer without Azure clients; extraction yields one chunk per blob
+    whose text names the blob's etag, and blobs listed in ``failing`` produce nothing."""
+    vectorizer = DocumentVectorizer.__new__(DocumentVectorizer)
+    vectorizer.vectors_dir = str(tmp_path)
+    vectorizer.vector_dtype = "float32"
+    vectorizer.max_segments = 8
+    vectorizer.ann_min_rows = 10 ** 9
+    vectorizer.blob_service_client = FakeBlobService()
+    vectorizer.failing = set()
+    vectorizer.processed = []
+
+    def process_container(container_name, blobs):
+        vectorizer.processed.append(sorted(b.name for b in blobs))
+        return [{
+            "blob_name": b.name, "container": container_name, "content": f"{b.name} v{b.etag}",
+            "embedding": np.ones(4, dtype=np.float32), "last_modified": b.last_modified.isoformat(),
+            "size": b.size, "chunk_index": 0
+        } for b in blobs if b.name not in vectorizer.failing]
+
+    vectorizer.process_container = process_container
+    return vectorizer
+
+
+def contents(vectorizer):
+    index = ResidentIndex(vectorizer.get_vector_store("docs"))
+    return sorted(index.document(i)["content"] for i in range(len(index)))
+
+
+def test_only_added_and_changed_blobs_are_processed(vectorizer):
+    service = vectorizer.blob_service_client
+    service.blobs = [blob("a.pdf"), blob("b.pdf"), blob("notes.txt")]
+    assert vectorizer.vectorize_container_incremental("docs") == 2
+
+    service.blobs = [blob("a.pdf"), blob("b.pdf", etag="2"), blob("c.pdf")]
+    vectorizer.vectorize_container_incremental("docs")
+
+    assert vectorizer.processed == [["a.pdf", "b.pdf"], ["b.pdf", "c.pdf"]]
+    assert contents(vectorizer) == ["a.pdf v1", "b.pdf v2", "c.pdf v1"]
+
+
+def test_unchanged_container_is_left_alone(vectorizer):
+    vectorizer.blob_service_client.blobs = [blob("a.pdf")]
+    vectorizer.vectorize_container_incremental("docs")
+    version = vectorizer.get_vector_store("docs").version()
+
+    assert vectorizer.vectorize_container_incremental("docs") == 0
+    assert vectorizer.get_vector_store("docs").version() == version
+
+
+def test_deleted_blobs_are_tombstoned(vectorizer):
+    service = vectorizer.blob_service_client
+    service.blobs = [blob("a.pdf"), blob("b.pdf")]
+    vectorizer.vectorize_container_incremental("docs")
+
+    service.blobs = [blob("b.pdf")]
+    vectorizer.vectorize_container_incremental("docs")
+
+    assert contents(vectorizer) == ["b.pdf v1"]
+    assert "a.pdf" not in BlobManifest(vectorizer.manifest_path("docs")).entries
+
+
+def test_failed_blobs_are_retried_on_the_next_run(vectorizer):
+    service = vectorizer.blob_service_client
+    service.blobs = [blob("a.pdf"), blob("b.pdf")]
+    vectorizer.failing = {"b.pdf"}
+    vectorizer.vectorize_container_incremental("docs")
+    assert "b.pdf" not in BlobManifest(vectorizer.manifest_path("docs")).entries
+
+    vectorizer.failing = set()
+    vectorizer.vectorize_container_incremental("docs")
+
+    assert vectorizer.processed[-1] == ["b.pdf"]
+    assert contents(vectorizer) == ["a.pdf v1", "b.pdf v1"]
@@ -0,0 +1,110 @@
+import io
+import codecs
+import tempfile
+from typing import IO, Iterator, Tuple
+
+import PyPDF2
+from pptx import Presentation
+from docx import Document
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.webp')
+
+# Paragraphs grouped into one DOCX unit, and bytes decoded per plain-text unit
+DOCX_PARAGRAPHS_PER_UNIT = 50
+TEXT_READ_SIZE = 1 << 20
+
+# Downloads larger than this are spooled to a temporary file
+SPOOL_MAX_BYTES = 32 * 1024 * 1024
+
+
+def open_blob_stream(blob_client, max_memory_bytes: int = SPOOL_MAX_BYTES) -> IO[bytes]:
+    """Download a blob into a spooled file that only spills to disk when large.
+
+    The download is copied in chunks, so the full file is never held in memory
+    twice, and documents under ``max_memory_bytes`` never touch the disk.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=max_memory_bytes)
+    blob_client.download_blob(max_concurrency=4).readinto(spool)
+    spool.seek(0)
+    return spool
+
+
+def iter_pdf_pages(stream: IO[bytes]) -> Iterator[Tuple[int, str]]:
+    """Yield (page_number, text) one page at a time."""
+    reader = PyPDF2.PdfReader(stream)
+    for page_number, page in enumerate(reader.pages, start=1):
+        yield page_number, page.extract_text() or ""
+
+
+def iter_pptx_slides(stream: IO[bytes]) -> Iterator[Tuple[int, str]]:
+    """Yield (slide_number, text) one slide at a time."""
+    prs = Presentation(stream)
+    for slide_number, slide in enumerate(prs.slides, start=1):
+        texts = [shape.text for shape in slide.shapes if hasattr(shape, "text")]
+        yield slide_number, "\n".join(texts)
+
+
+def iter_docx_paragraphs(stream: IO[bytes]) -> Iterator[Tuple[int, str]]:
+    """Yield (unit_number, text) for groups of paragraphs."""
+    doc = Document(stream)
+    batch = []
+    unit = 1
+    for para in doc.paragraphs:
+        batch.append(para.text)
+        if len(batch) >= DOCX_PARAGRAPHS_PER_UNIT:
+            yield unit, "\n".join(batch)
+            batch = []
+            unit += 1
+    if batch:
+        yield unit, "\n".join(batch)
+
+
+def iter_image_text(stream: IO[bytes]) -> Iterator[Tuple[int, str]]:
+    """Yield the OCR text of an image as a single unit.
+
+    Needs Pillow, pytesseract and the tesseract binary, so they are imported
+    only when an image is extracted.
+    """
+    from PIL import Image
+    import pytesseract
+
+    image = Image.open(stream)
+    yield 1, pytesseract.image_to_string(image)
+
+
+def iter_plain_text(stream: IO[bytes]) -> Iterator[Tuple[int, str]]:
+    """Decode UTF-8 text incrementally; raises UnicodeDecodeError on binary data."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    unit = 1
+    while True:
+        data = stream.read(TEXT_READ_SIZE)
+        text = decoder.decode(data, final=not data)
+        if text:
+            yield unit, text
+            unit += 1
+        if not data:
+            break
+
+
+def iter_document_units(blob_name: str, stream: IO[bytes]) -> Iterator[Tuple[int, str]]:
+    """Yield (unit_number, text) for a document, choosing the extractor by extension.
+
+    Units are pages for PDFs, slides for PPTX, paragraph groups for DOCX and
+    decoded blocks for plain text.
+    """
+    name = blob_name.lower()
+    if name.endswith('.pdf'):
+        return iter_pdf_pages(stream)
+    elif name.endswith('.pptx'):
+        return iter_pptx_slides(stream)
+    elif name.endswith('.docx'):
+        return iter_docx_paragraphs(stream)
+    elif name.endswith(IMAGE_EXTENSIONS):
+        return iter_image_text(stream)
+    return iter_plain_text(stream)
+
+
+def extract_text(blob_name: str, data: bytes) -> str:
+    """Extract the whole text of a document held in memory."""
+    return "\n".join(text for _, text in iter_document_units(blob_name, io.BytesIO(data))).strip()
+
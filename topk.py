@@ -0,0 +1,86 @@
+from typing import List
+
+import numpy as np
+
+
+def top_k_unique(scores: np.ndarray, group_ids: np.ndarray, k: int, initial_factor: int = 3) -> List[int]:
+    """Return row indices of the best row in each of the top k groups.
+
+    Candidates are selected with np.argpartition instead of a full sort. If
+    the candidate pool holds fewer than k distinct groups (one document owns
+    most of the best chunks) the pool is widened and the selection repeated,
+    until k groups are found or every row has been considered.
+    """
+    n = len(scores)
+    if n == 0 or k <= 0:
+        return []
+    pool = min(n, k * initial_factor)
+    while True:
+        if pool < n:
+            candidates = np.argpartition(-scores, pool - 1)[:pool]
+        else:
+            candidates = np.arange(n)
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        seen = set()
+        selected = []
+        for idx in candidates:
+            group = int(group_ids[idx])
+            if group in seen or not np.isfinite(scores[idx]):
+                continue
+            seen.add(group)
+            selected.append(int(idx))
+            if len(selected) == k:
+                return selected
+        if pool >= n:
+            return selected
+        pool = min(n, pool * 4)
+
+
+def batch_scores(vectors: np.ndarray, queries: np.ndarray, max_cells: int = 1 << 26):
+    """Yield (start, scores) for blocks of queries scored as one matrix multiply.
+
+    Queries are L2-normalized; vectors are expected to be already. Blocks are
+    sized so a score matrix never exceeds max_cells entries.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    queries = queries / np.where(norms > 0, norms, 1.0)
+    block = max(1, max_cells // max(1, len(vectors)))
+    for start in range(0, len(queries), block):
+        yield start, queries[start:start + block] @ vectors.T
+
+
+def batch_top_k_unique(vectors: np.ndarray, queries: np.ndarray, group_ids: np.ndarray, k: int):
+    """Score many queries at once and return (indices, scores) per query."""
+    results = []
+    for _, scores in batch_scores(vectors, queries):
+        for row in scores:
+            indices = top_k_unique(row, group_ids, k)
+            results.append((indices, row[indices]))
+    return results
+
+
+def mmr_order(scores: np.ndarray, vectors: np.ndarray, diversity: float = 0.3,
+              duplicate_threshold: float = 0.95) -> List[int]:
+    """Order candidates by maximal marginal relevance.
+
+    Each step picks the candidate maximizing
+    ``(1 - diversity) * score - diversity * (max similarity to those already picked)``.
+    ``vectors`` must be L2-normalized. Candidates at least
+    ``duplicate_threshold`` similar to a picked one are dropped as duplicates.
+    """
+    n = len(scores)
+    if n == 0:
+        return []
+    scores = np.asarray(scores, dtype=np.float32)
+    redundancy = np.zeros(n, dtype=np.float32)
+    remaining = np.ones(n, dtype=bool)
+    order = []
+    while remaining.any():
+        marginal = np.where(remaining, (1 - diversity) * scores - diversity * redundancy, -np.inf)
+        picked = int(np.argmax(marginal))
+        order.append(picked)
+        remaining[picked] = False
+        redundancy = np.maximum(redundancy, vectors @ vectors[picked])
+        remaining &= redundancy < duplicate_threshold
+    return order
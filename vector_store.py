@@ -0,0 +1,341 @@
+import os
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Per-row metadata columns; blob refers to an entry in the segment's blob table
+META_DTYPE = np.dtype([
+    ('blob', np.int32),
+    ('chunk', np.int32),
+    ('offset', np.int64),
+    ('length', np.int32),
+    ('norm', np.float32),
+    ('page_start', np.int32),
+    ('page_end', np.int32),
+    ('source_offset', np.int64)
+])
+
+MANIFEST_NAME = "segments.json"
+
+# Rows scored per block so float16 segments are upcast in bounded memory
+SCORE_BLOCK_ROWS = 65536
+
+
+class Segment:
+    """A read-only, memory-mapped segment of the vector store."""
+
+    def __init__(self, root: str, info: Dict, tombstones: Dict[str, int]):
+        self.id = info['id']
+        self.count = info['count']
+        prefix = os.path.join(root, f"seg_{self.id:06d}")
+        self.vectors = np.load(f"{prefix}.vectors.npy", mmap_mode='r')
+        self.meta = np.load(f"{prefix}.meta.npy", mmap_mode='r')
+        self.text_path = f"{prefix}.text.bin"
+        with open(f"{prefix}.blobs.json", 'r') as f:
+            self.blobs = json.load(f)
+        # Blobs tombstoned after this segment was written are dead in it
+        self.dead_blobs = [
+            i for i, blob in enumerate(self.blobs)
+            if tombstones.get(blob['blob_name'], -1) > self.id
+        ]
+
+    def live_mask(self) -> Optional[np.ndarray]:
+        """Boolean mask of live rows, or None when every row is live."""
+        if not self.dead_blobs:
+            return None
+        return ~np.isin(self.meta['blob'], self.dead_blobs)
+
+    def text(self, row: int) -> str:
+        offset, length = int(self.meta['offset'][row]), int(self.meta['length'][row])
+        with open(self.text_path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length).decode('utf-8')
+
+    def document(self, row: int) -> Dict:
+        """Metadata for one chunk in the shape of the old JSON snapshots."""
+        document = {
+            **self.blobs[int(self.meta['blob'][row])],
+            'chunk_index': int(self.meta['chunk'][row]),
+            'content': self.text(row)
+        }
+        # Segments written before page tracking lack these columns
+        if 'page_start' in self.meta.dtype.names:
+            document['page_start'] = int(self.meta['page_start'][row])
+            document['page_end'] = int(self.meta['page_end'][row])
+            document['start_offset'] = int(self.meta['source_offset'][row])
+        return document
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every row against query; dead rows score -inf."""
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, SCORE_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + len(block)] = block @ query
+        norms = np.asarray(self.meta['norm'])
+        scores /= np.where(norms > 0, norms, 1.0)
+        mask = self.live_mask()
+        if mask is not None:
+            scores[~mask] = -np.inf
+        return scores
+
+
+class VectorStore:
+    """Append-only, segment-based vector store for one container.
+
+    Every write adds an immutable segment made of a float32 (or float16)
+    vector matrix, a columnar metadata array and an offset-indexed text file.
+    Deletions are recorded as tombstones in ``segments.json``, which is
+    replaced atomically so readers always see a consistent version. Readers
+    open segments with ``np.load(mmap_mode='r')`` and never load the corpus
+    into memory. ``compact`` merges segments and drops tombstoned rows.
+    """
+
+    def __init__(self, root: str, dtype: str = 'float32'):
+        self.root = root
+        self.dtype = np.dtype(dtype)
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.root, MANIFEST_NAME)
+
+    def read_manifest(self) -> Dict:
+        if not os.path.exists(self.manifest_path):
+            return {'version': 0, 'next_segment_id': 0, 'segments': [], 'tombstones': {}}
+        with open(self.manifest_path, 'r') as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest: Dict):
+        manifest['version'] += 1
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def version(self) -> int:
+        return self.read_manifest()['version']
+
+    def is_empty(self) -> bool:
+        return not self.read_manifest()['segments']
+
+    def _segment_prefix(self, segment_id: int) -> str:
+        return os.path.join(self.root, f"seg_{segment_id:06d}")
+
+    def _write_segment(self, segment_id: int, documents: List[Dict]) -> Dict:
+        """Write documents as segment files and return its manifest entry."""
+        prefix = self._segment_prefix(segment_id)
+        vectors = np.asarray([doc['embedding'] for doc in documents], dtype=np.float32)
+        meta = np.zeros(len(documents), dtype=META_DTYPE)
+        meta['norm'] = np.linalg.norm(vectors, axis=1)
+        blob_ids: Dict[str, int] = {}
+        blobs = []
+        offset = 0
+        with open(f"{prefix}.text.bin", 'wb') as text_file:
+            for row, doc in enumerate(documents):
+                if doc['blob_name'] not in blob_ids:
+                    blob_ids[doc['blob_name']] = len(blobs)
+                    blobs.append({
+                        'blob_name': doc['blob_name'],
+                        'container': doc['container'],
+                        'last_modified': doc['last_modified'],
+                        'size': doc['size']
+                    })
+                encoded = doc['content'].encode('utf-8')
+                text_file.write(encoded)
+                meta[row] = (blob_ids[doc['blob_name']], doc.get('chunk_index', 0),
+                             offset, len(encoded), meta['norm'][row],
+                             doc.get('page_start', 0), doc.get('page_end', 0), doc.get('start_offset', 0))
+                offset += len(encoded)
+        np.save(f"{prefix}.vectors.npy", vectors.astype(self.dtype))
+        np.save(f"{prefix}.meta.npy", meta)
+        with open(f"{prefix}.blobs.json", 'w') as f:
+            json.dump(blobs, f)
+        return {'id': segment_id, 'count': len(documents), 'dtype': self.dtype.name}
+
+    def _remove_segment_files(self, segment_id: int):
+        prefix = self._segment_prefix(segment_id)
+        for suffix in ('.vectors.npy', '.meta.npy', '.text.bin', '.blobs.json'):
+            if os.path.exists(prefix + suffix):
+                os.remove(prefix + suffix)
+
+    def apply_delta(self, documents: List[Dict], tombstones: Iterable[str] = (), replace: bool = False):
+        """Append documents and tombstone blobs in one atomic manifest update.
+
+        With replace=True every existing segment is dropped instead, which is
+        how a full rebuild is published.
+        """
+        manifest = self.read_manifest()
+        segment_id = manifest['next_segment_id']
+        manifest['next_segment_id'] += 1
+        old_segments = manifest['segments']
+        if replace:
+            manifest['segments'] = []
+            manifest['tombstones'] = {}
+        for blob_name in tombstones:
+            manifest['tombstones'][blob_name] = segment_id
+        if documents:
+            manifest['segments'].append(self._write_segment(segment_id, documents))
+        self._write_manifest(manifest)
+        if replace:
+            for info in old_segments:
+                self._remove_segment_files(info['id'])
+
+    def manifest_stamp(self) -> Optional[Tuple[int, int]]:
+        """Cheap change marker for the manifest: (mtime_ns, size), or None."""
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def open_segments(self, manifest: Optional[Dict] = None) -> List[Segment]:
+        """Open every segment memory-mapped as of the current manifest."""
+        manifest = manifest or self.read_manifest()
+        return [Segment(self.root, info, manifest['tombstones']) for info in manifest['segments']]
+
+    def dead_fraction(self) -> float:
+        """Fraction of stored rows that are tombstoned."""
+        total = dead = 0
+        for segment in self.open_segments():
+            total += segment.count
+            mask = segment.live_mask()
+            if mask is not None:
+                dead += int((~mask).sum())
+        return dead / total if total else 0.0
+
+    def compact(self, batch_rows: int = 50000):
+        """Merge all segments into one, dropping tombstoned rows.
+
+        Rows are copied in batches so compaction never holds the whole
+        corpus in memory.
+        """
+        manifest = self.read_manifest()
+        segments = self.open_segments()
+        if not segments:
+            return
+        segment_id = manifest['next_segment_id']
+        prefix = self._segment_prefix(segment_id)
+        live_rows = []
+        for segment in segments:
+            mask = segment.live_mask()
+            live_rows.append(np.arange(segment.count) if mask is None else np.flatnonzero(mask))
+        total = int(sum(len(rows) for rows in live_rows))
+        if total == 0:
+            # Everything was tombstoned, so publish an empty store
+            manifest['segments'], manifest['tombstones'] = [], {}
+            self._write_manifest(manifest)
+            for segment in segments:
+                self._remove_segment_files(segment.id)
+            return
+        dim = segments[0].vectors.shape[1]
+
+        vectors = np.lib.format.open_memmap(f"{prefix}.vectors.npy", mode='w+',
+                                            dtype=self.dtype, shape=(total, dim))
+        meta = np.lib.format.open_memmap(f"{prefix}.meta.npy", mode='w+',
+                                         dtype=META_DTYPE, shape=(total,))
+        blobs, blob_ids = [], {}
+        out_row, out_offset = 0, 0
+        with open(f"{prefix}.text.bin", 'wb') as text_file:
+            for segment, rows in zip(segments, live_rows):
+                # Remap this segment's blob ids into the merged blob table
+                remap = np.zeros(len(segment.blobs), dtype=np.int32)
+                for i, blob in enumerate(segment.blobs):
+                    if blob['blob_name'] not in blob_ids:
+                        blob_ids[blob['blob_name']] = len(blobs)
+                        blobs.append(blob)
+                    remap[i] = blob_ids[blob['blob_name']]
+                with open(segment.text_path, 'rb') as source:
+                    for start in range(0, len(rows), batch_rows):
+                        part = rows[start:start + batch_rows]
+                        n = len(part)
+                        vectors[out_row:out_row + n] = segment.vectors[part]
+                        # Copy by field so segments with older metadata layouts merge too
+                        source_meta = segment.meta[part]
+                        part_meta = np.zeros(n, dtype=META_DTYPE)
+                        for name in source_meta.dtype.names:
+                            part_meta[name] = source_meta[name]
+                        for row_meta in part_meta:
+                            source.seek(int(row_meta['offset']))
+                            text_file.write(source.read(int(row_meta['length'])))
+                        part_meta['blob'] = remap[part_meta['blob']]
+                        part_meta['offset'] = out_offset + np.concatenate(
+                            ([0], np.cumsum(part_meta['length'][:-1], dtype=np.int64)))
+                        out_offset += int(part_meta['length'].sum())
+                        meta[out_row:out_row + n] = part_meta
+                        out_row += n
+        vectors.flush()
+        meta.flush()
+        del vectors, meta
+        with open(f"{prefix}.blobs.json", 'w') as f:
+            json.dump(blobs, f)
+
+        old_segments = manifest['segments']
+        manifest['next_segment_id'] += 1
+        manifest['segments'] = [{'id': segment_id, 'count': total, 'dtype': self.dtype.name}]
+        manifest['tombstones'] = {}
+        self._write_manifest(manifest)
+        del segments
+        for info in old_segments:
+            self._remove_segment_files(info['id'])
+        print(f"Compacted {len(old_segments)} segments into one with {total} rows")
+
+
+class ResidentIndex:
+    """The live rows of a store held in memory as L2-normalized float32.
+
+    Scoring a query is then a single matrix-vector product. Rows map back to
+    their segment for metadata and text, which stay on disk.
+    """
+
+    def __init__(self, store: VectorStore):
+        manifest = store.read_manifest()
+        self.version = manifest['version']
+        self.segments = store.open_segments(manifest)
+        matrices, segment_ids, rows, blob_keys = [], [], [], []
+        self.blob_names: List[Tuple[str, str]] = []
+        blob_index: Dict[Tuple[str, str], int] = {}
+        for position, segment in enumerate(self.segments):
+            mask = segment.live_mask()
+            live = np.arange(segment.count) if mask is None else np.flatnonzero(mask)
+            if not len(live):
+                continue
+            vectors = np.asarray(segment.vectors[live], dtype=np.float32)
+            # Normalize with the stored precision's own norms, not the float32 ones
+            norms = np.linalg.norm(vectors, axis=1)
+            vectors /= np.where(norms > 0, norms, 1.0)[:, None]
+            matrices.append(vectors)
+            segment_ids.append(np.full(len(live), position, dtype=np.int32))
+            rows.append(live)
+            # Global ids per (container, blob_name) so results can be deduplicated cheaply
+            remap = np.empty(len(segment.blobs), dtype=np.int32)
+            for i, blob in enumerate(segment.blobs):
+                key = (blob['container'], blob['blob_name'])
+                if key not in blob_index:
+                    blob_index[key] = len(self.blob_names)
+                    self.blob_names.append(key)
+                remap[i] = blob_index[key]
+            blob_keys.append(remap[np.asarray(segment.meta['blob'][live])])
+        if matrices:
+            self.vectors = np.ascontiguousarray(np.concatenate(matrices))
+            self.segment_ids = np.concatenate(segment_ids)
+            self.rows = np.concatenate(rows)
+            self.blob_ids = np.concatenate(blob_keys)
+        else:
+            self.vectors = np.zeros((0, 0), dtype=np.float32)
+            self.segment_ids = np.zeros(0, dtype=np.int32)
+            self.rows = np.zeros(0, dtype=np.int64)
+            self.blob_ids = np.zeros(0, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every live row against query."""
+        query = np.asarray(query, dtype=np.float32)
+        return self.vectors @ (query / (np.linalg.norm(query) or 1.0))
+
+    def document(self, i: int) -> Dict:
+        return self.segments[int(self.segment_ids[i])].document(int(self.rows[i]))
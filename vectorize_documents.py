@@ -1,17 +1,21 @@
 import os
+import argparse
 from azure.storage.blob import BlobServiceClient
 from openai import AzureOpenAI
 from dotenv import load_dotenv
 import numpy as np
 from tqdm import tqdm
 import json
-from datetime import datetime
-import PyPDF2
-import io
-from pptx import Presentation
-from docx import Document
-from PIL import Image
-import pytesseract
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from text_extraction import extract_text, iter_document_units, open_blob_stream, SPOOL_MAX_BYTES
+from chunking import TokenChunker
+from ingest_pipeline import IngestPipeline
+from embedding_client import BatchEmbeddingClient
+from embedding_cache import EmbeddingCache
+from blob_manifest import BlobManifest
+from vector_store import VectorStore
+from ann_index import IVFPQIndex
 
 class DocumentVectorizer:
     def __init__(self):
@@ -33,193 +37,387 @@ class DocumentVectorizer:
         # Embedding model name
         self.embedding_model = "text-embedding-ada-002"
         
+        # Persistent embedding cache shared with the indexer and retriever
+        self.embedding_cache = EmbeddingCache()
+        
+        # Batched, concurrent embedding client used for ingest
+        self.embedding_client = BatchEmbeddingClient(
+            self.openai_client,
+            self.embedding_model,
+            max_in_flight=int(os.getenv('EMBEDDING_MAX_IN_FLIGHT', '8')),
+            cache=self.embedding_cache
+        )
+        
+        # Number of pending chunks handed to the embedding client at once; it splits them
+        # into small requests, so a flush fills max_in_flight
+        self.embedding_flush_size = int(os.getenv('EMBEDDING_FLUSH_SIZE', '256'))
+        
+        # Flushes embedded in the background while extraction continues; beyond this
+        # many queued, extraction waits so pending chunks stay bounded
+        self.max_queued_flushes = 2
+        
+        # Downloads larger than this are spooled to a temporary file
+        self.spool_max_bytes = SPOOL_MAX_BYTES
+        
+        # Token-aware chunker shared with index_blob_docs
+        self.chunker = TokenChunker()
+        
+        # Parallel download and extraction; INGEST_EXTRACT_WORKERS=0 keeps the serial streaming path
+        self.ingest_pipeline = None
+        if os.getenv('INGEST_EXTRACT_WORKERS') != '0':
+            self.ingest_pipeline = IngestPipeline.from_env(chunker=self.chunker)
+        
         # Create vectors directory if it doesn't exist
         self.vectors_dir = "vectors"
         os.makedirs(self.vectors_dir, exist_ok=True)
+        
+        # Storage precision of the vector store ('float32' or 'float16')
+        self.vector_dtype = os.getenv('VECTOR_DTYPE', 'float32')
+        
+        # Compact a container's store once it has this many segments
+        self.max_segments = 8
+        
+        # Build an IVF-PQ index next to stores with at least this many chunks
+        self.ann_min_rows = int(os.getenv('ANN_MIN_ROWS', '50000'))
 
     def get_embedding(self, text):
         """Get embedding for a single text using Azure OpenAI."""
+        cached = self.embedding_cache.get(self.embedding_model, text)
+        if cached is not None:
+            return cached
         try:
             response = self.openai_client.embeddings.create(
                 input=text,
                 model=self.embedding_model
             )
+            self.embedding_cache.put(self.embedding_model, text, response.data[0].embedding)
             return response.data[0].embedding
         except Exception as e:
             print(f"Error getting embedding: {str(e)}")
             return None
 
-    def extract_text_from_pdf(self, pdf_bytes):
-        """Extract text from PDF bytes."""
+    def _extract(self, kind, blob_name, content):
         try:
-            pdf_file = io.BytesIO(pdf_bytes)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            text = ""
-            
-            # Extract text from each page
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            
-            return text.strip()
+            return extract_text(blob_name, content)
         except Exception as e:
-            print(f"Error extracting text from PDF: {str(e)}")
+            print(f"Error extracting text from {kind}: {str(e)}")
             return None
 
+    def extract_text_from_pdf(self, pdf_bytes):
+        """Extract text from PDF bytes."""
+        return self._extract("PDF", "document.pdf", pdf_bytes)
+
     def extract_text_from_pptx(self, pptx_bytes):
         """Extract text from PPTX bytes."""
-        try:
-            pptx_file = io.BytesIO(pptx_bytes)
-            prs = Presentation(pptx_file)
-            text = ""
-            
-            # Extract text from each slide
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        text += shape.text + "\n"
-            
-            return text.strip()
-        except Exception as e:
-            print(f"Error extracting text from PPTX: {str(e)}")
-            return None
+        return self._extract("PPTX", "document.pptx", pptx_bytes)
 
     def extract_text_from_docx(self, docx_bytes):
-        try:
-            docx_file = io.BytesIO(docx_bytes)
-            doc = Document(docx_file)
-            text = "\n".join([para.text for para in doc.paragraphs])
-            return text.strip()
-        except Exception as e:
-            print(f"Error extracting text from DOCX: {str(e)}")
-            return None
+        return self._extract("DOCX", "document.docx", docx_bytes)
 
     def extract_text_from_image(self, image_bytes):
+        return self._extract("image", "image.png", image_bytes)
+
+    def open_blob_stream(self, blob_client):
+        """Download a blob into a spooled file that only spills to disk when large."""
+        return open_blob_stream(blob_client, self.spool_max_bytes)
+
+    def iter_blob_chunks(self, blob_client):
+        """Yield chunks of a blob as its pages or slides are extracted.
+
+        Errors are printed and re-raised, since chunks already yielded for the
+        blob are only part of it.
+        """
         try:
-            image = Image.open(io.BytesIO(image_bytes))
-            text = pytesseract.image_to_string(image)
-            return text.strip()
+            with self.open_blob_stream(blob_client) as stream:
+                units = iter_document_units(blob_client.blob_name, stream)
+                yield from self.chunker.chunk_units(units)
+        except UnicodeDecodeError:
+            print(f"Warning: Could not decode {blob_client.blob_name} as text. Skipping.")
+            raise
         except Exception as e:
-            print(f"Error extracting text from image: {str(e)}")
-            return None
+            print(f"Error reading blob {blob_client.blob_name}: {str(e)}")
+            raise
 
     def read_blob_content(self, blob_client):
         """Read content from a blob."""
         try:
-            dow_stream = blob_client.download_blob()
-            content = dow_stream.readall()
-            name = blob_client.blob_name.lower()
-            if name.endswith('.pdf'):
-                return self.extract_text_from_pdf(content)
-            elif name.endswith('.pptx'):
-                return self.extract_text_from_pptx(content)
-            elif name.endswith('.docx'):
-                return self.extract_text_from_docx(content)
-            elif name.endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.webp')):
-                return self.extract_text_from_image(content)
-            else:
-                try:
-                    return content.decode('utf-8')
-                except UnicodeDecodeError:
-                    print(f"Warning: Could not decode {blob_client.blob_name} as text. Skipping.")
-                    return None
+            with self.open_blob_stream(blob_client) as stream:
+                units = iter_document_units(blob_client.blob_name, stream)
+                return "\n".join(text for _, text in units).strip()
+        except UnicodeDecodeError:
+            print(f"Warning: Could not decode {blob_client.blob_name} as text. Skipping.")
+            return None
         except Exception as e:
             print(f"Error reading blob {blob_client.blob_name}: {str(e)}")
             return None
 
-    def split_text(self, text, max_chunk_size=2000):
-        """Split text into chunks of max_chunk_size characters."""
-        return [text[i:i+max_chunk_size] for i in range(0, len(text), max_chunk_size)]
+    def embed_documents(self, documents):
+        """Embed a list of chunk records in batches, dropping chunks that failed."""
+        embeddings = self.embedding_client.embed([doc['content'] for doc in documents])
+        embedded = []
+        for doc, embedding in zip(documents, embeddings):
+            if not embedding:
+                continue
+            # float32 arrays are ~8x smaller than lists of Python floats
+            doc['embedding'] = np.asarray(embedding, dtype=np.float32)
+            embedded.append(doc)
+        return embedded
+
+    def split_text(self, text):
+        """Split text into token-bounded chunks along paragraph and sentence boundaries."""
+        return [chunk['text'] for chunk in self.chunker.chunk_text(text)]
+
+    def is_supported_blob(self, blob_name):
+        """Only PDF and PPTX files are vectorized."""
+        return blob_name.lower().endswith(('.pdf', '.pptx'))
 
-    def process_container(self, container_name):
-        """Process all documents in a container."""
+    def process_container(self, container_name, blob_list=None):
+        """Process all documents in a container, or only the given blobs."""
         print(f"\nProcessing container: {container_name}")
         
         # Get container client
         container_client = self.blob_service_client.get_container_client(container_name)
         
         # List all blobs in the container
-        blob_list = list(container_client.list_blobs())
+        if blob_list is None:
+            blob_list = list(container_client.list_blobs())
         
         # Create a list to store document data
         documents = []
+        # Chunks waiting to be embedded, and flushes being embedded in the background
+        pending = []
+        flushes = deque()
+        flush_executor = ThreadPoolExecutor(max_workers=1)
+        # Blobs that failed partway; their chunks are dropped so the manifest retries them
+        failed = set()
         
-        # Process each blob
-        for blob in tqdm(blob_list, desc="Processing documents"):
-            # Skip non-PDF and non-PPTX files
-            if not (blob.name.lower().endswith('.pdf') or blob.name.lower().endswith('.pptx')):
-                continue
-                
-            blob_client = container_client.get_blob_client(blob.name)
-            
-            # Read blob content
-            content = self.read_blob_content(blob_client)
-            if not content:
-                continue
-            
-            # Split content into chunks
-            chunks = self.split_text(content, max_chunk_size=2000)
+        def flush():
+            nonlocal pending
+            flushes.append(flush_executor.submit(self.embed_documents, pending))
+            pending = []
+            while len(flushes) > self.max_queued_flushes:
+                documents.extend(flushes.popleft().result())
+        
+        def add_chunks(blob, chunks):
+            nonlocal pending
+            blob_records = []
             for chunk_idx, chunk in enumerate(chunks):
-                # Get embedding
-                embedding = self.get_embedding(chunk)
-                if not embedding:
-                    continue
-                # Store document data for each chunk
-                documents.append({
+                # Store document data for each chunk, embedding is filled in on flush
+                record = {
                     'blob_name': blob.name,
                     'container': container_name,
-                    'content': chunk,
-                    'embedding': embedding,
+                    'content': chunk['text'],
+                    'embedding': None,
                     'last_modified': blob.last_modified.isoformat(),
                     'size': blob.size,
                     'chunk_index': chunk_idx,
-                    'num_chunks': len(chunks)
-                })
+                    'page_start': chunk['page_start'],
+                    'page_end': chunk['page_end'],
+                    'start_offset': chunk['start_offset']
+                }
+                pending.append(record)
+                blob_records.append(record)
+                
+                if len(pending) >= self.embedding_flush_size:
+                    flush()
+            
+            for record in blob_records:
+                record['num_chunks'] = len(blob_records)
+        
+        # Skip non-PDF and non-PPTX files
+        blob_list = [blob for blob in blob_list if self.is_supported_blob(blob.name)]
+        
+        try:
+            if self.ingest_pipeline is not None:
+                # Downloads and extraction run ahead in worker pools; embedding happens here
+                results = self.ingest_pipeline.run(container_client, blob_list)
+                for blob, chunks in tqdm(results, total=len(blob_list), desc="Processing documents"):
+                    add_chunks(blob, chunks)
+            else:
+                # Process each blob, streaming chunks as pages are extracted
+                for blob in tqdm(blob_list, desc="Processing documents"):
+                    blob_client = container_client.get_blob_client(blob.name)
+                    try:
+                        add_chunks(blob, self.iter_blob_chunks(blob_client))
+                    except Exception:
+                        failed.add(blob.name)
+            
+            if pending:
+                flush()
+            while flushes:
+                documents.extend(flushes.popleft().result())
+        finally:
+            # On error, drop queued flushes rather than embedding them
+            flush_executor.shutdown(wait=True, cancel_futures=True)
+        
+        if failed:
+            documents = [doc for doc in documents if doc['blob_name'] not in failed]
         
         return documents
 
-    def save_vectors(self, documents, container_name):
-        """Save vectors and metadata to files."""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    def get_vector_store(self, container_name):
+        """Open the segment-based vector store for a container."""
+        return VectorStore(os.path.join(self.vectors_dir, container_name), dtype=self.vector_dtype)
+
+    def save_vectors(self, documents, container_name, tombstones=(), replace=True):
+        """Write vectors, metadata and chunk text to the container's vector store.
+
+        A full run replaces the store; an incremental run appends a segment
+        and tombstones the blobs it supersedes.
+        """
+        store = self.get_vector_store(container_name)
+        store.apply_delta(documents, tombstones=tombstones, replace=replace)
+        return store
+
+    def load_latest_vectors(self, container_name):
+        """Load the most recent legacy npy/json snapshot as chunk records."""
+        vector_files = sorted(
+            f for f in os.listdir(self.vectors_dir)
+            if f.startswith(f"{container_name}_embeddings_") and f.endswith('.npy')
+        )
+        if not vector_files:
+            return None
+        latest_vector_file = vector_files[-1]
+        latest_metadata_file = latest_vector_file.replace('embeddings_', 'metadata_').replace('.npy', '.json')
+        embeddings = np.load(os.path.join(self.vectors_dir, latest_vector_file))
+        with open(os.path.join(self.vectors_dir, latest_metadata_file), 'r') as f:
+            metadata = json.load(f)
+        return [{**meta, 'embedding': embedding} for meta, embedding in zip(metadata, embeddings)]
+
+    def compact_container(self, container_name, force=False):
+        """Merge a container's segments when there are too many or too many dead rows."""
+        store = self.get_vector_store(container_name)
+        segments = len(store.read_manifest()['segments'])
+        if force or segments > self.max_segments or (segments > 1 and store.dead_fraction() > 0.3):
+            store.compact()
+
+    def build_ann_index(self, container_name, retrain=False):
+        """Build or refresh the container's approximate-nearest-neighbour index.
+
+        Incremental refreshes re-encode rows with the existing quantizers
+        instead of re-training them.
+        """
+        store = self.get_vector_store(container_name)
+        rows = sum(info['count'] for info in store.read_manifest()['segments'])
+        if rows < self.ann_min_rows:
+            return None
+        trained = None
+        if not retrain and IVFPQIndex.exists(store):
+            try:
+                trained = IVFPQIndex(store)
+            except Exception as e:
+                print(f"Error loading ANN index for {container_name}: {str(e)}. Retraining.")
+        return IVFPQIndex.build(store, trained=trained)
+
+    def manifest_path(self, container_name):
+        return os.path.join(self.vectors_dir, f"{container_name}_manifest.json")
+
+    def vectorize_container_incremental(self, container_name):
+        """Re-vectorize only blobs that were added or changed since the last run.
+
+        Blobs are compared with the container's manifest by etag, size and
+        last_modified. Chunks of changed and deleted blobs are tombstoned and
+        the delta is appended to the vector store as a new segment.
+        """
+        manifest = BlobManifest(self.manifest_path(container_name))
+        store = self.get_vector_store(container_name)
+        if store.is_empty():
+            # Carry over a legacy snapshot so its blobs are not re-embedded
+            legacy = self.load_latest_vectors(container_name)
+            if legacy:
+                print(f"Importing {len(legacy)} chunks from legacy snapshot for {container_name}")
+                store.apply_delta(legacy, replace=True)
+            else:
+                # Nothing to apply a delta to, so start from an empty store
+                manifest.entries = {}
+        
+        container_client = self.blob_service_client.get_container_client(container_name)
+        blobs = [b for b in container_client.list_blobs() if self.is_supported_blob(b.name)]
+        added, changed, deleted = manifest.diff(blobs)
+        print(f"\nContainer {container_name}: {len(added)} added, {len(changed)} changed, "
+              f"{len(deleted)} deleted, {len(blobs) - len(added) - len(changed)} unchanged")
+        if not (added or changed or deleted):
+            return 0
         
-        # Save embeddings as numpy array
-        embeddings = np.array([doc['embedding'] for doc in documents])
-        np.save(f"{self.vectors_dir}/{container_name}_embeddings_{timestamp}.npy", embeddings)
+        # Tombstone every chunk that belongs to a changed or deleted blob; added
+        # blobs are included in case the store predates the manifest
+        tombstoned = {b.name for b in added + changed} | set(deleted)
         
-        # Save metadata as JSON with content
-        metadata = [{
-            'blob_name': doc['blob_name'],
-            'container': doc['container'],
-            'last_modified': doc['last_modified'],
-            'size': doc['size'],
-            'content': doc['content']  # Store the content for snippet generation
-        } for doc in documents]
+        new_documents = self.process_container(container_name, added + changed) if (added or changed) else []
         
-        with open(f"{self.vectors_dir}/{container_name}_metadata_{timestamp}.json", 'w') as f:
-            json.dump(metadata, f, indent=2)
+        self.save_vectors(new_documents, container_name, tombstones=tombstoned, replace=False)
+        self.compact_container(container_name)
+        self.build_ann_index(container_name)
+        
+        # Only record blobs that produced chunks so failed ones are retried next run
+        processed = {doc['blob_name'] for doc in new_documents}
+        for blob in added + changed:
+            if blob.name in processed:
+                manifest.update(blob)
+            else:
+                manifest.remove(blob.name)
+        for name in deleted:
+            manifest.remove(name)
+        manifest.save()
+        
+        print(f"Applied delta to {container_name}: {len(tombstoned)} blobs tombstoned, "
+              f"{len(new_documents)} chunks added")
+        return len(new_documents)
 
-    def vectorize_all_containers(self):
+    def vectorize_all_containers(self, incremental=False):
         """Process all containers and create vector embeddings."""
         try:
             # List all containers
             containers = self.blob_service_client.list_containers()
             
             for container in containers:
+                if incremental:
+                    self.vectorize_container_incremental(container.name)
+                    continue
+                
                 # Process container
-                documents = self.process_container(container.name)
+                container_client = self.blob_service_client.get_container_client(container.name)
+                blob_list = list(container_client.list_blobs())
+                documents = self.process_container(container.name, blob_list)
                 
                 if documents:
                     # Save vectors and metadata
                     self.save_vectors(documents, container.name)
+                    
+                    # Record what was vectorized so later runs can be incremental
+                    manifest = BlobManifest(self.manifest_path(container.name))
+                    manifest.entries = {}
+                    processed = {doc['blob_name'] for doc in documents}
+                    for blob in blob_list:
+                        if blob.name in processed:
+                            manifest.update(blob)
+                    manifest.save()
+                    self.build_ann_index(container.name, retrain=True)
                     print(f"Successfully processed {len(documents)} documents in container {container.name}")
                 else:
                     print(f"No documents were processed in container {container.name}")
+            
+            stats = self.embedding_cache.stats()
+            print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
                 
         except Exception as e:
             print(f"Error during vectorization: {str(e)}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Vectorize documents in Azure Blob Storage")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only process blobs added or changed since the last run")
+    parser.add_argument('--compact', action='store_true',
+                        help="merge each container's vector store segments and exit")
+    args = parser.parse_args()
+    
     vectorizer = DocumentVectorizer()
-    vectorizer.vectorize_all_containers()
+    if args.compact:
+        for container in vectorizer.blob_service_client.list_containers():
+            vectorizer.compact_container(container.name, force=True)
+            vectorizer.build_ann_index(container.name)
+        return
+    vectorizer.vectorize_all_containers(incremental=args.incremental)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file